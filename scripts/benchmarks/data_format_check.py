@@ -0,0 +1,92 @@
+import json
+import os
+import sys
+import tempfile
+from datetime import date
+import pandas as pd
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARK_DIR, '..', 'metlife_classifier'))
+sys.path.insert(0, os.path.join(BENCHMARK_DIR, '..', 'edi_parsing'))
+from feature_extraction_utilities import build_set, build_set_chunked, read_table, train_feature_impute
+from edi_stream_utilities import is_clean_metlife_response
+from metlife_edi_html_parser import ParsedRecordBuilder, clean_blanks, parse_lines, write_parsed
+import metlife_parsing_utilities as mpu
+from synthetic_edi_utilities import synthetic_data
+
+
+# Number of synthetic records from the OF REST API
+N_RECORDS = 5000
+# Formats of the parsed HTML data compared with csv
+FORMATS = ['parquet', 'feather']
+# Date patient ages are calculated at, fixed so the formats are comparable
+AS_OF = date(2017, 4, 17)
+SEED = 0
+
+
+def parse_records(records):
+    """ Parse the clean MetLife responses of synthetic records, as
+    metlife_edi_cleaner and metlife_edi_html_parser do.
+
+    Args:
+        records (list of dicts): records from the OF REST API.
+
+    Returns:
+        Pandas DataFrame object - the parsed MetLife records
+    """
+    parsed = ParsedRecordBuilder()
+    lines = (
+        json.dumps(datum) for datum in records if is_clean_metlife_response(datum)
+    )
+    for patient_id, values, path in parse_lines(lines):
+        if values is not None and mpu.is_metlife(values):
+            parsed.add(values)
+    df = parsed.to_frame()
+    clean_blanks(df)
+    return df
+
+
+def assert_same_values(df, expected):
+    """ Check that two frames hold the same values in the same columns,
+    ignoring the integer / float types of the ids. """
+    pd.testing.assert_frame_equal(
+        df.reset_index(drop=True), expected.reset_index(drop=True),
+        check_dtype=False
+    )
+
+
+if __name__ == '__main__':
+    records, df_sql = synthetic_data(N_RECORDS, seed=SEED)
+    df_parsed = parse_records(records)
+    print('Parsed', len(df_parsed), 'MetLife records')
+
+    with tempfile.TemporaryDirectory() as directory:
+        sql_file = os.path.join(directory, 'sql.csv')
+        df_sql.to_csv(sql_file, index=False)
+
+        csv_file = os.path.join(directory, 'parsed.csv')
+        write_parsed(df_parsed, csv_file)
+        df_joined = build_set(sql_file, csv_file)
+        df_train = train_feature_impute(df_joined.copy(), as_of=AS_OF)
+        chunked_file = os.path.join(directory, 'joined_csv.csv')
+        build_set_chunked(sql_file, csv_file, chunked_file)
+        df_chunked = read_table(chunked_file, low_memory=False)
+
+        for data_format in FORMATS:
+            html_file = os.path.join(directory, 'parsed.' + data_format)
+            write_parsed(df_parsed, html_file)
+
+            # The joined data and the cleaned training data are the same
+            # whatever format the parsed data was written in
+            df_joined_typed = build_set(sql_file, html_file)
+            assert_same_values(df_joined_typed, df_joined)
+            assert_same_values(
+                train_feature_impute(df_joined_typed, as_of=AS_OF), df_train
+            )
+
+            joined_file = os.path.join(directory, 'joined_' + data_format + '.csv')
+            build_set_chunked(sql_file, html_file, joined_file)
+            assert_same_values(read_table(joined_file, low_memory=False), df_chunked)
+
+            print(data_format, 'matches csv:', df_joined.shape, 'joined,',
+                  df_train.shape, 'cleaned')
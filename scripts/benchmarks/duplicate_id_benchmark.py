@@ -0,0 +1,144 @@
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+import numpy as np
+import pandas as pd
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'metlife_classifier')
+)
+from Metlife_Classifier_v0_zach import build_set
+
+
+# Number of records in the synthetic parsed HTML data
+N_RECORDS = 20000
+# Fractions of the patient IDs that occur twice and three times
+PAIR_FRACTION = 0.2
+TRIPLE_FRACTION = 0.1
+# Fraction of records with no InsurancePolicyPatientEligibilityId
+NULL_FRACTION = 0.02
+SEED = 0
+
+KEY = 'InsurancePolicyPatientEligibilityId'
+NETWORK_PREFIXES = ['LifetimeMax', 'LifetimeRemaining', 'LifetimeUsed', 'CoIns']
+
+
+def synthetic_data(n_records, seed=SEED):
+    """ Build synthetic parsed HTML and SQL data in which some patient IDs
+    occur twice or three times, spread through the HTML data rather than
+    next to each other.
+
+    Args:
+        n_records (int): the number of parsed HTML records.
+
+    Keyword Arguments:
+        seed (int): the random seed.
+
+    Returns:
+        Tuple of the parsed HTML and SQL Pandas DataFrame objects
+    """
+    rng = np.random.RandomState(seed)
+
+    n_triples = int(n_records * TRIPLE_FRACTION / 3)
+    n_pairs = int(n_records * PAIR_FRACTION / 2)
+    n_single = n_records - 3 * n_triples - 2 * n_pairs
+    ids = np.concatenate([
+        np.repeat(np.arange(n_triples), 3),
+        np.repeat(np.arange(n_triples, n_triples + n_pairs), 2),
+        np.arange(n_triples + n_pairs, n_triples + n_pairs + n_single)
+    ]).astype('float64') + 1000
+    rng.shuffle(ids)
+    ids[rng.random_sample(n_records) < NULL_FRACTION] = np.nan
+
+    df_html = pd.DataFrame({KEY: ids, 'CarrierName': 'MetLife'})
+    for prefix in NETWORK_PREFIXES:
+        for network in ['InNetwork', 'OutNetwork']:
+            values = rng.randint(0, 5000, n_records)
+            if prefix == 'CoIns':
+                df_html[prefix + '_' + network] = values / 5000
+            else:
+                # The HTML has comma separated dollar amounts
+                df_html[prefix + '_' + network] = ['{:,}'.format(v) for v in values]
+    # Tells the duplicated records of an ID apart
+    df_html['Record'] = np.arange(n_records)
+
+    unique_ids = np.unique(ids[~np.isnan(ids)])
+    df_sql = pd.DataFrame({
+        KEY: unique_ids,
+        'IsInNetwork': rng.randint(0, 2, len(unique_ids)),
+        'PatientDateOfBirth': '01/01/1980'
+    })
+
+    return df_html, df_sql
+
+
+def drop_duplicate_ids_counter(df_html):
+    """ The previous Counter based removal of duplicated patient IDs from
+    build_set. """
+    patientID = df_html[KEY]
+    patientIDcnt = Counter(patientID)
+
+    patcntlist = list(patientIDcnt.values())
+    dupIDindex = [i for i in range(len(patcntlist)) if patcntlist[i] > 1]
+
+    IDlist = list(patientIDcnt.keys())
+    dupIDlist = [IDlist[i] for i in dupIDindex]
+
+    duplicate = pd.DataFrame()
+    for i in range(len(dupIDlist)):
+        loopdata = df_html.loc[lambda df: df[KEY] == dupIDlist[i]]
+        duplicate = pd.concat([duplicate, loopdata])
+
+    dropind = [duplicate.index[i] for i in range(len(duplicate))]
+
+    for i in range(len(dropind)):
+        df_html.drop(dropind[i], inplace=True)
+
+
+def drop_duplicate_ids_mask(df_html):
+    """ The removal of duplicated patient IDs used by build_set. """
+    return df_html[~df_html[KEY].duplicated(keep=False)]
+
+
+if __name__ == '__main__':
+    df_html, df_sql = synthetic_data(N_RECORDS)
+    df_html = df_html[df_html[KEY].notnull()]
+    print('Synthetic HTML data:', len(df_html), 'records with IDs,',
+          int(df_html[KEY].duplicated(keep=False).sum()), 'of them duplicated')
+
+    df_counter = df_html.copy()
+    t1 = time.time()
+    drop_duplicate_ids_counter(df_counter)
+    t_counter = time.time() - t1
+    print('Counter: {:.3f} seconds'.format(t_counter))
+
+    t1 = time.time()
+    df_mask = drop_duplicate_ids_mask(df_html)
+    t_mask = time.time() - t1
+    print('mask:    {:.3f} seconds'.format(t_mask))
+
+    # Both keep the same records, with the same index labels
+    pd.testing.assert_frame_equal(df_mask, df_counter)
+    print('speedup: {:.0f}x'.format(t_counter / t_mask))
+
+    # build_set gives the same joined data whether it is given the raw
+    # records or the ones the Counter implementation kept
+    with tempfile.TemporaryDirectory() as directory:
+        html_file = os.path.join(directory, 'html.csv')
+        deduplicated_html_file = os.path.join(directory, 'html_deduplicated.csv')
+        sql_file = os.path.join(directory, 'sql.csv')
+
+        df_raw, df_sql = synthetic_data(N_RECORDS)
+        df_raw.to_csv(html_file, index=False)
+        df_sql.to_csv(sql_file, index=False)
+        df_counter = df_raw[df_raw[KEY].notnull()].copy()
+        drop_duplicate_ids_counter(df_counter)
+        df_counter.to_csv(deduplicated_html_file, index=False)
+
+        pd.testing.assert_frame_equal(
+            build_set(sql_file, html_file),
+            build_set(sql_file, deduplicated_html_file)
+        )
+    print('build_set output matches the Counter implementation')
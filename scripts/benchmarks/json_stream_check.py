@@ -0,0 +1,65 @@
+import io
+import json
+import os
+import sys
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'edi_parsing')
+)
+from edi_stream_utilities import iter_json_array
+
+
+# Read chunk sizes tried for every array, so elements are split at every
+# position
+CHUNK_SIZES = list(range(1, 41)) + [1 << 16]
+
+ARRAYS = {
+    'numbers': [1.5, 2, 300, -1.25e-3, 1E10, 0, -7, 3.14159, 12345678901234567890],
+    'strings': ['a', 'b,c', 'with space', '', 'quoted "]"', 'ünïcode'],
+    'objects': [
+        {'a': [1, {'b': None}], 'c': 2.5},
+        {},
+        [],
+        True,
+        False,
+        None,
+        {'HtmlResponse': '<table id="payerTable"></table>' * 5,
+         'InsurancePolicyPatientEligibilityId': 1001,
+         'InsuranceEligibilityAuditId': 5000001}
+    ],
+    'empty': [],
+}
+
+# Truncated or malformed arrays, which must raise a ValueError
+INVALID = ['', '{}', '[1.5, 2', '[1 2]', '[1.]', '["a" "b"]', '[1,]']
+
+
+def decode(text, chunk_size):
+    """ Decode a JSON array with iter_json_array, reading chunk_size
+    characters at a time. """
+    return list(iter_json_array(io.StringIO(text), chunk_size=chunk_size))
+
+
+if __name__ == '__main__':
+    n_checks = 0
+    for name, array in ARRAYS.items():
+        for text in [json.dumps(array),
+                     json.dumps(array, indent=2),
+                     json.dumps(array, separators=(',', ':'))]:
+            for chunk_size in CHUNK_SIZES:
+                decoded = decode(text, chunk_size)
+                assert decoded == array, (name, chunk_size, decoded)
+                n_checks += 1
+
+    for text in INVALID:
+        for chunk_size in CHUNK_SIZES:
+            try:
+                decode(text, chunk_size)
+            except ValueError:
+                n_checks += 1
+            else:
+                raise AssertionError('{!r} decoded with chunk size {}'.format(
+                    text, chunk_size
+                ))
+
+    print('iter_json_array passed', n_checks, 'checks')
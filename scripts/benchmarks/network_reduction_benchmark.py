@@ -0,0 +1,86 @@
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'metlife_classifier')
+)
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'edi_parsing')
+)
+from feature_extraction_utilities import NETWORK_COLUMNS, reduce_network_values
+
+
+# Number of rows in the synthetic joined dataset
+N_ROWS = 1000000
+# Fraction of null values in each column
+NULL_FRACTION = 0.1
+SEED = 0
+
+
+def synthetic_join(n_rows, null_fraction=NULL_FRACTION, seed=SEED):
+    """ Build a synthetic joined dataset with the columns used by the
+    in/out-of-network reduction.
+
+    Args:
+        n_rows (int): the number of rows.
+
+    Keyword Arguments:
+        null_fraction (float): the fraction of null values in each column.
+        seed (int): the random seed.
+
+    Returns:
+        Pandas DataFrame object - the synthetic data.
+    """
+    rng = np.random.RandomState(seed)
+
+    def with_nulls(values):
+        values = values.astype('float64')
+        values[rng.random_sample(n_rows) < null_fraction] = np.nan
+        return values
+
+    df = pd.DataFrame({
+        'IsInNetwork': with_nulls(rng.randint(0, 2, n_rows)),
+    })
+    for prefix in NETWORK_COLUMNS.values():
+        scale = 1 if prefix == 'CoIns' else 2500
+        df[prefix + '_InNetwork'] = with_nulls(rng.random_sample(n_rows) * scale)
+        df[prefix + '_OutNetwork'] = with_nulls(rng.random_sample(n_rows) * scale)
+
+    return df
+
+
+def reduce_network_values_iterrows(df):
+    """ The previous row by row implementation of reduce_network_values. """
+    for column, prefix in NETWORK_COLUMNS.items():
+        df[column] = [
+            row[prefix + '_OutNetwork']
+            if row['IsInNetwork'] == 0
+            else row[prefix + '_InNetwork']
+            for index, row in df.iterrows()
+        ]
+
+
+if __name__ == '__main__':
+    df = synthetic_join(N_ROWS)
+    print('Synthetic join:', N_ROWS, 'rows')
+
+    df_vectorized = df.copy()
+    t1 = time.time()
+    reduce_network_values(df_vectorized)
+    t_vectorized = time.time() - t1
+    print('vectorized: {:.3f} seconds'.format(t_vectorized))
+
+    df_iterrows = df.copy()
+    t1 = time.time()
+    reduce_network_values_iterrows(df_iterrows)
+    t_iterrows = time.time() - t1
+    print('iterrows:   {:.3f} seconds'.format(t_iterrows))
+
+    # Check that both give the same values, including nulls
+    for column in NETWORK_COLUMNS:
+        pd.testing.assert_series_equal(df_vectorized[column], df_iterrows[column])
+
+    print('speedup: {:.0f}x'.format(t_iterrows / t_vectorized))
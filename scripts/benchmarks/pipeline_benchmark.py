@@ -0,0 +1,274 @@
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARK_DIR, '..', 'metlife_classifier'))
+sys.path.insert(0, os.path.join(BENCHMARK_DIR, '..', 'edi_parsing'))
+from classifier_utilities import fit_extra_trees, peak_memory_mb, predict_with_exclusions
+from feature_extraction_utilities import build_set, FeaturePipeline, NON_FEATURE_COLUMNS, read_table, write_table
+from model_artifact_utilities import CompactForest
+from edi_stream_utilities import iter_json_array, is_clean_metlife_response
+from metlife_edi_html_parser import ParsedRecordBuilder, clean_blanks, parse_lines
+import metlife_parsing_utilities as mpu
+from synthetic_edi_utilities import write_synthetic_data
+
+
+# Numbers of synthetic records from the OF REST API to run the pipeline on
+SCALES = [1000, 10000, 100000]
+# Stages of the pipeline, in the order they run
+STAGES = ['clean', 'parse', 'build_set', 'impute', 'train', 'predict']
+# Html parsing backend, one of 'bs4', 'lxml' or 'regex'
+# (see mpu.parse_edi_response)
+BACKEND = 'bs4'
+# Number of trees in the benchmarked forest
+N_ESTIMATORS = 100
+# Number of cores used to train the forest
+N_JOBS = 1
+# Date patient ages are calculated at, fixed so runs are comparable
+AS_OF = date(2017, 4, 17)
+SEED = 0
+
+# Directory the results are written to, one JSON file per run
+RESULTS_DIR = os.path.join(BENCHMARK_DIR, 'results')
+# Results of an earlier run to compare this run with, e.g.
+# os.path.join(RESULTS_DIR, '<file>.json'). None skips the comparison.
+COMPARE_WITH = None
+
+
+def stage_paths(directory, n):
+    """ Get the files each stage of a benchmark run reads and writes.
+
+    Args:
+        directory (str): the working directory of the run.
+        n (int): the number of synthetic records.
+
+    Returns:
+        Dictionary of file paths
+    """
+    def path(name):
+        return os.path.join(directory, name.format(n))
+
+    return {
+        'edi_file': path('edi_html_synthetic_{}.txt'),
+        'sql_file': path('sql_synthetic_{}.csv'),
+        'cleaned_file': path('metlife_cleaned_synthetic_{}.txt'),
+        'html_file': path('metlife_parsed_synthetic_{}.csv'),
+        'joined_file': path('joined_synthetic_{}.csv'),
+        'train_file': path('train_synthetic_{}.csv'),
+        'feature_pipeline_file': path('features_synthetic_{}.json'),
+        'model_dir': path('model_synthetic_{}_compact'),
+    }
+
+
+def clean(paths):
+    """ Keep the MetLife responses without errors, as metlife_edi_cleaner
+    does. """
+    n_read = 0
+    with open(paths['edi_file']) as f, open(paths['cleaned_file'], 'w') as out:
+        for datum in iter_json_array(f):
+            n_read += 1
+            if is_clean_metlife_response(datum):
+                out.write(json.dumps(datum, ensure_ascii=False) + '\n')
+    return n_read
+
+
+def parse(paths):
+    """ Parse the html of the MetLife responses, as metlife_edi_html_parser
+    does. """
+    records = ParsedRecordBuilder()
+    n_read = 0
+    with open(paths['cleaned_file']) as f:
+        lines = (line for line in f if line.strip())
+        for patient_id, values, path in parse_lines(lines, backend=BACKEND):
+            n_read += 1
+            if values is not None and mpu.is_metlife(values):
+                records.add(values)
+    df = records.to_frame()
+    clean_blanks(df)
+    df.to_csv(paths['html_file'], index=False)
+    return n_read
+
+
+def join(paths):
+    """ Join the parsed html to the OF SQL data with build_set. """
+    df = build_set(paths['sql_file'], paths['html_file'])
+    write_table(df, paths['joined_file'])
+    return len(df)
+
+
+def impute(paths):
+    """ Clean the training features with a new FeaturePipeline. """
+    df = read_table(paths['joined_file'], low_memory=False)
+    pipeline = FeaturePipeline()
+    train_df = pipeline.fit_transform(df, as_of=AS_OF)
+    pipeline.save(paths['feature_pipeline_file'])
+    write_table(train_df, paths['train_file'])
+    return len(df)
+
+
+def train(paths):
+    """ Train the ExtraTrees classifier and save its compact copy. """
+    train_df = read_table(paths['train_file'])
+    feature_columns = [
+        column
+        for column in train_df.columns
+        if column not in NON_FEATURE_COLUMNS
+    ]
+    clf, stages = fit_extra_trees(
+        train_df[feature_columns].values,
+        train_df['EDI_only'].values,
+        n_estimators=N_ESTIMATORS,
+        n_jobs=N_JOBS,
+        random_state=SEED
+    )
+    CompactForest.from_classifier(clf).save(
+        paths['model_dir'], feature_columns, 'synthetic'
+    )
+    return len(train_df)
+
+
+def predict(paths):
+    """ Clean the joined data with the fitted pipeline and predict, as
+    metlife_classifier_test does. """
+    df = read_table(paths['joined_file'], low_memory=False)
+    pipeline = FeaturePipeline.load(paths['feature_pipeline_file'])
+    test_df = pipeline.transform(df, as_of=AS_OF)
+    clf = CompactForest.load(paths['model_dir'])
+    predict_with_exclusions(clf, test_df, clf.manifest['feature_columns'])
+    return len(df)
+
+
+STAGE_FUNCTIONS = {
+    'clean': clean,
+    'parse': parse,
+    'build_set': join,
+    'impute': impute,
+    'train': train,
+    'predict': predict,
+}
+
+
+def run_stage(stage, paths):
+    """ Run and time a stage. Meant to be run in a fresh process, so the
+    peak memory is that of the stage alone.
+
+    Args:
+        stage (str): the stage, one of STAGES.
+        paths (dict): the files of the run, from stage_paths.
+
+    Returns:
+        Dictionary of the number of input records, the wall time in seconds,
+        the records per second, the resident memory of the process before
+        the stage and its peak during the stage, in megabytes
+    """
+    baseline = peak_memory_mb()
+    t1 = time.perf_counter()
+    n_records = STAGE_FUNCTIONS[stage](paths)
+    seconds = time.perf_counter() - t1
+    return {
+        'records': n_records,
+        'seconds': seconds,
+        'records_per_second': n_records / seconds if seconds else 0.0,
+        'baseline_rss_mb': baseline,
+        'peak_rss_mb': peak_memory_mb()
+    }
+
+
+def run_benchmark(n, directory, stages=STAGES):
+    """ Generate synthetic data and run each stage of the pipeline on it, in
+    its own process.
+
+    Args:
+        n (int): the number of synthetic records.
+        directory (str): the working directory for the data files.
+
+    Keyword Arguments:
+        stages (list of str): the stages to run, in order.
+
+    Returns:
+        Dictionary of the results of run_stage for each stage
+    """
+    paths = stage_paths(directory, n)
+    write_synthetic_data(directory, n, seed=SEED)
+
+    results = {}
+    context = multiprocessing.get_context('spawn')
+    for stage in stages:
+        with context.Pool(1) as pool:
+            results[stage] = pool.apply(run_stage, (stage, paths))
+        print('{:>7} records  {:<10} {seconds:8.2f} s  {records_per_second:10.1f} '
+              'records/s  peak RSS {peak_rss_mb:7.1f} MB'.format(
+                  n, stage, **results[stage]))
+    return results
+
+
+def git_commit():
+    """ Get the commit of the working tree, or None outside a git
+    repository. """
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=BENCHMARK_DIR,
+            stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare_results(old, new):
+    """ Print the change in time and peak memory of each stage between two
+    benchmark runs.
+
+    Args:
+        old (dict): the results of the earlier run.
+        new (dict): the results of this run.
+    """
+    print('Compared with', old.get('commit'), 'from', old.get('started'))
+    for n, stages in new['scales'].items():
+        for stage, result in stages.items():
+            before = old['scales'].get(n, {}).get(stage)
+            if before is None:
+                continue
+            print('{:>7} records  {:<10} time x{:.2f}  peak RSS x{:.2f}'.format(
+                n, stage,
+                result['seconds'] / before['seconds'],
+                result['peak_rss_mb'] / before['peak_rss_mb']
+            ))
+
+
+if __name__ == '__main__':
+    run = {
+        'commit': git_commit(),
+        'started': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'backend': BACKEND,
+        'n_estimators': N_ESTIMATORS,
+        'n_jobs': N_JOBS,
+        'scales': {}
+    }
+
+    for n in SCALES:
+        with tempfile.TemporaryDirectory() as directory:
+            run['scales'][str(n)] = run_benchmark(n, directory)
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    results_file = os.path.join(
+        RESULTS_DIR,
+        'pipeline_{}_{}.json'.format(
+            run['started'].replace(':', ''), (run['commit'] or 'nocommit')[:10]
+        )
+    )
+    with open(results_file, 'w') as f:
+        json.dump(run, f, indent=2)
+    print('Results written to', results_file)
+
+    if COMPARE_WITH is not None:
+        with open(COMPARE_WITH) as f:
+            compare_results(json.load(f), run)
@@ -0,0 +1,138 @@
+import http.client
+import json
+import os
+import sys
+import threading
+import time
+import numpy as np
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'metlife_classifier')
+)
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'edi_parsing')
+)
+from scoring_utilities import SQL_FIELDS_KEY, SqlLookup
+from edi_stream_utilities import iter_jsonl
+
+
+# Address of a running metlife_classifier_service.py
+HOST = '127.0.0.1'
+PORT = 8080
+# Number of clients sending requests at the same time
+CONCURRENCY = 16
+# Number of requests each client sends
+REQUESTS_PER_CLIENT = 200
+# Number of records read from the EDI file to build requests from
+N_RECORDS = 1000
+
+
+def load_requests(edi_file, sql_file, n_records=N_RECORDS):
+    """ Build scoring requests from cleaned EDI records, adding the OF SQL
+    fields of each check.
+
+    Args:
+        edi_file (str): the cleaned EDI responses, one JSON record per line.
+        sql_file (str): the filename containing the OF SQL data.
+
+    Keyword Arguments:
+        n_records (int): the number of records read.
+
+    Returns:
+        List of dicts - the requests
+    """
+    key = SqlLookup.key
+    lookup = SqlLookup(sql_file)
+    df_sql = lookup.data.set_index(lookup.index)
+    df_sql = df_sql[~df_sql.index.duplicated()]
+    # JSON has no NaN, so send missing values as null
+    df_sql = df_sql.astype(object).where(df_sql.notnull(), None)
+
+    requests = []
+    with open(edi_file) as f:
+        for datum in iter_jsonl(f):
+            if datum[key] in df_sql.index:
+                datum[SQL_FIELDS_KEY] = df_sql.loc[datum[key]].to_dict()
+            requests.append(datum)
+            if len(requests) >= n_records:
+                break
+    return requests
+
+
+def run_client(requests, offset, n_requests, latencies, errors,
+               host=HOST, port=PORT):
+    """ Send requests one after another over a single connection, recording
+    the latency of each.
+
+    Args:
+        requests (list of dicts): the requests to send, cycling through them.
+        offset (int): the position in requests to start at.
+        n_requests (int): the number of requests sent.
+        latencies (list): the latencies, in seconds, are appended to this.
+        errors (list): the failed responses are appended to this.
+    """
+    connection = http.client.HTTPConnection(host, port)
+    headers = {'Content-Type': 'application/json'}
+    for i in range(n_requests):
+        body = json.dumps(requests[(offset + i) % len(requests)])
+        t1 = time.perf_counter()
+        connection.request('POST', '/score', body, headers)
+        response = connection.getresponse()
+        content = response.read()
+        latencies.append(time.perf_counter() - t1)
+        if response.status != 200:
+            errors.append(content)
+    connection.close()
+
+
+def get_stats(host=HOST, port=PORT):
+    """ Get the batching statistics of the service. """
+    connection = http.client.HTTPConnection(host, port)
+    connection.request('GET', '/stats')
+    stats = json.loads(connection.getresponse().read().decode('utf-8'))
+    connection.close()
+    return stats
+
+
+if __name__ == '__main__':
+    test_date_range = '20170401_20170417'
+
+    # Input data files
+    sql_file = '../sql_data/4-18-2017FlatDataV9.csv'
+    edi_file = '../edi_data/final_data/' \
+               'metlife_cleaned_edi_HTMLOnly_noErrors_' + test_date_range + '.txt'
+
+    requests = load_requests(edi_file, sql_file)
+    print('Loaded', len(requests), 'requests')
+
+    latencies = []
+    errors = []
+    clients = [
+        threading.Thread(
+            target=run_client,
+            args=(requests, i * REQUESTS_PER_CLIENT, REQUESTS_PER_CLIENT,
+                  latencies, errors)
+        )
+        for i in range(CONCURRENCY)
+    ]
+
+    t1 = time.perf_counter()
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    seconds = time.perf_counter() - t1
+
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+    print('{} requests from {} clients in {:.1f} seconds ({:.1f} requests/s)'.format(
+        len(latencies), CONCURRENCY, seconds, len(latencies) / seconds
+    ))
+    print('latency p50 {:.1f} ms, p95 {:.1f} ms, p99 {:.1f} ms, max {:.1f} ms'.format(
+        p50, p95, p99, max(latencies) * 1000
+    ))
+    print('errors:', len(errors))
+
+    stats = get_stats()
+    print('service: {} batches, mean batch size {:.1f}'.format(
+        stats['n_batches'], stats['mean_batch_size']
+    ))
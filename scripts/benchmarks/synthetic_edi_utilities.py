@@ -0,0 +1,359 @@
+import json
+import os
+import random
+import pandas as pd
+
+
+SEED = 0
+
+# Fraction of records from the OF REST API that are for another carrier
+OTHER_CARRIER_RATE = 0.1
+# Fraction of records whose response is an error page
+ERROR_RATE = 0.03
+# Fraction of records with an empty response
+EMPTY_RATE = 0.01
+# Fraction of MetLife responses without a payer table
+NO_PAYER_TABLE_RATE = 0.02
+# Chance that each of the other tables is missing from a MetLife response
+MISSING_TABLE_RATE = 0.05
+# Fraction of MetLife responses with malformed html (unclosed cells, upper
+# case tags, comments, or cut short after a table)
+MALFORMED_RATE = 0.05
+# Fraction of records that repeat the html of an earlier check of the same
+# patient and plan
+REPEAT_RATE = 0.2
+# Fraction of records that share their InsurancePolicyPatientEligibilityId
+# with the record before them
+DUPLICATE_ID_RATE = 0.01
+# Fraction of checks whose OF values differ from the values in the html
+MISMATCH_RATE = 0.3
+
+OTHER_CARRIERS = ['Delta Dental', 'Cigna', 'Aetna', 'Guardian']
+STATES = ['TX', 'CA', 'NY', 'FL', 'IL', 'WA', 'GA', 'NV']
+CITIES = ['Austin', 'Los Angeles', 'Albany', 'Miami', 'Chicago', 'Seattle',
+          'Atlanta', 'Reno']
+COVERAGE_TYPES = ['Dental<br/>Orthodontics', 'Dental', 'Dental<br/>Vision']
+LIFETIME_MAXIMUMS = [1000, 1500, 2000, 2500, 3000]
+
+
+def row(header, value):
+    return '<tr><th>{}</th><td>{}</td></tr>'.format(header, value)
+
+
+def dollars(amount):
+    return '${:,}'.format(amount)
+
+
+def synthetic_check(rng, i):
+    """ Draw the patient and plan of a synthetic eligibility check.
+
+    Args:
+        rng (random.Random): the random number generator.
+        i (int): the number of the check.
+
+    Returns:
+        Dictionary of the values shown in the html and entered in OF.
+    """
+    lifetime_max = rng.choice(LIFETIME_MAXIMUMS)
+    used = rng.choice([0, 0, 250, 500, 1000, lifetime_max])
+    city = rng.randrange(len(CITIES))
+    return {
+        'id': i,
+        'transaction_id': 'T{:09d}'.format(i),
+        'provider': 'Dr. Provider {}'.format(rng.randrange(500)),
+        'provider_id': 'P{:06d}'.format(rng.randrange(10 ** 6)),
+        'patient': 'Patient {}'.format(i),
+        'member_id': 'M{:09d}'.format(rng.randrange(10 ** 9)),
+        'group_number': 'G{:05d}'.format(rng.randrange(2000)),
+        'dob': '{:02d}/{:02d}/{}'.format(
+            rng.randint(1, 12), rng.randint(1, 28), rng.randint(1950, 2014)
+        ),
+        'sex': rng.choice(['M', 'F']),
+        'city': CITIES[city],
+        'state': STATES[city],
+        'zip': '{:05d}'.format(rng.randrange(10 ** 5)),
+        'coverage': rng.choice(COVERAGE_TYPES),
+        'plan_year': rng.randint(2014, 2017),
+        'lifetime_max': lifetime_max,
+        'lifetime_used': used,
+        'wait_period': rng.random() < 0.2,
+        'coinsurance': rng.choice(['50%', '50%', '60%', '80%', 'N/A']),
+        'in_network': rng.random() < 0.7,
+    }
+
+
+def metlife_html(rng, check, payer_table=True, missing_tables=(),
+                 malformed=None):
+    """ Build the html of a MetLife EDI response, with the eight tables read
+    by the EDI parsing utilities.
+
+    Args:
+        rng (random.Random): the random number generator.
+        check (dict): the check, from synthetic_check.
+
+    Keyword Arguments:
+        payer_table (boolean): include the payer table.
+        missing_tables (collection of str): ids of other tables to leave out.
+        malformed (str): how to break the html - 'unclosed', 'uppercase',
+                         'comments' or 'truncated'. Defaults to well formed
+                         html.
+
+    Returns:
+        String - the html response
+    """
+    remaining = check['lifetime_max'] - check['lifetime_used']
+    tables = [
+        ('payerTable',
+         row('Payer Name', 'MetLife') +
+         row('Transaction ID', check['transaction_id'])),
+        ('providerTable',
+         row('Provider', check['provider']) +
+         row('Address', '{} Main St'.format(check['id'] % 9000 + 1)) +
+         row('Provider ID', check['provider_id']) +
+         row('Tax ID', '\xa0')),
+        ('subscriberTable',
+         row('Patient Name', check['patient']) +
+         row('Member ID', check['member_id']) +
+         row('SSN', '') +
+         row('Group Number', check['group_number']) +
+         row('Group Name', 'Group {}'.format(check['group_number'])) +
+         row('Date of Birth', check['dob']) +
+         row('Gender', check['sex']) +
+         row('Address', '{} Elm St'.format(check['id'] % 5000 + 1)) +
+         '<tr><th></th><td>{}, {} {}</td></tr>'.format(
+             check['city'], check['state'], check['zip'])),
+        ('coveragesTable',
+         '<tr><td>{}</td></tr>'.format(check['coverage'])),
+        ('coverageDatesTable',
+         '<tr><td>Policy Effective: 01/01/{}</td></tr>'
+         '<tr><td>Policy Expiration: 12/31/{}</td></tr>'
+         '<tr><td>Plan Begin Date: 01/01/{}</td></tr>'
+         '<tr><td>Plan End Date: 12/31/{}</td></tr>'.format(
+             check['plan_year'] - 1, check['plan_year'] + 2,
+             check['plan_year'], check['plan_year'])),
+        ('maximumsTable', ''.join(
+            '<tr><td>{}</td><td class="inNetwork">{}</td>'
+            '<td class="outNetwork">{}</td></tr>'.format(
+                label, dollars(amount), dollars(amount))
+            for label, amount in [('Orthodontics', check['lifetime_max']),
+                                  ('Used', check['lifetime_used']),
+                                  ('Remaining', remaining)])),
+        ('planProvisionsTable',
+         '<tr><td>{}</td></tr>'.format(
+             '12 month waiting period for orthodontics'
+             if check['wait_period'] else 'Waiting Period does not apply.')),
+        ('coInsuranceTable',
+         '<tr><td>Orthodontics</td><td class="inNetwork">{}</td>'
+         '<td class="outNetwork">50%</td></tr>'.format(check['coinsurance'])),
+    ]
+
+    parts = ['<html><head><title>MetLife Dental Eligibility</title></head><body>']
+    for table_id, content in tables:
+        if table_id == 'payerTable' and not payer_table:
+            continue
+        if table_id in missing_tables:
+            continue
+        parts.append('<table id="{}">{}</table>'.format(table_id, content))
+    parts.append('</body></html>')
+    html = ''.join(parts)
+
+    if malformed == 'unclosed':
+        html = html.replace('</td>', '')
+    elif malformed == 'uppercase':
+        html = html.replace('<table', '<TABLE').replace('</table>', '</TABLE>') \
+                   .replace('<tr>', '<TR>').replace('</tr>', '</TR>')
+    elif malformed == 'comments':
+        html = html.replace('<tr>', '\n  <!-- row -->\n  <tr>')
+    elif malformed == 'truncated':
+        # Cut short after one of the tables, without the closing tags
+        ends = [i for i in range(len(parts) - 1) if parts[i].startswith('<table')]
+        html = ''.join(parts[:rng.choice(ends) + 1]) if ends else parts[0]
+
+    return html
+
+
+def other_carrier_html(rng, check):
+    """ Build the html of another carrier's EDI response. """
+    return (
+        '<html><body><table id="payerTable">' +
+        row('Payer Name', rng.choice(OTHER_CARRIERS)) +
+        row('Transaction ID', check['transaction_id']) +
+        '</table><table id="subscriberTable">' +
+        row('Patient Name', check['patient']) +
+        row('Date of Birth', check['dob']) +
+        '</table></body></html>'
+    )
+
+
+def error_html(rng, check):
+    """ Build the html of an EDI response that contained an error. """
+    return (
+        '<html><body><h1>An Error Occurred</h1><p>MetLife could not verify '
+        'member {}.</p></body></html>'.format(check['member_id'])
+    )
+
+
+def sql_row(rng, check, carrier='MetLife'):
+    """ Build the flat OF SQL row of a check.
+
+    Args:
+        rng (random.Random): the random number generator.
+        check (dict): the check, from synthetic_check.
+
+    Keyword Arguments:
+        carrier (str): the carrier entered in OF.
+
+    Returns:
+        Dictionary of the OF SQL columns.
+    """
+    lifetime_max = check['lifetime_max']
+    lifetime_remaining = lifetime_max - check['lifetime_used']
+    # Some checks were entered in OF with different values than the html
+    if rng.random() < MISMATCH_RATE:
+        lifetime_max += rng.choice([500, -500, 1000])
+    if rng.random() < MISMATCH_RATE:
+        lifetime_remaining += rng.choice([1, 250, -250])
+
+    def maybe(value, null_rate=0.05):
+        return None if rng.random() < null_rate else value
+
+    return {
+        'InsurancePolicyPatientEligibilityId': check['id'],
+        'CarrierName': carrier,
+        'IsInNetwork': maybe(int(check['in_network'])),
+        'LifetimeMax': maybe(lifetime_max),
+        'LifetimeRemaining': maybe(lifetime_remaining),
+        'PatientDateOfBirth': check['dob'],
+        'StudentStatus': maybe(rng.choice(['FullTime', 'PartTime', 'NotStudent'])),
+        'IsPreAuthRequired': maybe(rng.choice([0, 0, 0, 1])),
+        'AgeMax': maybe(rng.choice([19, 26, 99])),
+        'AgeMaxStudent': maybe(rng.choice([23, 26])),
+        'RelationshipToSubscriber': rng.choice(['Self', 'Spouse', 'Child']),
+        'CoordinationOfBenefits': maybe(rng.choice([1.0, 2.0])),
+        'InsurancePlanPriorityId': rng.randint(1, 3),
+        'PayerId': rng.randint(100, 110),
+        'PatientId': rng.randrange(10 ** 6),
+        'CreatedOn': '{}-01-01'.format(check['plan_year']),
+        'UpdatedOn': '{}-02-01'.format(check['plan_year']),
+        'PlanPriority': 1,
+        'IsActive': 1,
+        'ClaimStatus': rng.choice(['Open', 'Closed']),
+        'GroupName': 'Group {}'.format(check['group_number']),
+        'SubscriberSSN': None,
+        'DeductibleAmount': maybe(round(rng.random() * 100, 2), 0.3),
+    }
+
+
+def synthetic_data(n, seed=SEED):
+    """ Generate synthetic records from the OF REST API, with every kind of
+    response the EDI cleaner and parser handle, and the matching OF SQL
+    export.
+
+    Args:
+        n (int): the number of records.
+
+    Keyword Arguments:
+        seed (int): the random seed.
+
+    Returns:
+        records (list of dicts): the records, with the OF ids and the
+                                 HtmlResponse
+        df_sql (Pandas DataFrame object): one OF SQL row per distinct
+                                          InsurancePolicyPatientEligibilityId
+    """
+    rng = random.Random(seed)
+    records = []
+    sql_rows = []
+    earlier = []
+    malformations = ['unclosed', 'uppercase', 'comments', 'truncated']
+
+    for i in range(n):
+        patient_id = 10 ** 6 + i
+        if records and rng.random() < DUPLICATE_ID_RATE:
+            patient_id = records[-1]['InsurancePolicyPatientEligibilityId']
+
+        draw = rng.random()
+        if earlier and rng.random() < REPEAT_RATE:
+            # Another check of an earlier patient and plan returns the same
+            # html
+            check, html = rng.choice(earlier)
+            carrier = 'MetLife'
+        elif draw < OTHER_CARRIER_RATE:
+            check = synthetic_check(rng, i)
+            html = other_carrier_html(rng, check)
+            carrier = rng.choice(OTHER_CARRIERS)
+        elif draw < OTHER_CARRIER_RATE + ERROR_RATE:
+            check = synthetic_check(rng, i)
+            html = error_html(rng, check)
+            carrier = 'MetLife'
+        elif draw < OTHER_CARRIER_RATE + ERROR_RATE + EMPTY_RATE:
+            check = synthetic_check(rng, i)
+            html = ''
+            carrier = 'MetLife'
+        else:
+            check = synthetic_check(rng, i)
+            html = metlife_html(
+                rng,
+                check,
+                payer_table=rng.random() >= NO_PAYER_TABLE_RATE,
+                missing_tables=[
+                    table_id
+                    for table_id in ['providerTable', 'subscriberTable',
+                                     'coveragesTable', 'coverageDatesTable',
+                                     'maximumsTable', 'planProvisionsTable',
+                                     'coInsuranceTable']
+                    if rng.random() < MISSING_TABLE_RATE
+                ],
+                malformed=(rng.choice(malformations)
+                           if rng.random() < MALFORMED_RATE else None)
+            )
+            # OF sometimes has a different carrier for a MetLife response
+            carrier = 'MetLife' if rng.random() >= 0.05 else rng.choice(OTHER_CARRIERS)
+            earlier.append((check, html))
+
+        records.append({
+            'InsurancePolicyPatientEligibilityId': patient_id,
+            'InsuranceEligibilityAuditId': 5 * 10 ** 6 + i,
+            'HtmlResponse': html
+        })
+        if patient_id == 10 ** 6 + i:
+            sql_rows.append(dict(
+                sql_row(rng, check, carrier),
+                InsurancePolicyPatientEligibilityId=patient_id
+            ))
+
+    return records, pd.DataFrame(sql_rows)
+
+
+def write_synthetic_data(directory, n, seed=SEED):
+    """ Write synthetic data in the formats of the pipeline's inputs: a JSON
+    array of records like the OF REST API dumps, and a csv of the OF SQL
+    export.
+
+    Args:
+        directory (str): the directory to write to. Created if it doesn't
+                         exist.
+        n (int): the number of records.
+
+    Keyword Arguments:
+        seed (int): the random seed.
+
+    Returns:
+        Dictionary of the 'edi_file' and 'sql_file' paths written
+    """
+    os.makedirs(directory, exist_ok=True)
+    records, df_sql = synthetic_data(n, seed=seed)
+
+    edi_file = os.path.join(directory, 'edi_html_synthetic_{}.txt'.format(n))
+    with open(edi_file, 'w') as f:
+        f.write('[')
+        for i, datum in enumerate(records):
+            if i:
+                f.write(',\n')
+            f.write(json.dumps(datum, ensure_ascii=False))
+        f.write(']')
+
+    sql_file = os.path.join(directory, 'sql_synthetic_{}.csv'.format(n))
+    df_sql.to_csv(sql_file, index=False)
+
+    return {'edi_file': edi_file, 'sql_file': sql_file}
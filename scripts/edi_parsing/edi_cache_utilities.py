@@ -0,0 +1,253 @@
+import hashlib
+import json
+import sqlite3
+import time
+
+
+# Version of the parsed values stored in a cache. Bump it whenever a change
+# to the parsing utilities changes the values parsed from a response, so
+# caches written by older code are emptied instead of read.
+CACHE_VERSION = 1
+# Largest number of parsed responses kept in a cache
+MAX_ENTRIES = 1000000
+# Number of lookups or additions between commits of the cache
+COMMIT_EVERY = 1000
+
+# OF ids copied from the input record rather than parsed from the html, so
+# they aren't stored in the cache
+ID_FIELDS = (
+    'InsurancePolicyPatientEligibilityId',
+    'InsuranceEligibilityAuditId'
+)
+
+# Returned by ParsedResponseCache.get_many for responses that aren't cached
+MISSING = object()
+
+
+def response_hash(html):
+    """ Get the key that identifies an html response in the cache.
+
+    Args:
+        html (str): the 'HtmlResponse' of a record from the OF REST API.
+
+    Returns:
+        Bytes - the SHA-256 digest of the html.
+    """
+    return hashlib.sha256((html or '').encode('utf-8')).digest()
+
+
+class ParsedResponseCache(object):
+    """ An on-disk SQLite store of parsed EDI responses, keyed by a hash of
+    the html, so that identical responses (e.g. repeated checks of the same
+    patient and plan, or records pulled twice by overlapping date windows)
+    are only parsed once, across runs.
+
+    The parsed values are stored without the OF ids, which come from the
+    record. When the cache holds more than max_entries responses, the least
+    recently used ones are evicted.
+
+    Args:
+        path (str): the SQLite database file. Created if it doesn't exist.
+
+    Keyword Arguments:
+        max_entries (int): the largest number of responses kept.
+    """
+
+    def __init__(self, path, max_entries=MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._pending = 0
+
+        self._db = sqlite3.connect(path)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)'
+        )
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS parsed ('
+            'hash BLOB PRIMARY KEY, parsed_values TEXT, last_used REAL)'
+        )
+        self._db.execute(
+            'CREATE INDEX IF NOT EXISTS parsed_last_used ON parsed (last_used)'
+        )
+
+        # Empty caches written by a different version of the parser
+        row = self._db.execute(
+            "SELECT value FROM meta WHERE key = 'version'"
+        ).fetchone()
+        if row is None or int(row[0]) != CACHE_VERSION:
+            self._db.execute('DELETE FROM parsed')
+            self._db.execute(
+                "INSERT OR REPLACE INTO meta VALUES ('version', ?)",
+                (str(CACHE_VERSION),)
+            )
+        self._db.commit()
+
+        self._n_entries = self._db.execute(
+            'SELECT COUNT(*) FROM parsed'
+        ).fetchone()[0]
+        # A smaller max_entries than the cache was written with applies
+        # straight away
+        self._evict()
+        self._db.commit()
+
+    def __len__(self):
+        return self._n_entries
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def get_many(self, data):
+        """ Look up the parsed values of a batch of records.
+
+        Args:
+            data (list of dicts): records from the cleaned EDI data.
+
+        Returns:
+            List with, for each record, its parsed values (see
+            mpu.parse_edi_response) with the record's OF ids, None if the
+            response has no payer table, or MISSING if the response isn't
+            cached.
+        """
+        keys = [response_hash(datum['HtmlResponse']) for datum in data]
+        found = {}
+        unique_keys = list(set(keys))
+        # Stay under SQLite's limit on the number of query parameters
+        for i in range(0, len(unique_keys), 500):
+            chunk = unique_keys[i:i + 500]
+            found.update(self._db.execute(
+                'SELECT hash, parsed_values FROM parsed WHERE hash IN ({})'.format(
+                    ','.join('?' * len(chunk))
+                ),
+                chunk
+            ))
+
+        if found:
+            now = time.time()
+            self._db.executemany(
+                'UPDATE parsed SET last_used = ? WHERE hash = ?',
+                [(now, key) for key in found]
+            )
+
+        results = []
+        for datum, key in zip(data, keys):
+            if key not in found:
+                self.misses += 1
+                results.append(MISSING)
+                continue
+
+            self.hits += 1
+            values = json.loads(found[key])
+            if values is not None:
+                values = with_ids(values, datum)
+            results.append(values)
+
+        self._count(len(data))
+        return results
+
+    def put_many(self, data, parsed):
+        """ Add the parsed values of a batch of records, evicting the least
+        recently used responses if the cache is full.
+
+        Args:
+            data (list of dicts): records from the cleaned EDI data.
+            parsed (list): for each record, its parsed values, or None if the
+                           response has no payer table.
+        """
+        now = time.time()
+        rows = []
+        for datum, values in zip(data, parsed):
+            if values is not None:
+                values = {
+                    field: value
+                    for field, value in values.items()
+                    if field not in ID_FIELDS
+                }
+            rows.append(
+                (response_hash(datum['HtmlResponse']), json.dumps(values), now)
+            )
+
+        before = self._db.total_changes
+        self._db.executemany(
+            'INSERT OR IGNORE INTO parsed VALUES (?, ?, ?)', rows
+        )
+        self._n_entries += self._db.total_changes - before
+        self._evict()
+
+        self._count(len(rows))
+
+    def stats(self):
+        """ Summarize the lookups so far.
+
+        Returns:
+            Dictionary of the number of hits, misses and evictions, the hit
+            rate and the number of responses in the cache
+        """
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'entries': self._n_entries
+        }
+
+    def __str__(self):
+        return (
+            'Parsed response cache: {hits} hits, {misses} misses '
+            '({hit_rate:.1%} hit rate), {evictions} evicted, '
+            '{entries} cached'.format(**self.stats())
+        )
+
+    def commit(self):
+        """ Write the pending changes to disk. """
+        self._db.commit()
+        self._pending = 0
+
+    def close(self):
+        """ Commit the pending changes and close the database. """
+        self.commit()
+        self._db.close()
+
+    def _evict(self):
+        # Remove the least recently used responses over max_entries
+        if self._n_entries > self.max_entries:
+            n_evict = self._n_entries - self.max_entries
+            self._db.execute(
+                'DELETE FROM parsed WHERE hash IN ('
+                'SELECT hash FROM parsed ORDER BY last_used LIMIT ?)',
+                (n_evict,)
+            )
+            self._n_entries -= n_evict
+            self.evictions += n_evict
+
+    def _count(self, n):
+        self._pending += n
+        if self._pending >= COMMIT_EVERY:
+            self.commit()
+
+
+def with_ids(values, datum):
+    """ Give parsed values the OF ids of a record, as mpu.parse_edi_response
+    does, replacing any ids they already have.
+
+    Args:
+        values (dict): parsed values of a response.
+        datum (dict): a single record from the cleaned EDI data.
+
+    Returns:
+        Dictionary of the record's non-empty OF ids followed by the parsed
+        values.
+    """
+    record_ids = {field: datum[field] for field in ID_FIELDS if datum[field]}
+    record_ids.update(
+        (field, value) for field, value in values.items() if field not in ID_FIELDS
+    )
+    return record_ids
@@ -0,0 +1,125 @@
+import json
+import os
+
+
+# Name of the file in a checkpoint directory listing the completed parts
+CHECKPOINT_FILE = 'checkpoint.jsonl'
+
+
+def record_key(datum):
+    """ Get the key that identifies an EDI response in a checkpoint.
+
+    Args:
+        datum (dict): a single record from the cleaned EDI data.
+
+    Returns:
+        Tuple of the record's InsuranceEligibilityAuditId and
+        InsurancePolicyPatientEligibilityId.
+    """
+    return (
+        datum.get('InsuranceEligibilityAuditId'),
+        datum.get('InsurancePolicyPatientEligibilityId')
+    )
+
+
+class ParseCheckpoint(object):
+    """ A directory of parsed part files plus a checkpoint of the records
+    each part covers, so that an interrupted or extended parse only has to
+    handle records that haven't been parsed yet.
+
+    Each completed part is written to a temporary file and renamed into
+    place before a line listing its records is appended to the checkpoint
+    file, so a part only counts as done once both exist. Part files that
+    aren't listed in the checkpoint (from a run that crashed mid-part) are
+    removed when the checkpoint is opened.
+
+    Args:
+        directory (str): the directory holding the part files and
+                         checkpoint. Created if it doesn't exist.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.parts = []
+        self.keys = set()
+
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, CHECKPOINT_FILE)
+        if os.path.exists(path):
+            entries = []
+            truncated = False
+            with open(path) as f:
+                for line in f:
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:
+                        # The last line may be cut short by a crash
+                        truncated = True
+                        break
+
+            # Drop the partial line so new parts are appended after the
+            # last complete one
+            if truncated:
+                with open(path, 'w') as f:
+                    for entry in entries:
+                        f.write(json.dumps(entry) + '\n')
+
+            for entry in entries:
+                self.parts.append(entry['part'])
+                self.keys.update(tuple(key) for key in entry['keys'])
+
+        # Remove parts that were never recorded as complete
+        for name in os.listdir(directory):
+            if name.startswith('part-') and name not in self.parts:
+                os.remove(os.path.join(directory, name))
+
+    def __contains__(self, key):
+        return key in self.keys
+
+    def __len__(self):
+        return len(self.keys)
+
+    def write_part(self, df, keys):
+        """ Write a completed part and record its keys in the checkpoint.
+
+        Args:
+            df (Pandas DataFrame object): the parsed records of the part.
+            keys (list of tuples): the keys of every record handled in the
+                                   part, including ones that produced no
+                                   parsed row.
+        """
+        name = 'part-{:05d}.csv'.format(len(self.parts))
+        path = os.path.join(self.directory, name)
+
+        df.to_csv(path + '.tmp', index=False)
+        os.replace(path + '.tmp', path)
+
+        with open(os.path.join(self.directory, CHECKPOINT_FILE), 'a') as f:
+            f.write(json.dumps({'part': name, 'keys': list(keys)}) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+        self.parts.append(name)
+        self.keys.update(keys)
+
+    def merge(self, output_file):
+        """ Concatenate the parts, in the order they were written, into a
+        single csv file.
+
+        Args:
+            output_file (str): the csv file to write.
+        """
+        header = None
+        with open(output_file, 'w') as out:
+            for name in self.parts:
+                with open(os.path.join(self.directory, name)) as f:
+                    part_header = f.readline()
+                    if header is None:
+                        header = part_header
+                        out.write(header)
+                    elif part_header != header:
+                        raise ValueError(
+                            'Columns of {} do not match earlier parts'.format(name)
+                        )
+                    for line in f:
+                        out.write(line)
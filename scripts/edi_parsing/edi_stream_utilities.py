@@ -0,0 +1,128 @@
+import json
+import re
+
+
+def iter_json_array(f, chunk_size=1 << 16):
+    """ Lazily decode the elements of a top-level JSON array from a file
+    object. Only one element (plus at most one read chunk) is held in memory
+    at a time, so memory use does not grow with the size of the file.
+
+    Args:
+        f (file object): an open text file whose contents are a JSON array.
+
+    Keyword Arguments:
+        chunk_size (int): the number of characters to read from the file at
+                          a time.
+
+    Returns:
+        A generator yielding each decoded element of the array in order.
+    """
+
+    decoder = json.JSONDecoder()
+    whitespace = re.compile(r'[ \t\n\r]*')
+
+    buf = ''
+    pos = 0
+    eof = False
+
+    def fill(buf, pos):
+        chunk = f.read(chunk_size)
+        return buf[pos:] + chunk, 0, not chunk
+
+    # Find the opening bracket of the array
+    while True:
+        pos = whitespace.match(buf, pos).end()
+        if pos < len(buf):
+            break
+        if eof:
+            raise ValueError('Expected a JSON array but the file is empty')
+        buf, pos, eof = fill(buf, pos)
+
+    if buf[pos] != '[':
+        raise ValueError('Expected a JSON array, found {!r}'.format(buf[pos]))
+    pos += 1
+
+    expect_value = True
+    first = True
+    while True:
+        pos = whitespace.match(buf, pos).end()
+        if pos == len(buf):
+            if eof:
+                raise ValueError('Unterminated JSON array')
+            buf, pos, eof = fill(buf, pos)
+            continue
+
+        if buf[pos] == ']' and (first or not expect_value):
+            return
+
+        if not expect_value:
+            if buf[pos] != ',':
+                raise ValueError(
+                    'Expected "," or "]" in JSON array, found {!r}'.format(buf[pos])
+                )
+            pos += 1
+            expect_value = True
+            continue
+
+        # Decode the next element. A failure or a value that runs right up to
+        # the end of the buffer may just mean the element is split across
+        # chunks, so read more and try again. A number split at a fraction or
+        # exponent (e.g. '1.' | '5') decodes early, so one followed by the
+        # start of a fraction or exponent is also read again.
+        try:
+            value, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            buf, pos, eof = fill(buf, pos)
+            continue
+        if not eof and (
+            end == len(buf) or
+            (buf[pos] in '-0123456789' and buf[end] in '.eE+-')
+        ):
+            buf, pos, eof = fill(buf, pos)
+            continue
+
+        yield value
+        buf, pos = buf[end:], 0
+        expect_value = False
+        first = False
+
+
+def iter_jsonl(f):
+    """ Lazily decode a file containing one JSON document per line, skipping
+    blank lines.
+
+    Args:
+        f (file object): an open text file in JSON lines format.
+
+    Returns:
+        A generator yielding each decoded line in order.
+    """
+
+    for line in f:
+        if line.strip():
+            yield json.loads(line)
+
+
+def is_clean_metlife_response(datum):
+    """ Check whether an EDI response from the OF REST API is a MetLife
+    response that did not contain an error.
+
+    Args:
+        datum (dict): a single record from the OF REST API.
+
+    Returns:
+        Boolean - True if the record should be kept.
+    """
+
+    html = datum['HtmlResponse']
+    if not html:
+        return False
+
+    # Look for MetLife only responses
+    if not re.search('metlife', html, re.IGNORECASE):
+        return False
+
+    # Filter out responses that contained an error
+    return not re.search('An Error Occurred', html)
@@ -0,0 +1,294 @@
+import cProfile
+import functools
+import io
+import json
+import os
+import pstats
+import resource
+import time
+import tracemalloc
+
+
+# Environment variable listing the profilers to run, comma separated:
+# 'cprofile' and/or 'tracemalloc', e.g. METLIFE_PROFILE=cprofile,tracemalloc
+PROFILE_ENV = 'METLIFE_PROFILE'
+# Environment variable naming a file to write the JSON run summary to
+SUMMARY_FILE_ENV = 'METLIFE_SUMMARY_FILE'
+# Prefix of the timers around the parsing of each html table
+TABLE_TIMER_PREFIX = 'parse.table.'
+# Number of tables, and of cProfile functions, listed in the summary
+N_SLOWEST = 10
+
+
+class _Timer(object):
+    """ Context manager adding the time spent in its block to a timer's
+    [calls, seconds, max seconds] statistics. """
+
+    __slots__ = ('stats', 'start')
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        seconds = time.perf_counter() - self.start
+        stats = self.stats
+        stats[0] += 1
+        stats[1] += seconds
+        if seconds > stats[2]:
+            stats[2] = seconds
+
+
+class Instruments(object):
+    """ Named timers and counters for a run of the pipeline, with optional
+    cProfile and tracemalloc capture, summarized at the end of the run.
+
+    Timers and counters are cheap enough to leave around per-record code
+    (about a microsecond each). Work done in worker processes is added with
+    map_collected and merge, so the seconds of a timer can add up to more
+    than the elapsed time of the run.
+    """
+
+    def __init__(self):
+        self.timers = {}
+        self.counters = {}
+        self.start_time = time.perf_counter()
+        self.profiler = None
+        self.profile_file = None
+
+    def timer(self, name):
+        """ Time a block of code.
+
+        Args:
+            name (str): the name of the timer, e.g. 'build_set'.
+
+        Returns:
+            A context manager that adds the time spent in its block to the
+            timer
+        """
+        stats = self.timers.get(name)
+        if stats is None:
+            stats = self.timers[name] = [0, 0.0, 0.0]
+        return _Timer(stats)
+
+    def timed(self, name):
+        """ Time every call of a function.
+
+        Args:
+            name (str): the name of the timer.
+
+        Returns:
+            A decorator that wraps the function in the timer
+        """
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.timer(name):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def count(self, name, n=1):
+        """ Add to a counter.
+
+        Args:
+            name (str): the name of the counter, e.g. 'records.parsed'.
+
+        Keyword Arguments:
+            n (int): the amount to add.
+        """
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def drain(self):
+        """ Take the timers and counters recorded so far, starting them
+        again from 0.
+
+        Returns:
+            Tuple of the timers and counters, for merge
+        """
+        timers, counters = self.timers, self.counters
+        self.timers = {}
+        self.counters = {}
+        return timers, counters
+
+    def merge(self, collected):
+        """ Add timers and counters recorded elsewhere, e.g. in a worker
+        process, to these.
+
+        Args:
+            collected (tuple): the timers and counters, from drain.
+        """
+        timers, counters = collected
+        for name, (calls, seconds, max_seconds) in timers.items():
+            stats = self.timers.get(name)
+            if stats is None:
+                stats = self.timers[name] = [0, 0.0, 0.0]
+            stats[0] += calls
+            stats[1] += seconds
+            stats[2] = max(stats[2], max_seconds)
+        for name, n in counters.items():
+            self.count(name, n)
+
+    def reset(self):
+        """ Forget the timers and counters and stop the profilers. Used as
+        the initializer of worker processes, which would otherwise send back
+        what they inherited from the parent process. """
+        self.drain()
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.profiler = None
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def start(self, profilers=None, profile_file=None):
+        """ Restart the run clock and start the requested profilers.
+
+        Keyword Arguments:
+            profilers (collection of str): 'cprofile' and/or 'tracemalloc'.
+                                           Defaults to the profilers listed
+                                           in the PROFILE_ENV environment
+                                           variable.
+            profile_file (str): the file the cProfile statistics are dumped
+                                to, for use with pstats or snakeviz.
+                                Defaults to not saving them.
+        """
+        if profilers is None:
+            profilers = [
+                profiler.strip().lower()
+                for profiler in os.environ.get(PROFILE_ENV, '').split(',')
+                if profiler.strip()
+            ]
+        unknown = set(profilers).difference(['cprofile', 'tracemalloc'])
+        if unknown:
+            raise ValueError('Unknown profilers: {}'.format(sorted(unknown)))
+
+        self.start_time = time.perf_counter()
+        if 'tracemalloc' in profilers and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        if 'cprofile' in profilers:
+            self.profiler = cProfile.Profile()
+            self.profile_file = profile_file
+            self.profiler.enable()
+
+    def summary(self):
+        """ Summarize the run so far.
+
+        Returns:
+            Dictionary of the elapsed seconds, the counters, each timer's
+            calls, total seconds, mean and max milliseconds and share of the
+            elapsed time (slowest first), the slowest html tables, the peak
+            resident memory in megabytes and, when profiling, the tracemalloc
+            peak and the slowest functions
+        """
+        elapsed = time.perf_counter() - self.start_time
+        stages = {
+            name: {
+                'calls': calls,
+                'seconds': seconds,
+                'mean_ms': seconds / calls * 1000 if calls else 0.0,
+                'max_ms': max_seconds * 1000,
+                'share': seconds / elapsed if elapsed else 0.0
+            }
+            for name, (calls, seconds, max_seconds) in sorted(
+                self.timers.items(), key=lambda item: -item[1][1]
+            )
+        }
+
+        summary = {
+            'elapsed_seconds': elapsed,
+            'counters': dict(sorted(self.counters.items())),
+            'stages': stages,
+            'slowest_tables': [
+                dict(stats, table=name[len(TABLE_TIMER_PREFIX):])
+                for name, stats in stages.items()
+                if name.startswith(TABLE_TIMER_PREFIX)
+            ][:N_SLOWEST],
+            'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        }
+
+        if tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            summary['tracemalloc_peak_mb'] = peak / 1024 ** 2
+
+        if self.profiler is not None:
+            stream = io.StringIO()
+            stats = pstats.Stats(self.profiler, stream=stream)
+            summary['slowest_functions'] = [
+                {
+                    'function': '{}:{}({})'.format(*function),
+                    'calls': calls,
+                    'own_seconds': own_seconds,
+                    'cumulative_seconds': cumulative_seconds
+                }
+                for function, (primitive_calls, calls, own_seconds,
+                               cumulative_seconds, callers) in sorted(
+                    stats.stats.items(), key=lambda item: -item[1][3]
+                )[:N_SLOWEST]
+            ]
+            if self.profile_file is not None:
+                summary['profile_file'] = self.profile_file
+
+        return summary
+
+    def report(self, summary_file=None):
+        """ Stop the profilers and print the summary of the run as JSON.
+
+        Keyword Arguments:
+            summary_file (str): a file to also write the summary to.
+                                Defaults to the file named by the
+                                SUMMARY_FILE_ENV environment variable, if
+                                set.
+
+        Returns:
+            Dictionary - the summary (see summary)
+        """
+        if self.profiler is not None:
+            self.profiler.disable()
+            if self.profile_file is not None:
+                self.profiler.dump_stats(self.profile_file)
+
+        summary = self.summary()
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+        print('Run summary:', json.dumps(summary, indent=2))
+
+        summary_file = summary_file or os.environ.get(SUMMARY_FILE_ENV)
+        if summary_file:
+            with open(summary_file, 'w') as f:
+                json.dump(summary, f, indent=2)
+
+        return summary
+
+
+def map_collected(function, items):
+    """ Apply a function to each of a list of items, collecting the timers
+    and counters recorded meanwhile. Meant to be run in a worker process,
+    with the collected instruments merged into the parent's.
+
+    Args:
+        function (function): the function to apply.
+        items (list): the items.
+
+    Returns:
+        Tuple of the list of results and the collected timers and counters
+        (see Instruments.merge)
+    """
+    results = [function(item) for item in items]
+    return results, INSTRUMENTS.drain()
+
+
+# The instruments shared by every module in a run
+INSTRUMENTS = Instruments()
+
+timer = INSTRUMENTS.timer
+timed = INSTRUMENTS.timed
+count = INSTRUMENTS.count
+merge = INSTRUMENTS.merge
+reset = INSTRUMENTS.reset
+start = INSTRUMENTS.start
+summary = INSTRUMENTS.summary
+report = INSTRUMENTS.report
@@ -1,6 +1,6 @@
 import json
-import re
-from pprint import pprint
+import time
+from edi_stream_utilities import iter_json_array, is_clean_metlife_response
 
 
 output_file = './edi_data/metlife_cleaned_edi_HTMLOnly_noErrors_20140516_20170331.txt'
@@ -29,16 +29,28 @@ data_files = [
     './edi_data/edi_html_20170401_20170417.txt'
 ]
 
-# Read in json data from OF REST API
-data = []
-for file in data_files:
-    with open(file) as f:
-        data += json.load(f)
-
-with open(output_file, 'x') as f:
-    for datum in data:
-	# Look for MetLife only responses
-        if re.search('metlife', datum['HtmlResponse'], re.IGNORECASE):
-            # Filter out responses that contained an error	
-            if not re.search('An Error Occurred', datum['HtmlResponse']):
-                f.write(json.dumps(datum, ensure_ascii=False)+'\n')
+# Stream records from the OF REST API dumps one at a time and write out the
+# MetLife responses as JSON lines, so only a single record is held in memory
+t1 = time.time()
+n_read = 0
+n_written = 0
+
+with open(output_file, 'x') as out:
+    for file in data_files:
+        with open(file) as f:
+            for datum in iter_json_array(f):
+                n_read += 1
+                if is_clean_metlife_response(datum):
+                    out.write(json.dumps(datum, ensure_ascii=False)+'\n')
+                    n_written += 1
+
+                if n_read % 10000 == 0:
+                    elapsed = time.time() - t1
+                    print('Read', n_read, 'records, kept', n_written,
+                          '\n{:.0f} records/s'.format(n_read / elapsed))
+
+elapsed = time.time() - t1
+print('Read', n_read, 'records, kept', n_written,
+      'in {:.02f} minutes ({:.0f} records/s)'.format(
+          elapsed / 60, n_read / elapsed if elapsed else 0
+      ))
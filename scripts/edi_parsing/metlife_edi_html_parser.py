@@ -1,109 +1,491 @@
 import json
-import re
+import os
+import random
+from collections import Counter, deque
+from functools import partial
 import numpy as np
 import pandas as pd
 import metlife_parsing_utilities as mpu
-from bs4 import BeautifulSoup
+import instrumentation_utilities as instruments
+from edi_cache_utilities import MISSING, ParsedResponseCache, with_ids
+from edi_checkpoint_utilities import ParseCheckpoint, record_key
+from multiprocessing import Pool
 import time
 
 
-t1 = time.time()
+# Number of worker processes used to parse the html. When set to 1 the
+# responses are parsed serially in this process.
+N_WORKERS = 1
+# Number of records sent to a worker process at a time
+CHUNK_SIZE = 100
+# Html parsing backend, one of 'bs4', 'lxml' or 'regex'
+# (see mpu.parse_edi_response)
+BACKEND = 'bs4'
+# Number of randomly sampled records to check against the 'bs4' backend
+# before parsing. Set to 0 to skip validation.
+VALIDATE_SAMPLE = 0
+# Parse incrementally: write parsed records to part files in a checkpoint
+# directory, skip records a previous run already finished, and merge the
+# parts into the output file at the end
+INCREMENTAL = False
+# Number of input records covered by each part file
+PART_SIZE = 10000
+# Format of the output file: 'csv', or 'parquet' / 'feather' to write typed
+# columns (see mpu.PARSED_DTYPES)
+OUTPUT_FORMAT = 'csv'
+# Look up each html response in an on-disk cache of parsed responses before
+# parsing it, so identical responses are only parsed once across runs
+CACHE = False
+# Largest number of parsed responses kept in the cache
+CACHE_MAX_ENTRIES = 1000000
 
-input_file = '../edi_data/final_data/' \
-             'metlife_cleaned_edi_HTMLOnly_noErrors_20170401_20170417.txt'
-output_file = '../edi_data/parsed_data/metlife_20170401_20170417.csv'
 
-data = []
-with open(input_file) as f:
-    for line in f:
-        data.append(json.loads(line))
+def parse_line(line, backend=BACKEND):
+    """ Decode a line of the cleaned EDI data and parse its html response.
 
-# Create datafram to store parsed data
-df = pd.DataFrame()
+    Args:
+        line (str): a single JSON encoded record from the cleaned EDI data.
 
-# Keep track of time
-i = 0
-n = len(data)
+    Keyword Arguments:
+        backend (str): the html parsing backend to use.
 
-# Loop through html responses and parse out required data to add to dataframe
-for datum in data:
-    # Print progress and time elapsed
-    if i % 1000 == 0:
-        print('On record', i, 'out of', n, '\ntime elapsed: {:.02f} minutes'.format((time.time() - t1) / 60))
-    i += 1
+    Returns:
+        Tuple of the record's InsurancePolicyPatientEligibilityId, the
+        dictionary of parsed values (None if there is no payer table) and the
+        name of the backend that parsed it.
+    """
+    return parse_datum(json.loads(line), backend=backend)
 
-    # Create dictionary to store parsed values
-    values = {}
-    if datum['InsurancePolicyPatientEligibilityId']:
-        values['InsurancePolicyPatientEligibilityId'] = datum['InsurancePolicyPatientEligibilityId']
-    if datum['InsuranceEligibilityAuditId']:
-        values['InsuranceEligibilityAuditId'] = datum['InsuranceEligibilityAuditId']
 
-    # Parse the html
-    soup = BeautifulSoup(datum['HtmlResponse'], 'lxml')
+def parse_datum(datum, backend=BACKEND):
+    """ Parse the html response of a decoded record of the cleaned EDI data.
 
-    # Figure out which carrier this is and send to the html parser
-    payer_table = soup.find(id='payerTable')
-    if payer_table:
-        values['CarrierName_HTML'] = mpu.find_next_sibling(
-            payer_table, 'th', 'Payer Name', 'td'
-        )
-        values['TransactionId'] = mpu.find_next_sibling(
-            payer_table, 'th', 'Transaction ID', 'td'
-        )
+    Args:
+        datum (dict): a single record from the cleaned EDI data.
+
+    Keyword Arguments:
+        backend (str): the html parsing backend to use.
+
+    Returns:
+        The same as parse_line.
+    """
+    values, path = mpu.parse_edi_response_path(datum, backend=backend)
+    return datum['InsurancePolicyPatientEligibilityId'], values, path
+
+
+def chunks(items, size):
+    """ Split an iterable into lists of up to size items.
+
+    Args:
+        items (iterable): the items.
+        size (int): the largest number of items in a list.
+
+    Returns:
+        A generator yielding the lists in order.
+    """
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def parse_lines(lines, n_workers=N_WORKERS, chunk_size=CHUNK_SIZE,
+                backend=BACKEND, cache=None):
+    """ Parse lines of cleaned EDI data, sharding them across a pool of
+    worker processes if more than one worker is requested. Results are
+    always yielded in input order.
+
+    Args:
+        lines (iterable of str): JSON encoded records from the cleaned
+                                 EDI data.
+
+    Keyword Arguments:
+        n_workers (int): the number of worker processes to use.
+        chunk_size (int): the number of records sent to a worker at a time.
+        backend (str): the html parsing backend to use.
+        cache (ParsedResponseCache): a cache of parsed responses. Responses
+                                     found in it aren't parsed again (their
+                                     backend is reported as 'cache'), and
+                                     newly parsed ones are added to it.
+
+    Returns:
+        A generator yielding the output of parse_line for each line.
+    """
+    parse = partial(parse_line, backend=backend)
+
+    if cache is None:
+        if n_workers <= 1:
+            yield from map(parse, lines)
+            return
+
+        # Send the workers chunks of lines, and add the timers and counters
+        # of each chunk to this process's
+        with Pool(n_workers, initializer=instruments.reset) as pool:
+            for results, collected in pool.imap(
+                partial(instruments.map_collected, parse),
+                chunks(lines, chunk_size)
+            ):
+                instruments.merge(collected)
+                yield from results
+        return
+
+    pool = Pool(n_workers, initializer=instruments.reset) if n_workers > 1 else None
+    try:
+        # Look up a batch of records at a time, and parse the distinct
+        # responses that aren't cached
+        batch = []
+        for line in lines:
+            batch.append(json.loads(line))
+            if len(batch) >= chunk_size * max(n_workers, 1):
+                yield from parse_cached(batch, cache, backend, pool, chunk_size)
+                batch = []
+        if batch:
+            yield from parse_cached(batch, cache, backend, pool, chunk_size)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
 
-        # Double check to see if carrier is metlife
-        if re.search('metlife', values['CarrierName_HTML'], re.IGNORECASE):
-            # Find data from provider table if it is there
-            parsed_data = mpu.parse_provider_table(soup)
-            values.update(parsed_data)
 
-            # Find data from subscriber table if it is there
-            parsed_data = mpu.parse_subscriber_table(soup)
-            values.update(parsed_data)
+def parse_cached(data, cache, backend=BACKEND, pool=None, chunk_size=CHUNK_SIZE):
+    """ Parse a batch of decoded records, using and updating a cache of
+    parsed responses.
 
-            # Find data from coverage type table if it is there
-            parsed_data = mpu.parse_coverage_type_table(soup)
-            values.update(parsed_data)
+    Args:
+        data (list of dicts): records from the cleaned EDI data.
+        cache (ParsedResponseCache): the cache of parsed responses.
 
-            # Find data from coverage dates table if it is there
-            parsed_data = mpu.parse_coverage_dates_table(soup)
-            values.update(parsed_data)
+    Keyword Arguments:
+        backend (str): the html parsing backend to use.
+        pool (multiprocessing Pool): the worker processes to parse with.
+                                     Defaults to parsing in this process.
+        chunk_size (int): the number of records sent to a worker at a time.
 
-            # Find data from maximums table if it is there
-            parsed_data = mpu.parse_maximums_table(soup)
-            values.update(parsed_data)
+    Returns:
+        List of the output of parse_line for each record.
+    """
+    results = [
+        None if values is MISSING
+        else (datum['InsurancePolicyPatientEligibilityId'], values, 'cache')
+        for datum, values in zip(data, cache.get_many(data))
+    ]
 
-            # Find data from plan provider table if it is there
-            parsed_data = mpu.parse_plan_provisions_table(soup)
-            values.update(parsed_data)
+    # Responses repeated within the batch are only parsed once
+    misses = {}
+    for i, result in enumerate(results):
+        if result is None:
+            misses.setdefault(data[i]['HtmlResponse'], []).append(i)
+    if not misses:
+        return results
+
+    to_parse = [data[positions[0]] for positions in misses.values()]
+    parse = partial(parse_datum, backend=backend)
+    if pool is None:
+        parsed = list(map(parse, to_parse))
+    else:
+        parsed = []
+        for chunk, collected in pool.map(
+            partial(instruments.map_collected, parse),
+            list(chunks(to_parse, chunk_size))
+        ):
+            instruments.merge(collected)
+            parsed.extend(chunk)
+    cache.put_many(to_parse, [values for patient_id, values, path in parsed])
+
+    for positions, (patient_id, values, path) in zip(misses.values(), parsed):
+        for i in positions:
+            datum = data[i]
+            if i != positions[0] and values is not None:
+                # Copy the values, with this record's own ids
+                values = with_ids(values, datum)
+            results[i] = (datum['InsurancePolicyPatientEligibilityId'], values, path)
+
+    return results
 
-            # Find data from coverage table if it is there
-            parsed_data = mpu.parse_coverage_table(soup)
-            values.update(parsed_data)
 
-            # Create new dataframe to store this row
+def type_parsed_frame(df):
+    """ Convert parsed records to the column types in mpu.PARSED_DTYPES.
+    Works on both freshly parsed records and records read back from csv as
+    text.
+
+    Args:
+        df (Pandas DataFrame object): the parsed records.
+
+    Returns:
+        Pandas DataFrame object - the records with typed columns.
+    """
+    booleans = {'True': True, 'False': False, True: True, False: False}
+
+    df = df.copy()
+    for column, dtype in mpu.PARSED_DTYPES.items():
+        values = df[column].astype(object).where(df[column].notnull(), None)
+        if dtype == 'Int64':
+            df[column] = pd.to_numeric(values).astype('Int64')
+        elif dtype == 'float64':
+            # Strip thousands separators from dollar amounts
+            df[column] = pd.to_numeric(values.map(
+                lambda v: v.translate({ord(','): None}) if isinstance(v, str) else v
+            )).astype('float64')
+        elif dtype == 'numeric':
             try:
-                row = pd.DataFrame(values, index=[0])
-            except:
-                print('Failed to create dataframe row. Iteration:', i, '\nvalues:')
-                print(values)
+                df[column] = pd.to_numeric(values).astype('float64')
+            except (ValueError, TypeError):
+                df[column] = values.map(lambda v: v if v is None else str(v))
+        elif dtype == 'boolean':
+            df[column] = values.map(booleans).astype('boolean')
+        else:
+            df[column] = values.map(lambda v: v if v is None else str(v))
+
+    return df
 
-        # Append row to dataframe
-        df = df.append(row, ignore_index=True)
 
-    # If a payer table can not be found then skip this edi response
+def write_parsed(df, output_file):
+    """ Write parsed records to a csv, parquet or feather file, depending on
+    the file extension. Parquet and feather files get typed columns.
+
+    Args:
+        df (Pandas DataFrame object): the parsed records.
+        output_file (str): the file to write.
+    """
+    if output_file.endswith('.parquet'):
+        type_parsed_frame(df).to_parquet(output_file, index=False)
+    elif output_file.endswith('.feather'):
+        type_parsed_frame(df).reset_index(drop=True).to_feather(output_file)
     else:
-        print(
-            str(int(datum['InsurancePolicyPatientEligibilityId'])),
-            " does not have a payer table"
+        df.to_csv(output_file, index=False)
+
+
+def sample_lines(lines, k, seed=0):
+    """ Draw a uniform random sample of k lines in a single pass.
+
+    Args:
+        lines (iterable of str): the lines to sample from.
+        k (int): the sample size.
+
+    Keyword Arguments:
+        seed (int): the random seed.
+
+    Returns:
+        A list of at most k lines.
+    """
+    rng = random.Random(seed)
+    sample = []
+    for i, line in enumerate(lines):
+        if i < k:
+            sample.append(line)
+        else:
+            j = rng.randint(0, i)
+            if j < k:
+                sample[j] = line
+    return sample
+
+
+# OF ids copied from the input records
+ID_COLUMNS = [
+    'InsurancePolicyPatientEligibilityId',
+    'InsuranceEligibilityAuditId',
+]
+
+
+class ParsedRecordBuilder(object):
+    """ Accumulate parsed EDI records column by column so the dataframe is
+    only built once, with a fixed column schema, instead of being copied for
+    every appended row.
+
+    Keyword Arguments:
+        columns (list of str): the column schema. Defaults to every column
+                               metlife_parsing_utilities can emit.
+    """
+
+    def __init__(self, columns=mpu.PARSED_COLUMNS):
+        self.columns = list(columns)
+        self._data = {column: [] for column in self.columns}
+        self._n = 0
+
+    def __len__(self):
+        return self._n
+
+    def add(self, values):
+        """ Add a dictionary of parsed values as a new record. Columns that
+        are missing from the dictionary are stored as None.
+
+        Args:
+            values (dict): the values returned by mpu.parse_edi_response.
+        """
+        unknown = set(values).difference(self._data)
+        if unknown:
+            raise KeyError('Unknown parsed columns: {}'.format(sorted(unknown)))
+
+        for column, column_values in self._data.items():
+            value = values.get(column)
+            # Unformatted address parts are parsed as a list of strings
+            if isinstance(value, list):
+                value = ' '.join(value)
+            column_values.append(value)
+        self._n += 1
+
+    def to_frame(self):
+        """ Build a dataframe from the accumulated records. ID columns are
+        stored as nullable integers so they are written the same way
+        whether or not some of them are missing.
+
+        Returns:
+            Pandas DataFrame object - one row per record, in the order added.
+        """
+        df = pd.DataFrame(self._data, columns=self.columns)
+        for column in ID_COLUMNS:
+            if column in df.columns:
+                try:
+                    df[column] = df[column].astype('Int64')
+                except (TypeError, ValueError):
+                    pass
+        return df
+
+
+def clean_blanks(df):
+    """ Replace blank values from html, represented as spaces (ascii code:
+    '\xa0') or empty strings, with NaN values.
+
+    Args:
+        df (Pandas DataFrame object): the parsed records, modified in place.
+    """
+    df.replace(to_replace='\xa0', value=np.NaN, inplace=True)
+    df.replace(to_replace='', value=np.NaN, inplace=True)
+
+
+if __name__ == '__main__':
+    t1 = time.time()
+    # Profile the run if asked to by the METLIFE_PROFILE environment variable.
+    # With N_WORKERS > 1 the timers of the worker processes are added to the
+    # run summary, but cProfile and tracemalloc only see this process.
+    instruments.start()
+
+    input_file = '../edi_data/final_data/' \
+                 'metlife_cleaned_edi_HTMLOnly_noErrors_20170401_20170417.txt'
+    output_file = '../edi_data/parsed_data/metlife_20170401_20170417.' + OUTPUT_FORMAT
+    checkpoint_dir = '../edi_data/parsed_data/metlife_20170401_20170417_parts'
+    # Parsed responses, shared by every run that parses EDI data
+    cache_file = '../edi_data/parsed_data/parsed_response_cache.sqlite'
+
+    # Count the records up front so progress can be reported
+    with open(input_file) as f:
+        n = sum(1 for line in f if line.strip())
+
+    # Check the chosen backend against BeautifulSoup on a sample
+    if VALIDATE_SAMPLE and BACKEND != 'bs4':
+        with open(input_file) as f:
+            sample = sample_lines((line for line in f if line.strip()), VALIDATE_SAMPLE)
+        paths, mismatches = mpu.validate_backend(
+            (json.loads(line) for line in sample), backend=BACKEND
         )
-        continue
+        print('Validated', len(sample), 'records:', dict(paths))
+        for audit_id, values, expected in mismatches:
+            print('Mismatch for InsuranceEligibilityAuditId', audit_id,
+                  '\n', BACKEND + ':', values, '\n', 'bs4:', expected)
+        if mismatches:
+            raise SystemExit('{} backend does not match bs4 on {} records'.format(
+                BACKEND, len(mismatches)
+            ))
+
+    # Records already parsed by a previous run are skipped when parsing
+    # incrementally. The keys of the records sent for parsing are queued so
+    # they can be matched up with the (in order) results.
+    checkpoint = ParseCheckpoint(checkpoint_dir) if INCREMENTAL else None
+    pending_keys = deque()
+    n_skipped = 0
+
+    def unparsed(lines):
+        global n_skipped
+        for line in lines:
+            if checkpoint is not None:
+                key = record_key(json.loads(line))
+                if key in checkpoint:
+                    n_skipped += 1
+                    continue
+                pending_keys.append(key)
+            yield line
+
+    # Accumulate parsed records column by column
+    records = ParsedRecordBuilder()
+    part_keys = []
+    # Count the records parsed by each backend
+    paths = Counter()
+
+    # Keep track of time
+    i = 0
+
+    cache = ParsedResponseCache(cache_file, max_entries=CACHE_MAX_ENTRIES) if CACHE else None
+
+    with open(input_file) as f:
+        lines = unparsed(line for line in f if line.strip())
 
-# Replace blank values from html, represented as spaces (ascii code: '\xa0')
-# with NaN values
-df.replace(to_replace='\xa0', value=np.NaN, inplace=True)
-df.replace(to_replace='', value=np.NaN, inplace=True)
+        # Loop through parsed html responses and add them to the dataframe
+        for patient_id, values, path in parse_lines(lines, cache=cache):
+            # Print progress and time elapsed
+            if i % 1000 == 0:
+                print('On record', i + n_skipped, 'out of', n, '\ntime elapsed: {:.02f} minutes'.format((time.time() - t1) / 60))
+            i += 1
+            paths[path] += 1
+            instruments.count('records.parsed')
+
+            # If a payer table can not be found then skip this edi response
+            if values is None:
+                print(
+                    str(int(patient_id)),
+                    " does not have a payer table"
+                )
+
+            # Only keep responses where the payer is MetLife
+            elif mpu.is_metlife(values):
+                records.add(values)
+                instruments.count('records.metlife')
+
+            # Write out a part once enough records have been handled
+            if checkpoint is not None:
+                part_keys.append(pending_keys.popleft())
+                if len(part_keys) >= PART_SIZE:
+                    df = records.to_frame()
+                    clean_blanks(df)
+                    checkpoint.write_part(df, part_keys)
+                    records = ParsedRecordBuilder()
+                    part_keys = []
+
+    print('Records parsed by each backend:', dict(paths))
+    if cache is not None:
+        print(cache)
+        cache.close()
+
+    # Create dataframe from the parsed records
+    with instruments.timer('to_frame'):
+        df = records.to_frame()
+
+        # Replace blank values from html, represented as spaces (ascii code: '\xa0')
+        # with NaN values
+        clean_blanks(df)
+
+    if checkpoint is None:
+        # Write dataframe to file
+        with instruments.timer('write'):
+            write_parsed(df, output_file)
+    else:
+        # Write the last part and merge all of the parts into the output file
+        if part_keys or not checkpoint.parts:
+            checkpoint.write_part(df, part_keys)
+        print('Skipped', n_skipped, 'records parsed by a previous run')
+        if OUTPUT_FORMAT == 'csv':
+            checkpoint.merge(output_file)
+        else:
+            merged_file = output_file + '.csv'
+            checkpoint.merge(merged_file)
+            df = pd.read_csv(
+                merged_file, dtype=object, keep_default_na=False, na_values=['']
+            )
+            write_parsed(df, output_file)
+            os.remove(merged_file)
 
-# Write dataframe to csv file
-df.to_csv(output_file, index=False)
+    instruments.count('records.skipped', n_skipped)
+    instruments.report()
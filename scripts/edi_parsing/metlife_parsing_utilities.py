@@ -1,6 +1,89 @@
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, Tag
+from collections import Counter, namedtuple
+from functools import lru_cache
+import lxml.etree
+import lxml.html
 import re
 
+from instrumentation_utilities import count, timer, TABLE_TIMER_PREFIX
+
+
+# Backends that parse_edi_response can use to extract data from the html
+BACKENDS = ('bs4', 'lxml', 'regex')
+
+# Ids of the html tables that hold the data we parse
+TABLE_IDS = (
+    'payerTable',
+    'providerTable',
+    'subscriberTable',
+    'coveragesTable',
+    'coverageDatesTable',
+    'maximumsTable',
+    'planProvisionsTable',
+    'coInsuranceTable',
+)
+
+# Every column that parse_edi_response can emit, in the order they are parsed
+PARSED_COLUMNS = [
+    'InsurancePolicyPatientEligibilityId',
+    'InsuranceEligibilityAuditId',
+    'CarrierName_HTML',
+    'TransactionId',
+    'ProviderName',
+    'ProviderAddress',
+    'ProviderId',
+    'ProviderTaxId',
+    'SubscriberPatientName',
+    'SubscriberMemberId',
+    'SubscriberSSN',
+    'GroupNumber',
+    'GroupName',
+    'SubscriberDOB',
+    'SubscriberSex',
+    'SubscriberAddress',
+    'SubscriberCity',
+    'SubscriberAddress2',
+    'SubscriberState',
+    'SubscriberZip',
+    'CoverageType',
+    'SubscriberPlanEffectiveDateStart',
+    'SubscriberPlanEffectiveDateEnd',
+    'PlanBenefitsStart',
+    'PlanBenefitsEnd',
+    'LifetimeMax_InNetwork',
+    'LifetimeMax_OutNetwork',
+    'LifetimeUsed_InNetwork',
+    'LifetimeUsed_OutNetwork',
+    'LifetimeRemaining_InNetwork',
+    'LifetimeRemaining_OutNetwork',
+    'WaitPeriod',
+    'CoIns_InNetwork',
+    'CoIns_OutNetwork',
+]
+
+
+# Type of each parsed column when written to a typed (parquet or feather)
+# file. Dollar amounts are parsed as text like '1,500' and stored as floats.
+# 'numeric' columns are stored as floats when every value is a number and as
+# text otherwise, the same types pd.read_csv infers for them, so the features
+# built from a typed file match those built from a csv.
+PARSED_DTYPES = {column: 'str' for column in PARSED_COLUMNS}
+PARSED_DTYPES.update({
+    'InsurancePolicyPatientEligibilityId': 'Int64',
+    'InsuranceEligibilityAuditId': 'Int64',
+    'GroupNumber': 'numeric',
+    'SubscriberZip': 'numeric',
+    'LifetimeMax_InNetwork': 'float64',
+    'LifetimeMax_OutNetwork': 'float64',
+    'LifetimeUsed_InNetwork': 'float64',
+    'LifetimeUsed_OutNetwork': 'float64',
+    'LifetimeRemaining_InNetwork': 'float64',
+    'LifetimeRemaining_OutNetwork': 'float64',
+    'WaitPeriod': 'boolean',
+    'CoIns_InNetwork': 'float64',
+    'CoIns_OutNetwork': 'float64',
+})
+
 
 def find_next_sibling(soup, element_type, text, sibling_type, n_steps=1):
     """ Find the text in the sibling element that comes (n_steps) after the
@@ -44,77 +127,21 @@ def find_next_sibling(soup, element_type, text, sibling_type, n_steps=1):
     return None
 
 
-def parse_provider_table(soup):
-    data = {}
-
-    # Find the Provider table
-    provider_table = soup.find(id='providerTable')
-    if not provider_table:
-        return data
-
-    data['ProviderName'] = find_next_sibling(
-        provider_table, 'th', 'Provider', 'td'
-    )
-    data['ProviderAddress'] = find_next_sibling(
-        provider_table, 'th', 'Address', 'td'
-    )
-    data['ProviderId'] = find_next_sibling(
-        provider_table, 'th', 'Provider ID', 'td'
-    )
-    data['ProviderTaxId'] = find_next_sibling(
-        provider_table, 'th', 'Tax ID', 'td'
-    )
-
-    return data
+def parse_city_state_zip(text):
+    """ Split the second line of a subscriber address, formatted as
+    'City, ST 12345', into its parts.
 
+    Args:
+        text (str): the text of the second address line.
 
-def parse_subscriber_table(soup):
+    Returns:
+        A dictionary containing the parsed city, state and zip. If the state
+        and zip are not in the expected format the unformatted parts are
+        stored under 'SubscriberAddress2' instead.
+    """
     data = {}
 
-    # Find the Subscriber table
-    subscriber_table = soup.find(id='subscriberTable')
-    if not subscriber_table:
-        return data
-
-    data['SubscriberPatientName'] = find_next_sibling(
-        subscriber_table, 'th', 'Patient Name', 'td'
-    )
-    data['SubscriberMemberId'] = find_next_sibling(
-        subscriber_table, 'th', 'Member ID', 'td'
-    )
-    data['SubscriberSSN'] = find_next_sibling(
-        subscriber_table, 'th', 'SSN', 'td'
-    )
-    data['GroupNumber'] = find_next_sibling(
-        subscriber_table, 'th', 'Group Number', 'td'
-    )
-    data['GroupName'] = find_next_sibling(
-        subscriber_table, 'th', 'Group Name', 'td'
-    )
-    data['SubscriberDOB'] = find_next_sibling(
-        subscriber_table, 'th', 'Date of Birth', 'td'
-    )
-    data['SubscriberSex'] = find_next_sibling(
-        subscriber_table, 'th', 'Gender', 'td'
-    )
-    data['SubscriberAddress'] = find_next_sibling(
-        subscriber_table, 'th', 'Address', 'td'
-    )
-
-    # Parse the City, State, and zip
-    address = subscriber_table.find('th', text=re.compile(r'Address'))
-    if not address:
-        return data
-
-    address2 = address.parent.next_sibling
-    if not address2:
-        return data
-
-    address2 = address2.find('td')
-    if not address2:
-        return data
-
-    address2 = address2.text.split(',')
+    address2 = text.split(',')
     data['SubscriberCity'] = address2[0]
 
     # Filter out any extra spaces
@@ -131,142 +158,781 @@ def parse_subscriber_table(soup):
     return data
 
 
-def parse_coverage_type_table(soup):
-    data = {}
+def clean_coverage_type(coverage):
+    """ Clean up the text of the coverage type cell.
 
-    # Find the Coverage Type table
-    coverage_table = soup.find(id='coveragesTable')
-    if not coverage_table:
-        return data
+    Args:
+        coverage (str): the text of the first cell in the coverages table.
 
-    coverage = coverage_table.find('td').text
+    Returns:
+        The cleaned coverage type, or MISSING if it should not be recorded.
+    """
     if coverage.find('br'):
         coverage = re.sub('<br/>', ', ', str(coverage))
-        data['CoverageType'] = BeautifulSoup(coverage, 'lxml').text
+        return html_text(coverage)
 
-    return data
+    return MISSING
 
 
-def parse_coverage_dates_table(soup):
-    data = {}
+@lru_cache(maxsize=1024)
+def html_text(html):
+    """ Get the text of an html snippet. Cached since the same few coverage
+    types come up in almost every response.
+    """
+    return BeautifulSoup(html, 'lxml').text
 
-    # Find Coverage Dates table
-    coverage_dates_table = soup.find(id='coverageDatesTable')
-    if not coverage_dates_table:
-        return data
 
-    elem = coverage_dates_table.find(
-        'td', text=re.compile(r'Policy Effective')
-    )
-    if elem:
-        data['SubscriberPlanEffectiveDateStart'] = elem.text.split(' ')[-1]
-
-    elem = coverage_dates_table.find(
-        'td', text=re.compile(r'Policy Expiration')
-    )
-    if elem:
-        data['SubscriberPlanEffectiveDateEnd'] = elem.text.split(' ')[-1]
-
-    elem = coverage_dates_table.find(
-        'td', text=re.compile(r'Plan Begin Date')
-    )
-    if elem:
-        data['PlanBenefitsStart'] = elem.text.split(' ')[-1]
-
-    elem = coverage_dates_table.find(
-        'td', text=re.compile(r'Plan End')
-    )
-    if elem:
-        data['PlanBenefitsEnd'] = elem.text.split(' ')[-1]
+def last_word(text):
+    """ Get the last space separated word of a cell, e.g. the date in
+    'Policy Effective: 01/01/2017'.
+    """
+    return text.split(' ')[-1]
+
 
-    return data
+def strip_currency(text):
+    """ Strip the leading '$' from a dollar amount. """
+    return text[1:]
 
 
-def parse_maximums_table(soup):
+def percent_to_fraction(text):
+    """ Convert a percentage such as '50%' to a fraction. Cells that are not
+    percentages are not recorded.
+    """
+    if '%' in text:
+        return int(text[:-1])/100
+    return MISSING
+
+
+# Marks a field that should be left out of the parsed data
+MISSING = object()
+
+# A field to extract from an html table.
+#
+# The anchor cell is the first 'anchor' ('th' or 'td') cell in the table whose
+# string matches the 'label' regex, or simply the first 'anchor' cell if label
+# is None. The value cell is then found relative to the anchor:
+#   - row is None and sibling is None: the anchor cell itself.
+#   - row is None: the (n_steps)th 'sibling' element after the anchor cell,
+#     like find_next_sibling.
+#   - row is an int: the first 'sibling' cell in the row that is (row) rows
+#     after the anchor's row. 'sibling' may include a css class, e.g.
+#     'td.inNetwork'.
+# The text of the value cell is passed through 'post' (if given) and stored
+# under 'column'. If column is None, post must return a dictionary of columns.
+# If the anchor or value cell can't be found then 'default' is stored. Fields
+# whose value is MISSING are left out.
+FieldSpec = namedtuple(
+    'FieldSpec',
+    ['column', 'anchor', 'label', 'sibling', 'n_steps', 'row', 'post', 'default']
+)
+
+
+def field(column, anchor, label, sibling='td', n_steps=1, row=None,
+          post=None, default=None):
+    """ Build a FieldSpec, compiling its label. """
+    if label is not None:
+        label = re.compile(r'{}'.format(label))
+    return FieldSpec(column, anchor, label, sibling, n_steps, row, post, default)
+
+
+# The fields parsed from each table, keyed by table id
+FIELD_SPECS = {
+    'payerTable': [
+        field('CarrierName_HTML', 'th', 'Payer Name'),
+        field('TransactionId', 'th', 'Transaction ID'),
+    ],
+    'providerTable': [
+        field('ProviderName', 'th', 'Provider'),
+        field('ProviderAddress', 'th', 'Address'),
+        field('ProviderId', 'th', 'Provider ID'),
+        field('ProviderTaxId', 'th', 'Tax ID'),
+    ],
+    'subscriberTable': [
+        field('SubscriberPatientName', 'th', 'Patient Name'),
+        field('SubscriberMemberId', 'th', 'Member ID'),
+        field('SubscriberSSN', 'th', 'SSN'),
+        field('GroupNumber', 'th', 'Group Number'),
+        field('GroupName', 'th', 'Group Name'),
+        field('SubscriberDOB', 'th', 'Date of Birth'),
+        field('SubscriberSex', 'th', 'Gender'),
+        field('SubscriberAddress', 'th', 'Address'),
+        # The City, State, and zip are in the row after the address
+        field(None, 'th', 'Address', row=1, post=parse_city_state_zip,
+              default=MISSING),
+    ],
+    'coveragesTable': [
+        field('CoverageType', 'td', None, sibling=None,
+              post=clean_coverage_type, default=MISSING),
+    ],
+    'coverageDatesTable': [
+        field('SubscriberPlanEffectiveDateStart', 'td', 'Policy Effective',
+              sibling=None, post=last_word, default=MISSING),
+        field('SubscriberPlanEffectiveDateEnd', 'td', 'Policy Expiration',
+              sibling=None, post=last_word, default=MISSING),
+        field('PlanBenefitsStart', 'td', 'Plan Begin Date',
+              sibling=None, post=last_word, default=MISSING),
+        field('PlanBenefitsEnd', 'td', 'Plan End',
+              sibling=None, post=last_word, default=MISSING),
+    ],
+    # The orthodontics lifetime max, used and remaining are in consecutive
+    # rows starting at the orthodontics row
+    'maximumsTable': [
+        field(name + suffix, 'td', 'Orthodontics', sibling='td.' + network,
+              row=row, post=strip_currency, default=MISSING)
+        for row, name in enumerate(
+            ['LifetimeMax', 'LifetimeUsed', 'LifetimeRemaining']
+        )
+        for suffix, network in [('_InNetwork', 'inNetwork'),
+                                ('_OutNetwork', 'outNetwork')]
+    ],
+    'planProvisionsTable': [
+        field('WaitPeriod', 'td', 'Waiting Period does not apply.',
+              sibling=None, post=lambda text: False, default=True),
+    ],
+    'coInsuranceTable': [
+        field('CoIns_InNetwork', 'td', 'Orthodontics', sibling='td.inNetwork',
+              row=0, post=percent_to_fraction, default=MISSING),
+        field('CoIns_OutNetwork', 'td', 'Orthodontics', sibling='td.outNetwork',
+              row=0, post=percent_to_fraction, default=MISSING),
+    ],
+}
+
+
+def extract_fields(table, specs):
+    """ Extract the fields described by a list of FieldSpecs from a table.
+
+    Args:
+        table (Bs4Table or LxmlTable): the indexed table.
+        specs (list of FieldSpec): the fields to extract.
+
+    Returns:
+        A dictionary of the extracted values.
+    """
     data = {}
+    for spec in specs:
+        value = extract_field(table, spec)
+        if value is MISSING:
+            continue
+        if spec.column is None:
+            data.update(value)
+        else:
+            data[spec.column] = value
 
-    # Find Maximums table
-    maximums_table = soup.find(id='maximumsTable')
-    if not maximums_table:
-        return data
+    return data
 
-    # Find orthodontics row
-    elem = maximums_table.find('td', text=re.compile(r'Orthodontics'))
-    if not elem:
-        return data
 
-    # Find in-network orthodontics lifetime max
-    row = elem.parent
-    lifetime_max = row.find('td', {'class': 'inNetwork'})
-    if lifetime_max:
-        data['LifetimeMax_InNetwork'] = lifetime_max.text[1:]
-    # Find out-of-network orthodontics lifetime max
-    lifetime_max = row.find('td', {'class': 'outNetwork'})
-    if lifetime_max:
-        data['LifetimeMax_OutNetwork'] = lifetime_max.text[1:]
-
-    # Find in-network orthodontics lifetime used
-    row = row.next_sibling
-    if not row:
-        return data
+def extract_field(table, spec):
+    """ Extract the value of a single FieldSpec from a table.
 
-    lifetime_used = row.find('td', {'class': 'inNetwork'})
-    if lifetime_used:
-        data['LifetimeUsed_InNetwork'] = lifetime_used.text[1:]
-    lifetime_used = row.find('td', {'class': 'outNetwork'})
-    if lifetime_used:
-        data['LifetimeUsed_OutNetwork'] = lifetime_used.text[1:]
+    Args:
+        table (Bs4Table or LxmlTable): the indexed table.
+        spec (FieldSpec): the field to extract.
 
-    # Find in-network orthodontics lifetime remaining
-    row = row.next_sibling
-    if not row:
-        return data
+    Returns:
+        The value of the field, spec.default if it can't be found.
+    """
+    anchor = table.find(spec.anchor, spec.label)
+    if anchor is None:
+        return spec.default
+
+    if spec.row is not None:
+        row = table.row(anchor, spec.row)
+        if row is None:
+            return spec.default
+        sibling_type, _, class_name = spec.sibling.partition('.')
+        cell = table.find_in_row(row, sibling_type, class_name or None)
+    elif spec.sibling is not None:
+        cell = table.next_sibling(anchor, spec.sibling, spec.n_steps)
+    else:
+        cell = anchor
+
+    if cell is None:
+        return spec.default
+
+    text = table.text(cell)
+    return text if spec.post is None else spec.post(text)
+
+
+class Bs4Table(object):
+    """ An index over one html table parsed with BeautifulSoup. The header
+    and data cells of the table are collected once, along with their
+    strings, so each label lookup is a scan over a short list rather than a
+    search of the tree.
+
+    Args:
+        table (BeautifulSoup Tag): the table element.
+    """
+
+    def __init__(self, table):
+        self.cells = {'th': [], 'td': []}
+        for elem in table.find_all(['th', 'td']):
+            self.cells[elem.name].append((elem.string, elem))
+
+    def find(self, element_type, pattern):
+        """ Find the first cell of the given type whose string matches the
+        pattern, like table.find(element_type, text=pattern).
+
+        Args:
+            element_type (str): 'th' or 'td'.
+            pattern (compiled regex or None): the pattern to search the
+                                              string for. If None the first
+                                              cell is returned.
+
+        Returns:
+            The matching element if it exists. None otherwise.
+        """
+        for string, elem in self.cells[element_type]:
+            if pattern is None or (string is not None and pattern.search(string)):
+                return elem
+        return None
 
-    lifetime_remaining = row.find('td', {'class': 'inNetwork'})
-    if lifetime_remaining:
-        data['LifetimeRemaining_InNetwork'] = lifetime_remaining.text[1:]
-    # Find out-of-network orthodontics lifetime remaining
-    lifetime_remaining = row.find('td', {'class': 'outNetwork'})
-    if lifetime_remaining:
-        data['LifetimeRemaining_OutNetwork'] = lifetime_remaining.text[1:]
+    def next_sibling(self, elem, sibling_type, n_steps=1):
+        steps = 1
+        for sibling in elem.next_siblings:
+            if sibling.name == sibling_type:
+                if steps == n_steps:
+                    return sibling
+                else:
+                    steps += 1
+        return None
 
-    return data
+    def row(self, elem, offset):
+        row = elem.parent
+        for _ in range(offset):
+            row = row.next_sibling
+            if not isinstance(row, Tag):
+                return None
+        return row
+
+    def find_in_row(self, row, element_type, class_name=None):
+        if class_name is None:
+            return row.find(element_type)
+        return row.find(element_type, {'class': class_name})
+
+    def text(self, elem):
+        return elem.text
+
+
+class LxmlTable(Bs4Table):
+    """ An index over one html table parsed with lxml. Lookups follow the
+    same rules as Bs4Table so that both backends return the same values.
+
+    Args:
+        table (lxml.html.HtmlElement): the table element.
+    """
+
+    def __init__(self, table):
+        self.cells = {'th': [], 'td': []}
+        for elem in table.iter('th', 'td'):
+            self.cells[elem.tag].append((element_string(elem), elem))
+
+    def next_sibling(self, elem, sibling_type, n_steps=1):
+        steps = 1
+        for sibling in elem.itersiblings():
+            if sibling.tag == sibling_type:
+                if steps == n_steps:
+                    return sibling
+                else:
+                    steps += 1
+        return None
+
+    def row(self, elem, offset):
+        row = elem.getparent()
+        for _ in range(offset):
+            # Text between rows is the next sibling as far as BeautifulSoup
+            # is concerned, so there is no next row
+            if row.tail:
+                return None
+            row = row.getnext()
+            if row is None or not isinstance(row.tag, str):
+                return None
+        return row
+
+    def find_in_row(self, row, element_type, class_name=None):
+        for child in row.iter(element_type):
+            if child is row:
+                continue
+            if class_name is None or class_name in (child.get('class') or '').split():
+                return child
+        return None
+
+    def text(self, elem):
+        return elem.text_content()
+
+
+def element_string(elem):
+    """ Get the single string held by an lxml element, following the rules
+    of BeautifulSoup's Tag.string: an element with one child delegates to
+    that child, and an element with mixed or multiple children has none.
+
+    Args:
+        elem (lxml element): the element.
+
+    Returns:
+        The string if there is exactly one. None otherwise.
+    """
+    children = list(elem)
+    if not children:
+        return elem.text
+    if len(children) == 1 and not elem.text and not children[0].tail:
+        return element_string(children[0])
+    return None
+
+
+def parse_table(soup, table_id):
+    """ Parse the fields in FIELD_SPECS from one table of an html response.
+
+    Args:
+        soup (BeautifulSoup object): the html to be parsed.
+        table_id (str): the id of the table.
+
+    Returns:
+        A dictionary of the parsed values. Empty if the table doesn't exist.
+    """
+    with timer(TABLE_TIMER_PREFIX + table_id):
+        table = soup.find(id=table_id)
+        if not table:
+            return {}
+
+        return extract_fields(Bs4Table(table), FIELD_SPECS[table_id])
+
+
+def parse_provider_table(soup):
+    return parse_table(soup, 'providerTable')
+
+
+def parse_subscriber_table(soup):
+    return parse_table(soup, 'subscriberTable')
+
+
+def parse_coverage_type_table(soup):
+    return parse_table(soup, 'coveragesTable')
+
+
+def parse_coverage_dates_table(soup):
+    return parse_table(soup, 'coverageDatesTable')
+
+
+def parse_maximums_table(soup):
+    return parse_table(soup, 'maximumsTable')
 
 
 def parse_plan_provisions_table(soup):
-    data = {}
+    return parse_table(soup, 'planProvisionsTable')
+
+
+def parse_coverage_table(soup):
+    return parse_table(soup, 'coInsuranceTable')
+
+
+def find_tables(soup):
+    """ Find and index each of the known tables (see TABLE_IDS) in an html
+    response parsed with BeautifulSoup.
+
+    Args:
+        soup (BeautifulSoup object): the html to be parsed.
+
+    Returns:
+        A dictionary mapping each table id found in the response to a
+        Bs4Table.
+    """
+    tables = {}
+    for elem in soup.find_all(id=list(TABLE_IDS)):
+        if elem['id'] not in tables:
+            tables[elem['id']] = Bs4Table(elem)
+
+    return tables
+
+
+def parse_html_tables(html):
+    """ Parse an html response once with lxml and index each of the known
+    tables (see TABLE_IDS).
 
-    # Find Plan Provisions table
-    plan_provisions_table = soup.find(id='planProvisionsTable')
-    if plan_provisions_table:
-        if plan_provisions_table.find('td', text=re.compile(r'Waiting Period does not apply.')):
-            data['WaitPeriod'] = False
+    Args:
+        html (str): the html response.
+
+    Returns:
+        A dictionary mapping each table id found in the response to an
+        LxmlTable.
+    """
+    doc = lxml.html.document_fromstring(html)
+
+    tables = {}
+    for elem in doc.iter():
+        table_id = elem.get('id') if isinstance(elem.tag, str) else None
+        if table_id in TABLE_IDS and table_id not in tables:
+            tables[table_id] = LxmlTable(elem)
+
+    return tables
+
+
+class FastPathMiss(Exception):
+    """ Raised when the regex fast path can't be sure it would parse an html
+    response the same way as BeautifulSoup. """
+    pass
+
+
+class RegexCell(object):
+    """ A th or td cell read by the regex fast path. """
+
+    def __init__(self, tag, classes, string, text, row, position):
+        self.tag = tag
+        self.classes = classes
+        self.string = string
+        self.text = text
+        self.row = row
+        self.position = position
+
+
+class RegexRow(object):
+    """ A table row read by the regex fast path. """
+
+    def __init__(self, index, section, tail):
+        self.index = index
+        self.section = section
+        self.tail = tail
+        self.cells = []
+
+
+_TABLE_RE = re.compile(
+    r'<table\b[^>]*?(?<![-\w])id\s*=\s*(["\']?)(\w+)\1[^>]*>(.*?)</table\s*>',
+    re.IGNORECASE | re.DOTALL
+)
+_TR_RE = re.compile(r'<tr\b[^>]*>(.*?)</tr\s*>', re.IGNORECASE | re.DOTALL)
+_CELL_RE = re.compile(
+    r'<(th|td)\b([^>]*)>(.*?)</\1\s*>', re.IGNORECASE | re.DOTALL
+)
+_SECTION_RE = re.compile(r'</?t(?:head|body|foot)\b[^>]*>', re.IGNORECASE)
+_CLASS_RE = re.compile(
+    r'\bclass\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|([^\s"\'>]+))', re.IGNORECASE
+)
+_WRAPPED_RE = re.compile(r'^<(\w+)\b[^>]*>([^<]*)</\1\s*>$')
+_BR_RE = re.compile(r'<br\s*/?>', re.IGNORECASE)
+_NESTED_RE = re.compile(r'<(?:t[dhr]|table|!|script|style)\b', re.IGNORECASE)
+_ENTITY_RE = re.compile(r'&(?:(amp|lt|gt|quot|nbsp)|#(\d+)|#[xX]([0-9a-fA-F]+));')
+_CONTROL_RE = re.compile('[\x00-\x08\x0b-\x1f\x7f]')
+
+
+def _unescape(text):
+    """ Decode the entities in cell text, raising FastPathMiss for any that
+    lxml might decode differently. """
+    if '&' not in text:
+        return text
+
+    decoded = []
+    last = 0
+    for match in _ENTITY_RE.finditer(text):
+        if '&' in text[last:match.start()]:
+            raise FastPathMiss('Unrecognized entity')
+
+        name, decimal, hexadecimal = match.groups()
+        if name:
+            char = {'amp': '&', 'lt': '<', 'gt': '>', 'quot': '"',
+                    'nbsp': '\xa0'}[name]
         else:
-            data['WaitPeriod'] = True
+            code = int(decimal) if decimal else int(hexadecimal, 16)
+            if not (32 <= code < 127 or 160 <= code < 0xd800):
+                raise FastPathMiss('Unusual character reference')
+            char = chr(code)
+        decoded.append(text[last:match.start()])
+        decoded.append(char)
+        last = match.end()
 
-    return data
+    if '&' in text[last:]:
+        raise FastPathMiss('Unrecognized entity')
+    decoded.append(text[last:])
 
+    return ''.join(decoded)
 
-def parse_coverage_table(soup):
-    data = {}
 
-    # Find Coverage table
-    coverage_table = soup.find(id='coInsuranceTable')
-    if not coverage_table:
-        return data
+def _cell_contents(inner):
+    """ Get the BeautifulSoup .string and .text of a cell's inner html.
 
-    # Find orthodontics row
-    elem = coverage_table.find('td', text=re.compile(r'Orthodontics'))
-    if not elem:
-        return data
+    Returns:
+        Tuple of the cell's string (None if it doesn't have exactly one) and
+        text.
+    """
+    if '<' not in inner:
+        text = _unescape(inner)
+        return (text or None), text
 
-    # Find in-network orthodontics co-insurance percentage
-    co_in = elem.parent.find('td', {'class': 'inNetwork'})
-    if co_in and '%' in co_in.text:
-        data['CoIns_InNetwork'] = int(co_in.text[:-1])/100
-    # Find out-of-network orthodontics co-insurance percentage
-    co_out = elem.parent.find('td', {'class': 'outNetwork'})
-    if co_out and '%' in co_out.text:
-        data['CoIns_OutNetwork'] = int(co_out.text[:-1])/100
+    match = _WRAPPED_RE.match(inner)
+    if match:
+        text = _unescape(match.group(2))
+        return (text or None), text
 
-    return data
+    parts = _BR_RE.split(inner)
+    if any('<' in part for part in parts):
+        raise FastPathMiss('Cell contains markup')
+
+    return None, _unescape(''.join(parts))
+
+
+class RegexTable(Bs4Table):
+    """ A table read straight from the html string with regular expressions,
+    without building a DOM. Only simple, well-formed tables are accepted;
+    anything the regexes can't read unambiguously raises FastPathMiss.
+    Lookups follow the same rules as Bs4Table.
+
+    Args:
+        content (str): the html between the table's opening and closing tags.
+    """
+
+    def __init__(self, content):
+        if _CONTROL_RE.search(content) or '\r' in content:
+            raise FastPathMiss('Unexpected characters in table')
+
+        self.rows = []
+        self.cells = {'th': [], 'td': []}
+
+        section = 0
+        pos = 0
+        for match in _TR_RE.finditer(content):
+            # Only whitespace and section tags may sit between rows
+            between = content[pos:match.start()]
+            outside_sections = _SECTION_RE.sub('', between)
+            if outside_sections.strip() or '<tr' in between.lower():
+                raise FastPathMiss('Unexpected content between rows')
+            if outside_sections != between:
+                section += 1
+            elif self.rows and between:
+                # BeautifulSoup treats text between rows as the next sibling
+                self.rows[-1].tail = True
+            pos = match.end()
+
+            row = RegexRow(len(self.rows), section, False)
+            self.rows.append(row)
+            self._read_cells(row, match.group(1))
+
+        if '<tr' in content[pos:].lower():
+            raise FastPathMiss('Unclosed row')
+
+    def _read_cells(self, row, html):
+        pos = 0
+        for match in _CELL_RE.finditer(html):
+            if html[pos:match.start()].strip():
+                raise FastPathMiss('Unexpected content between cells')
+            pos = match.end()
+
+            tag, attrs, inner = match.groups()
+            tag = tag.lower()
+            if _NESTED_RE.search(inner):
+                raise FastPathMiss('Nested cell')
+
+            classes = []
+            class_match = _CLASS_RE.search(attrs)
+            if class_match:
+                classes = next(g for g in class_match.groups() if g is not None).split()
+            elif 'class' in attrs.lower():
+                raise FastPathMiss('Unreadable class attribute')
+
+            string, text = _cell_contents(inner)
+            cell = RegexCell(tag, classes, string, text, row, len(row.cells))
+            row.cells.append(cell)
+            self.cells[tag].append((string, cell))
+
+        if html[pos:].strip():
+            raise FastPathMiss('Unexpected content after cells')
+
+    def next_sibling(self, elem, sibling_type, n_steps=1):
+        steps = 1
+        for sibling in elem.row.cells[elem.position + 1:]:
+            if sibling.tag == sibling_type:
+                if steps == n_steps:
+                    return sibling
+                else:
+                    steps += 1
+        return None
+
+    def row(self, elem, offset):
+        row = elem.row
+        for _ in range(offset):
+            if row.tail or row.index + 1 >= len(self.rows):
+                return None
+            next_row = self.rows[row.index + 1]
+            if next_row.section != row.section:
+                return None
+            row = next_row
+        return row
+
+    def find_in_row(self, row, element_type, class_name=None):
+        for cell in row.cells:
+            if cell.tag == element_type and (class_name is None or class_name in cell.classes):
+                return cell
+        return None
+
+    def text(self, elem):
+        return elem.text
+
+
+def regex_find_tables(html):
+    """ Read each of the known tables (see TABLE_IDS) straight from an html
+    response with regular expressions.
+
+    Args:
+        html (str): the html response.
+
+    Returns:
+        A dictionary mapping each table id found in the response to a
+        RegexTable.
+
+    Raises:
+        FastPathMiss if the response can't be read unambiguously.
+    """
+    tables = {}
+    found = []
+    for match in _TABLE_RE.finditer(html):
+        table_id = match.group(2)
+        if table_id not in TABLE_IDS:
+            continue
+        if table_id in tables or '<table' in match.group(3).lower():
+            raise FastPathMiss('Duplicate or nested table')
+        tables[table_id] = RegexTable(match.group(3))
+        found.append(table_id)
+
+    # An id that shows up anywhere else might belong to an element the
+    # regexes didn't match, which BeautifulSoup would find instead
+    for table_id in TABLE_IDS:
+        if html.count(table_id) != found.count(table_id):
+            raise FastPathMiss('Table id outside of a matched table')
+
+    return tables
+
+
+def parse_edi_response(datum, backend='bs4'):
+    """ Parse a single cleaned EDI response from the OF REST API into a
+    dictionary of values. The carrier is read from the payer table and the
+    remaining tables are only parsed if the carrier is MetLife.
+
+    Args:
+        datum (dict): a single record from the cleaned EDI data, containing
+                      the 'HtmlResponse' and the OF ID fields.
+
+    Keyword Arguments:
+        backend (str): 'bs4' to parse with BeautifulSoup, 'lxml' to parse
+                       each response once with lxml and read every table
+                       from a single traversal, or 'regex' to read the
+                       tables straight from the html string without building
+                       a DOM. All return the same values; 'lxml' and 'regex'
+                       fall back to BeautifulSoup for responses they can't
+                       handle.
+
+    Returns:
+        A dictionary of the parsed values, or None if the response does not
+        have a payer table.
+    """
+    return parse_edi_response_path(datum, backend)[0]
+
+
+def parse_edi_response_path(datum, backend='bs4'):
+    """ The same as parse_edi_response, but also reports which backend
+    actually parsed the response.
+
+    Returns:
+        Tuple of the parsed values (see parse_edi_response) and the name of
+        the backend used.
+    """
+    if backend not in BACKENDS:
+        raise ValueError('Unknown backend: {}'.format(backend))
+
+    values = {}
+    if datum['InsurancePolicyPatientEligibilityId']:
+        values['InsurancePolicyPatientEligibilityId'] = datum['InsurancePolicyPatientEligibilityId']
+    if datum['InsuranceEligibilityAuditId']:
+        values['InsuranceEligibilityAuditId'] = datum['InsuranceEligibilityAuditId']
+
+    tables = None
+    if backend == 'regex':
+        try:
+            with timer('parse.find_tables.regex'):
+                tables = regex_find_tables(datum['HtmlResponse'])
+        except FastPathMiss:
+            # Let BeautifulSoup handle anything out of the ordinary
+            count('parse.fallback.regex')
+    elif backend == 'lxml':
+        try:
+            with timer('parse.find_tables.lxml'):
+                tables = parse_html_tables(datum['HtmlResponse'])
+        except (lxml.etree.ParserError, ValueError):
+            # lxml refuses some documents BeautifulSoup accepts (e.g. empty
+            # responses), so use the BeautifulSoup backend for those
+            count('parse.fallback.lxml')
+
+    if tables is None:
+        backend = 'bs4'
+        with timer('parse.find_tables.bs4'):
+            tables = find_tables(BeautifulSoup(datum['HtmlResponse'], 'lxml'))
+
+    count('parse.path.' + backend)
+    return parse_tables(values, tables), backend
+
+
+def validate_backend(data, backend='regex'):
+    """ Compare a backend against BeautifulSoup on a sample of responses.
+
+    Args:
+        data (iterable of dict): records from the cleaned EDI data.
+
+    Keyword Arguments:
+        backend (str): the backend to check.
+
+    Returns:
+        Tuple of a Counter of the backend used for each record and a list of
+        (InsuranceEligibilityAuditId, backend values, bs4 values) tuples for
+        every record where the values differ.
+    """
+    paths = Counter()
+    mismatches = []
+    for datum in data:
+        values, path = parse_edi_response_path(datum, backend)
+        paths[path] += 1
+        if path != 'bs4':
+            expected = parse_edi_response(datum)
+            if values != expected:
+                mismatches.append(
+                    (datum['InsuranceEligibilityAuditId'], values, expected)
+                )
+
+    return paths, mismatches
+
+
+def parse_tables(values, tables):
+    """ Parse the indexed tables of an html response.
+
+    Args:
+        values (dict): the values parsed so far, updated in place.
+        tables (dict): the indexed tables, from find_tables or
+                       parse_html_tables.
+
+    Returns:
+        The updated values, or None if there is no payer table.
+    """
+    # Figure out which carrier this is
+    if 'payerTable' not in tables:
+        count('parse.no_payer_table')
+        return None
+    with timer(TABLE_TIMER_PREFIX + 'payerTable'):
+        values.update(extract_fields(tables['payerTable'], FIELD_SPECS['payerTable']))
+
+    # Double check to see if carrier is metlife before parsing the rest
+    if is_metlife(values):
+        for table_id in TABLE_IDS:
+            if table_id != 'payerTable' and table_id in tables:
+                with timer(TABLE_TIMER_PREFIX + table_id):
+                    values.update(extract_fields(tables[table_id], FIELD_SPECS[table_id]))
+
+    return values
+
+
+def is_metlife(values):
+    """ Check whether parsed values came from a MetLife response.
+
+    Args:
+        values (dict): the values returned by parse_edi_response.
+
+    Returns:
+        Boolean - True if the payer name in the HTML is MetLife. False if the
+        payer table has no payer name.
+    """
+    carrier = values.get('CarrierName_HTML')
+    return bool(carrier and re.search('metlife', carrier, re.IGNORECASE))
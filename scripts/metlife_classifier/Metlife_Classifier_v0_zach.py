@@ -65,35 +65,11 @@ def build_set(sql_loc, html_loc):
     # Drop entries that with no InsurancePolicyPatientEligibilityId from HTML parsed data
     df_html = df_html[df_html['InsurancePolicyPatientEligibilityId'].notnull()]
 
-    ## Parse out file containing duplicate patient IDs
-    patientID = df_html['InsurancePolicyPatientEligibilityId']
-
-    # Count occurance of individual patient IDs on uncleaned data
-    from collections import Counter
-    patientIDcnt = Counter(patientID)
-
-    # Loop to add up total duplicate checks & save index of duplicate IDs
-    patcntlist = list(patientIDcnt.values())
-    dupIDindex = [i for i in range(len(patcntlist)) if patcntlist[i] >1]
-
-    # Pull duplicate patient IDs using index from above
-    IDlist = list(patientIDcnt.keys())
-    dupIDlist = [IDlist[i] for i in dupIDindex]
-
-    # Pull full records for duplicate patient IDs
-    duplicate = pd.DataFrame()
-    for i in range(len(dupIDlist)):
-        loopdata = df_html.loc[lambda df: df.InsurancePolicyPatientEligibilityId == dupIDlist[i]]
-        duplicate = duplicate.append(loopdata)
-
-    # Get indexes of duplicate values
-    dropind =[duplicate.index[i] for i in range(len(duplicate))]
+    ## Drop every record of patient IDs that occur more than once
+    df_html = df_html[
+        ~df_html['InsurancePolicyPatientEligibilityId'].duplicated(keep=False)
+    ]
 
-    # Drop the duplicates based on idexes
-    for i in range(len(dropind)):
-        df_html.drop(dropind[i],inplace=True)
-    ##
-        
     # Join the datatables
     df_joined = pd.merge(
         df_html,
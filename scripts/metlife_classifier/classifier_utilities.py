@@ -0,0 +1,128 @@
+import resource
+import time
+import numpy as np
+import pandas as pd
+
+
+def peak_memory_mb():
+    """A function to get the peak resident memory of this process so far
+
+    Returns:
+        Float - the peak resident set size in megabytes
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def fit_extra_trees(X, Y, n_estimators=1000, stage_size=None, n_jobs=1,
+                    random_state=None, min_oob_improvement=None):
+    """A function to train the ExtraTrees classifier, optionally growing the
+    forest in stages and reporting the out-of-bag score after each one
+
+    Args:
+        X (numpy ndarray): the training features.
+        Y (numpy ndarray): the training targets.
+
+    Keyword Arguments:
+        n_estimators (int): the number of trees in the finished forest.
+        stage_size (int): the number of trees added in each stage. Defaults
+                          to growing the whole forest in a single stage,
+                          without an out-of-bag score.
+        n_jobs (int): the number of cores used to grow the trees (-1 for
+                      all cores).
+        random_state (int): the random seed. With a fixed seed the staged
+                            forest is the same as the one grown in a single
+                            stage.
+        min_oob_improvement (float): stop growing the forest once a stage
+                                     improves the out-of-bag score by less
+                                     than this. Defaults to growing all
+                                     n_estimators trees.
+
+    Returns:
+        clf (ExtraTreesClassifier): the trained classifier
+        stages (list of dicts): for each stage, the number of trees, the
+                                out-of-bag score (None if not staged), the
+                                wall time in seconds and the peak memory of
+                                the process in megabytes
+    """
+    from sklearn.ensemble import ExtraTreesClassifier
+
+    if stage_size:
+        sizes = list(range(stage_size, n_estimators, stage_size)) + [n_estimators]
+    else:
+        sizes = [n_estimators]
+
+    clf = ExtraTreesClassifier(
+        bootstrap=True,
+        n_estimators=sizes[0],
+        max_features=None,
+        n_jobs=n_jobs,
+        random_state=random_state,
+        warm_start=True,
+        oob_score=bool(stage_size)
+    )
+
+    stages = []
+    for size in sizes:
+        t1 = time.time()
+        clf.set_params(n_estimators=size)
+        clf.fit(X, Y)
+
+        stage = {
+            'n_estimators': size,
+            'oob_score': clf.oob_score_ if stage_size else None,
+            'seconds': time.time() - t1,
+            'peak_memory_mb': peak_memory_mb()
+        }
+        stages.append(stage)
+        print(
+            'Trained {n_estimators} trees in {seconds:.1f} seconds, '
+            'peak memory {peak_memory_mb:.0f} MB'.format(**stage) +
+            ('' if stage['oob_score'] is None
+             else ', out-of-bag score {:.4f}'.format(stage['oob_score']))
+        )
+
+        # Stop early once adding trees no longer helps
+        if (min_oob_improvement is not None and len(stages) > 1 and
+                stage['oob_score'] - stages[-2]['oob_score'] < min_oob_improvement):
+            print('Out-of-bag score improved by less than', min_oob_improvement,
+                  '- stopping at', size, 'trees')
+            break
+
+    # The finished classifier doesn't keep growing if it is fit again
+    clf.set_params(warm_start=False)
+
+    return clf, stages
+
+
+def predict_with_exclusions(clf, df, feature_columns, prefilter=True):
+    """A function to predict with the classifier, predicting 0 for the checks
+    that fall under an exclusion case
+
+    Args:
+        clf: the classifier, with a predict method.
+        df (Pandas DataFrame object): the cleaned data, with an Exclusion
+                                      column.
+        feature_columns (list of str): the features the classifier expects.
+
+    Keyword Arguments:
+        prefilter (boolean): only run the classifier on the checks that
+                             aren't excluded, instead of running it on every
+                             check and then overwriting the excluded ones.
+                             Both give the same predictions.
+
+    Returns:
+        Pandas Series object - the predictions, with the index of df
+    """
+    excluded = df['Exclusion'].astype(bool).values
+
+    if not prefilter:
+        predictions = clf.predict(df[feature_columns].values)
+        predictions[excluded] = 0
+        return pd.Series(predictions, index=df.index)
+
+    predictions = pd.Series(np.zeros(len(df), dtype=int), index=df.index)
+    if not excluded.all():
+        predicted = clf.predict(df.loc[~excluded, feature_columns].values)
+        predictions = predictions.astype(predicted.dtype)
+        predictions[~excluded] = predicted
+    return predictions
@@ -0,0 +1,130 @@
+import pandas as pd
+from datetime import date
+
+
+# Format of the dates in the OF SQL export and in the EDI html, e.g.
+# PatientDateOfBirth and the coverage dates
+DATE_FORMAT = '%m/%d/%Y'
+
+# Date that ages are calculated at when no as_of date is given. None means
+# today.
+REFERENCE_DATE = None
+
+# Largest number of distinct date strings kept in the parsed date cache
+DATE_CACHE_SIZE = 1000000
+
+# Parsed dates, by date string. The same dates of birth turn up again and
+# again (every check of a patient has one), so each distinct string is only
+# parsed once.
+_date_cache = {}
+
+
+def reference_date(as_of=None):
+    """A function to get the date that ages are calculated at
+
+    Keyword Arguments:
+        as_of (date): the date to use. Defaults to REFERENCE_DATE, or today
+                      if that isn't set.
+
+    Returns:
+        date - the reference date
+    """
+    if as_of is not None:
+        return as_of
+    if REFERENCE_DATE is not None:
+        return REFERENCE_DATE
+    return date.today()
+
+
+def parse_dates(values, errors='raise'):
+    """A function to convert date strings in DATE_FORMAT to datetimes,
+    parsing each distinct string once and caching the result
+
+    Args:
+        values (Pandas Series object): the date strings.
+
+    Keyword Arguments:
+        errors (str): 'raise' to raise a ValueError for a null or invalid
+                      date, or 'coerce' to return NaT for them.
+
+    Returns:
+        Pandas Series object - the datetimes, with the index of values
+    """
+    codes, uniques = pd.factorize(values)
+
+    new_values = [value for value in uniques if value not in _date_cache]
+    if new_values:
+        if len(_date_cache) + len(new_values) > DATE_CACHE_SIZE:
+            _date_cache.clear()
+        parsed = pd.to_datetime(
+            pd.Series(new_values, dtype=object),
+            format=DATE_FORMAT,
+            errors='coerce'
+        )
+        _date_cache.update(zip(new_values, parsed))
+
+    # Null values get the code -1, which takes the NaT at the end
+    parsed = pd.DatetimeIndex(
+        [_date_cache[value] for value in uniques] + [pd.NaT]
+    )
+    dates = pd.Series(parsed.take(codes), index=values.index)
+
+    if errors == 'raise':
+        unparsed = dates.isnull()
+        if unparsed.any():
+            raise ValueError(
+                'Invalid date: {!r}'.format(values[unparsed].iloc[0])
+            )
+
+    return dates
+
+
+def parse_date(value):
+    """A function to convert a single date string in DATE_FORMAT to a date,
+    using the same cache as parse_dates
+
+    Args:
+        value (str): the date string.
+
+    Returns:
+        date - the parsed date
+    """
+    return parse_dates(pd.Series([value], dtype=object))[0].date()
+
+
+def age_in_days(dates, as_of=None):
+    """A function to get the number of days from each date to the reference
+    date
+
+    Args:
+        dates (Pandas Series object): the datetimes, e.g. from parse_dates.
+
+    Keyword Arguments:
+        as_of (date): the date ages are calculated at (see reference_date).
+
+    Returns:
+        Pandas Series object - the number of days, null where dates is NaT
+    """
+    return (pd.Timestamp(reference_date(as_of)) - dates).dt.days
+
+
+def age_in_years(dates, as_of=None):
+    """A function to get the age in years, as a fraction, at the reference
+    date
+
+    Args:
+        dates (Pandas Series object): the datetimes, e.g. from parse_dates.
+
+    Keyword Arguments:
+        as_of (date): the date ages are calculated at (see reference_date).
+
+    Returns:
+        Pandas Series object - the ages, null where dates is NaT
+    """
+    return age_in_days(dates, as_of=as_of) / 365.25
+
+
+def clear_date_cache():
+    """A function to empty the parsed date cache """
+    _date_cache.clear()
+
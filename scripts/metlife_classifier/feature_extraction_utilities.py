@@ -1,6 +1,11 @@
+import json
+import os
 import pandas as pd
 import numpy as np
-from datetime import datetime, date
+from scipy.sparse import csr_matrix
+from date_utilities import age_in_days, age_in_years, parse_date, parse_dates, reference_date
+# From the EDI parsing scripts, which the entry scripts put on sys.path
+from instrumentation_utilities import timed
 
 
 def drop_columns(df, columns):
@@ -13,38 +18,264 @@ def drop_columns(df, columns):
     Returns:
         None - the dataframe is modified in place.
     """
-    for column in columns:
-        # Check to make sure the column is in the dataframe
-        if column in df.columns:
-            df.drop(column, axis=1, inplace=True)
+    # Check to make sure the columns are in the dataframe, and drop them all
+    # at once rather than copying the dataframe once per column
+    present = [column for column in dict.fromkeys(columns) if column in df.columns]
+    if present:
+        df.drop(present, axis=1, inplace=True)
 
 
-def build_set(sql_file, html_file):
-    """A function to combine various data sources into a single dataframe that
-    is used for EDI check classification
+def table_columns(filename, **kwargs):
+    """A function to get the column names of a csv, parquet or feather file
+    without reading its data.
 
     Args:
-        sql_file (str): the filename containing the OF SQL data.
-        html_file (str): the filename containing the parsed EDI HTML data.
+        filename (str): the file to read.
+
+    Keyword Arguments:
+        Passed on to pd.read_csv when reading a csv file.
 
     Returns:
-        Pandas DataFrame object - the dataframe containing the joined data
+        List of str - the column names, in file order. Duplicated csv column
+        names are numbered as pd.read_csv does ('X', 'X.1', ...).
     """
+    if filename.endswith('.parquet'):
+        import pyarrow.parquet
+        return pyarrow.parquet.read_schema(filename).names
+    if filename.endswith('.feather'):
+        import pyarrow.ipc
+        return pyarrow.ipc.open_file(filename).schema.names
+    return list(pd.read_csv(filename, nrows=0, **kwargs).columns)
 
-    # Load in the SQL query csv file
-    df_query = pd.read_csv(
-        sql_file,
-        low_memory=False,
-        encoding='ISO-8859-1'
-    )
 
-    # Load in the parsed HTML csv file
-    df_html = pd.read_csv(
-        html_file,
-        low_memory=False,
-        encoding='ISO-8859-1'
+def read_table(filename, columns=None, **kwargs):
+    """A function to read a dataframe from a csv, parquet or feather file,
+    depending on the file extension.
+
+    Args:
+        filename (str): the file to read.
+
+    Keyword Arguments:
+        columns (list of str): only read these columns. Defaults to reading
+                               every column.
+        Anything else is passed on to pd.read_csv when reading a csv file.
+
+    Returns:
+        Pandas DataFrame object - the data in the file
+    """
+    if filename.endswith('.parquet'):
+        return pd.read_parquet(filename, columns=columns)
+    if filename.endswith('.feather'):
+        return pd.read_feather(filename, columns=columns)
+    if columns is not None:
+        # Select the columns by position, so numbered duplicate column names
+        # can be selected too
+        header = table_columns(filename, encoding=kwargs.get('encoding'))
+        kwargs['usecols'] = sorted(header.index(column) for column in columns)
+    return pd.read_csv(filename, **kwargs)
+
+
+def iter_table(filename, chunksize, columns=None, **kwargs):
+    """A function to read a csv, parquet or feather file a chunk of rows at a
+    time, depending on the file extension.
+
+    Args:
+        filename (str): the file to read.
+        chunksize (int): the number of rows in each chunk. Feather files are
+                         read a record batch at a time instead.
+
+    Keyword Arguments:
+        columns (list of str): only read these columns. Defaults to reading
+                               every column.
+        Anything else is passed on to pd.read_csv when reading a csv file.
+
+    Returns:
+        A generator yielding a Pandas DataFrame object for each chunk
+    """
+    if filename.endswith('.parquet'):
+        import pyarrow.parquet
+        batches = pyarrow.parquet.ParquetFile(filename).iter_batches(
+            batch_size=chunksize, columns=columns
+        )
+        for batch in batches:
+            yield batch.to_pandas()
+    elif filename.endswith('.feather'):
+        import pyarrow.ipc
+        reader = pyarrow.ipc.open_file(filename)
+        for i in range(reader.num_record_batches):
+            df = reader.get_batch(i).to_pandas()
+            yield df if columns is None else df[columns]
+    else:
+        yield from read_table(
+            filename, columns=columns, chunksize=chunksize, **kwargs
+        )
+
+
+def write_table(df, filename):
+    """A function to write a dataframe to a csv, parquet or feather file,
+    depending on the file extension. Parquet and feather files keep the
+    column types, so they don't have to be inferred again when read.
+
+    Args:
+        df (Pandas DataFrame object): the dataframe to be written.
+        filename (str): the file to write.
+
+    Returns:
+        None
+    """
+    if filename.endswith('.parquet'):
+        df.to_parquet(filename, index=False)
+    elif filename.endswith('.feather'):
+        df.reset_index(drop=True).to_feather(filename)
+    else:
+        df.to_csv(filename, index=False)
+
+
+# Columns holding a single value reduced from the parsed in-network and
+# out-of-network HTML columns, mapped to the prefix of those columns
+NETWORK_COLUMNS = {
+    'LifeTimeRemainingValue': 'LifetimeRemaining',
+    'LifeTimeMaxValue': 'LifetimeMax',
+    'OrthoBenefitUsedLifetime': 'LifetimeUsed',
+    'CoIns': 'CoIns',
+}
+
+
+@timed('impute.reduce_network_values')
+def reduce_network_values(df):
+    """A function to reduce the in-network and out-of-network HTML values to
+    the one that applies to each check. The out-of-network value is used
+    when IsInNetwork is 0 and the in-network value otherwise (including when
+    IsInNetwork is null).
+
+    Args:
+        df (Pandas DataFrame object): the joined data.
+
+    Returns:
+        None - the columns in NETWORK_COLUMNS are added to the dataframe in
+        place.
+    """
+    out_of_network = (df['IsInNetwork'] == 0).fillna(False).to_numpy(dtype=bool)
+
+    for column, prefix in NETWORK_COLUMNS.items():
+        df[column] = df[prefix + '_InNetwork'].mask(
+            out_of_network,
+            df[prefix + '_OutNetwork']
+        )
+
+
+# Columns of the OF SQL export that are dropped during feature extraction
+# because they aren't useful, based on talks with OF
+UNUSED_COLUMNS = [
+    'InitialPaymentPercent',
+    'OrthoBenefitUsedLifetime',
+    'PlanPriority',
+    'IsMinMaxDependentsOnly',
+    'IsActive',
+    'IsActive.1',
+    'IsInNetwork',
+    'PracticeOverriddenBenefit',
+    'IsTerminated',
+    'TotalNumberOfAdjustments',
+    'TotalAdjustmentValue',
+    'BenefitPaidToDate',
+    'CurrentEstimatedAr',
+    'OrthoFiCalculatedBenefit',
+    'SubscriberAddress2',
+    'SubscriberMiddleInitial',
+    'SubscriberPhonePrimary',
+    'SubscriberPhoneSecondary',
+    'SubscriberSex',
+    'SubscriberSuffix',
+    'DeductibleOrthoLifetimeMax',
+    'ClaimStatus',
+    'HowManyElecChecks',
+    'AgeLimit'
+]
+
+# ID and date columns that are kept during feature extraction, based on OF
+# notes
+SAVED_COLUMNS = [
+    'InsurancePlanPriorityId',
+    'PayerId',
+    'PatientDateOfBirth',
+    'InsurancePolicyPatientEligibilityId'
+]
+
+# Datetime columns, dropped during feature extraction
+DATETIME_COLUMNS = [
+    'CreatedOn',
+    'CreatedOn.1',
+    'EligibilityCheckRequestedOn',
+    'EligibilityEndCheck',
+    'EligibilityStartCheck',
+    'PlanBenefitsEnd',
+    'PlanBenefitsStart',
+    'SubscriberPlanEffectiveDateStart',
+    'SubscriberPlanEffectiveDateEnd',
+    'SubscriberDOB',
+    'UpdatedOn',
+    'UpdatedOn.1',
+]
+
+# Columns of the OF SQL export that build_set needs even though they are
+# dropped during feature extraction
+BUILD_SET_COLUMNS = [
+    'InsurancePolicyPatientEligibilityId',
+    'IsInNetwork'
+]
+
+# Types of the OF SQL export columns used by the classifier. Columns that
+# aren't listed are read with inferred types.
+SQL_DTYPES = {
+    'InsurancePolicyPatientEligibilityId': 'float64',
+    'CarrierName': 'category',
+    'IsInNetwork': 'Int8',
+    'LifetimeMax': 'float64',
+    'LifetimeRemaining': 'float64',
+    'PatientDateOfBirth': 'object',
+    'StudentStatus': 'object',
+    'RelationshipToSubscriber': 'object',
+    'CoordinationOfBenefits': 'float64',
+    'IsPreAuthRequired': 'float32',
+    'AgeMax': 'float32',
+    'AgeMaxStudent': 'float32',
+    'InsurancePlanPriorityId': 'float64',
+    'PayerId': 'float64'
+}
+
+
+def is_used_sql_column(column):
+    """A function to check whether a column of the OF SQL export is used by
+    build_set or kept during feature extraction
+
+    Args:
+        column (str): the column name.
+
+    Returns:
+        Boolean - False if the column is always dropped.
+    """
+    if column in BUILD_SET_COLUMNS or column in SAVED_COLUMNS:
+        return True
+    return not (
+        column in UNUSED_COLUMNS or
+        column in DATETIME_COLUMNS or
+        column.endswith(('Id', 'Id.1'))
     )
 
+
+def prepare_html(df_html):
+    """A function to clean the parsed EDI HTML data before it is joined to
+    the OF SQL data
+
+    Args:
+        df_html (Pandas DataFrame object): the parsed EDI HTML data,
+                                           modified in place.
+
+    Returns:
+        None - the dataframe is modified in place.
+    """
+
     # Convert objects that should be floats to floats
     obj_2_float_col = [
         'LifetimeMax_InNetwork',
@@ -59,6 +290,21 @@ def build_set(sql_file, html_file):
         if df_html[col].dtype == 'object':
             df_html[col] = df_html[col].str.translate({ord(','): None}).astype('float')
 
+    # Typed (parquet or feather) parser output stores the OF ids as nullable
+    # Int64, which pd.merge can't join to the float64 key of the SQL data, so
+    # convert them to floats as read from csv
+    for col in ['InsurancePolicyPatientEligibilityId', 'InsuranceEligibilityAuditId']:
+        if col in df_html.columns and str(df_html[col].dtype) == 'Int64':
+            df_html[col] = df_html[col].astype('float64')
+
+    # Typed parser output stores WaitPeriod as a nullable boolean. Convert it
+    # to the True / False / NaN object column read from csv, which the
+    # exclusion flags and binarize_columns expect.
+    if 'WaitPeriod' in df_html.columns and str(df_html['WaitPeriod'].dtype) == 'boolean':
+        df_html['WaitPeriod'] = df_html['WaitPeriod'].astype(object).where(
+            df_html['WaitPeriod'].notnull(), np.nan
+        )
+
     # Drop some columns that are blank in HTML before determining query columns
     # to merge. Info for these columns is more complete in query
     html_col_drop = [
@@ -67,9 +313,90 @@ def build_set(sql_file, html_file):
     ]
     drop_columns(df_html, html_col_drop)
 
-    # Extract columns from query that are not in html
-    query_columns = list(set(df_query.columns)-set(df_html.columns))
-    query_columns.append('InsurancePolicyPatientEligibilityId')
+
+def query_columns(sql_file, html_columns):
+    """A function to determine the columns of the OF SQL data to join to the
+    parsed EDI HTML data
+
+    Args:
+        sql_file (str): the filename containing the OF SQL data.
+        html_columns (list of str): the columns of the prepared HTML data.
+
+    Returns:
+        List of str - the SQL columns that are not in the HTML data, leaving
+        out the ones that are always dropped, followed by the join column
+    """
+    columns = [
+        column
+        for column in table_columns(sql_file, encoding='ISO-8859-1')
+        if column not in html_columns and is_used_sql_column(column)
+    ]
+    columns.append('InsurancePolicyPatientEligibilityId')
+    return columns
+
+
+def read_query(sql_file, columns, chunksize=None):
+    """A function to read columns of the OF SQL data with the types in
+    SQL_DTYPES
+
+    Args:
+        sql_file (str): the filename containing the OF SQL data.
+        columns (list of str): the columns to read.
+
+    Keyword Arguments:
+        chunksize (int): read the data this many rows at a time.
+
+    Returns:
+        Pandas DataFrame object - the SQL data, or an iterator of dataframes
+        if a chunksize is given
+    """
+    dtype = {
+        column: dtype
+        for column, dtype in SQL_DTYPES.items()
+        if column in columns
+    }
+    if chunksize is not None:
+        return iter_table(
+            sql_file,
+            chunksize,
+            columns=columns,
+            encoding='ISO-8859-1',
+            dtype=dtype
+        )
+    return read_table(
+        sql_file,
+        columns=columns,
+        low_memory=False,
+        encoding='ISO-8859-1',
+        dtype=dtype
+    )
+
+
+@timed('build_set')
+def build_set(sql_file, html_file):
+    """A function to combine various data sources into a single dataframe that
+    is used for EDI check classification
+
+    Args:
+        sql_file (str): the filename containing the OF SQL data.
+        html_file (str): the filename containing the parsed EDI HTML data.
+
+    Either file may be a csv, parquet or feather file (see read_table).
+
+    Returns:
+        Pandas DataFrame object - the dataframe containing the joined data
+    """
+
+    # Load in the parsed HTML file
+    df_html = read_table(
+        html_file,
+        low_memory=False,
+        encoding='ISO-8859-1'
+    )
+    prepare_html(df_html)
+
+    # Load in only the columns of the SQL query file that are joined
+    df_query = read_query(sql_file, query_columns(sql_file, df_html.columns))
 
     # Drop entries that with no InsurancePolicyPatientEligibilityId from
     # parsed HTML data
@@ -85,45 +412,140 @@ def build_set(sql_file, html_file):
     # Join the datatables
     df_joined = pd.merge(
         df_html,
-        df_query[query_columns],
+        df_query,
         on='InsurancePolicyPatientEligibilityId',
         how='left'
     )
 
     # Reduce In/Out of network to appropriate value
-    df_joined['LifeTimeRemainingValue'] = [
-        row['LifetimeRemaining_OutNetwork']
-        if row['IsInNetwork'] == 0
-        else row['LifetimeRemaining_InNetwork']
-        for index, row in df_joined.iterrows()
-    ]
+    reduce_network_values(df_joined)
 
-    df_joined['LifeTimeMaxValue'] = [
-        row['LifetimeMax_OutNetwork']
-        if row['IsInNetwork'] == 0
-        else row['LifetimeMax_InNetwork']
-        for index, row in df_joined.iterrows()
-    ]
+    return df_joined
 
-    df_joined['OrthoBenefitUsedLifetime'] = [
-        row['LifetimeUsed_OutNetwork']
-        if row['IsInNetwork'] == 0
-        else row['LifetimeUsed_InNetwork']
-        for index, row in df_joined.iterrows()
-    ]
 
-    df_joined['CoIns'] = [
-        row['CoIns_OutNetwork']
-        if row['IsInNetwork'] == 0
-        else row['CoIns_InNetwork']
-        for index, row in df_joined.iterrows()
+# Number of rows read at a time by build_set_chunked
+JOIN_CHUNK_SIZE = 100000
+
+
+@timed('build_set')
+def build_set_chunked(sql_file, html_file, output_file,
+                      chunksize=JOIN_CHUNK_SIZE, index_side=None):
+    """A function to join the parsed EDI HTML data to the OF SQL data like
+    build_set, without holding both in memory. The smaller file is loaded
+    and indexed on InsurancePolicyPatientEligibilityId, the larger one is
+    streamed through it in chunks and the joined rows are appended to a csv
+    file as they are produced.
+
+    HTML rows with no or a duplicated InsurancePolicyPatientEligibilityId are
+    dropped and every other HTML row is kept, as in build_set. When the HTML
+    data is streamed the rows are written in the same order as build_set.
+    When the SQL data is streamed, matched rows are written in the order of
+    the SQL data, followed by the HTML rows with no match.
+
+    Args:
+        sql_file (str): the filename containing the OF SQL data.
+        html_file (str): the filename containing the parsed EDI HTML data.
+        output_file (str): the csv file to write the joined data to.
+
+    Keyword Arguments:
+        chunksize (int): the number of rows of the larger file read at a
+                         time.
+        index_side (str): 'html' or 'sql', the data to load and index.
+                          Defaults to the smaller file.
+
+    Returns:
+        Int - the number of joined rows written
+    """
+    key = 'InsurancePolicyPatientEligibilityId'
+
+    if index_side is None:
+        if os.path.getsize(html_file) <= os.path.getsize(sql_file):
+            index_side = 'html'
+        else:
+            index_side = 'sql'
+    if index_side not in ('html', 'sql'):
+        raise ValueError('index_side must be html or sql, not {!r}'.format(index_side))
+
+    # The prepared HTML columns, which determine the SQL columns to join
+    html_columns = [
+        column
+        for column in table_columns(html_file, encoding='ISO-8859-1')
+        if column not in ('GroupName', 'SubscriberSSN')
+    ]
+    sql_columns = query_columns(sql_file, html_columns)
+    columns = html_columns + [
+        column for column in sql_columns if column != key
+    ]
+    # Columns added by reduce_network_values
+    output_columns = columns + [
+        column for column in NETWORK_COLUMNS if column not in columns
     ]
 
-    return df_joined
+    n_rows = 0
+    header = True
+    with open(output_file, 'w') as f:
+
+        def write(df_joined):
+            nonlocal n_rows, header
+            reduce_network_values(df_joined)
+            df_joined[output_columns].to_csv(f, header=header, index=False)
+            n_rows += len(df_joined)
+            header = False
+
+        if index_side == 'sql':
+            # Find the IPPEIDs that occur more than once in the HTML data
+            html_ids = read_table(
+                html_file, columns=[key], encoding='ISO-8859-1'
+            )[key]
+            id_counts = html_ids.value_counts()
+            duplicate_ids = id_counts.index[id_counts > 1]
+            del html_ids, id_counts
+
+            df_query = read_query(sql_file, sql_columns)
+
+            for df_html in iter_table(html_file, chunksize, encoding='ISO-8859-1'):
+                prepare_html(df_html)
+                df_html = df_html[
+                    df_html[key].notnull() &
+                    ~df_html[key].isin(duplicate_ids)
+                ]
+                write(pd.merge(df_html, df_query, on=key, how='left'))
+
+        else:
+            df_html = read_table(
+                html_file,
+                low_memory=False,
+                encoding='ISO-8859-1'
+            )
+            prepare_html(df_html)
+            df_html = df_html[df_html[key].notnull()]
+            df_html = df_html.drop_duplicates([key], keep=False)
+            df_html = df_html.set_index(key, drop=False)
+            matched = np.zeros(len(df_html), dtype=bool)
+
+            for df_query in read_query(sql_file, sql_columns, chunksize=chunksize):
+                positions = df_html.index.get_indexer(df_query[key])
+                found = positions >= 0
+                if not found.any():
+                    continue
+                matched[positions[found]] = True
+                df_joined = df_html.iloc[positions[found]].reset_index(drop=True)
+                df_query = df_query[found].drop(key, axis=1).reset_index(drop=True)
+                write(pd.concat([df_joined, df_query], axis=1))
+
+            # Keep the HTML rows with no SQL data, as a left join would
+            write(df_html[~matched].reset_index(drop=True).reindex(columns=columns))
+
+        # Write the header even if there was nothing to join
+        if header:
+            pd.DataFrame(columns=output_columns).to_csv(f, index=False)
+
+    return n_rows
 
 
 def exclusion_case(dob, student_status, pre_auth, age_max, age_max_student,
-                   wait_period, lifetime_max_value, lifetime_remaining_value):
+                   wait_period, lifetime_max_value, lifetime_remaining_value,
+                   as_of=None):
     """Determine whether a given EDI check should be classified by one of the
     exclusion cases.
 
@@ -136,6 +558,10 @@ def exclusion_case(dob, student_status, pre_auth, age_max, age_max_student,
                                a student.
         wait_period (boolean): whether or not there is a wait period.
 
+    Keyword Arguments:
+        as_of (date): the date ages are calculated at (see
+                      date_utilities.reference_date).
+
     Returns:
         Boolean - True if the check falls under one of the exclusion cases.
     """
@@ -149,8 +575,8 @@ def exclusion_case(dob, student_status, pre_auth, age_max, age_max_student,
             pd.isnull(wait_period)):
         return True
 
-    # Age calculation - dob expected as 'Full_Month_Name Day# Year_w_Century'
-    age_days = date.today() - datetime.strptime(dob, '%m/%d/%Y').date()
+    # Age calculation - dob expected as 'Month/Day/Year_w_Century'
+    age_days = reference_date(as_of) - parse_date(dob)
     age = round(age_days.days/365.25)
 
     # Student statuses
@@ -179,7 +605,233 @@ def exclusion_case(dob, student_status, pre_auth, age_max, age_max_student,
     return False
 
 
-def train_feature_impute(df):
+# Reasons a check can be excluded, in the order exclusion_case checks them
+EXCLUSION_REASONS = [
+    'MissingValue',
+    'WaitPeriod',
+    'Student',
+    'AgeMax',
+    'PreAuth'
+]
+
+
+@timed('impute.exclusion_flags')
+def exclusion_flags(df, as_of=None, dob=None):
+    """A vectorized version of exclusion_case that also reports which of the
+    exclusion rules each check falls under.
+
+    Args:
+        df (Pandas DataFrame object): the joined data, containing the
+                                      PatientDateOfBirth, StudentStatus,
+                                      IsPreAuthRequired, AgeMax,
+                                      AgeMaxStudent, WaitPeriod,
+                                      LifeTimeMaxValue and
+                                      LifeTimeRemainingValue columns.
+
+    Keyword Arguments:
+        as_of (date): the date ages are calculated at (see
+                      date_utilities.reference_date).
+        dob (Pandas Series object): PatientDateOfBirth already parsed with
+                                    date_utilities.parse_dates. Defaults to
+                                    parsing it here.
+
+    Returns:
+        Pandas DataFrame object - with the same index as df, a boolean
+        'Exclusion' column that matches exclusion_case, and a boolean
+        'Exclusion_<reason>' column for each of EXCLUSION_REASONS. A check
+        flagged 'MissingValue' is not checked against the other rules;
+        otherwise every rule that applies is flagged.
+    """
+    required_columns = [
+        'PatientDateOfBirth',
+        'StudentStatus',
+        'IsPreAuthRequired',
+        'AgeMax',
+        'AgeMaxStudent',
+        'WaitPeriod'
+    ]
+    has_required = df[required_columns].notnull().all(axis=1)
+    missing = (
+        ~has_required |
+        df['LifeTimeMaxValue'].isnull() |
+        df['LifeTimeRemainingValue'].isnull()
+    )
+    valid = ~missing
+
+    # Age calculation - dob expected as 'Month/Day/Year_w_Century'. Like
+    # exclusion_case, only dates of birth of checks with all of the required
+    # values are parsed, and those must be valid dates.
+    if dob is None:
+        dob = parse_dates(df['PatientDateOfBirth'], errors='coerce')
+    dob = dob.where(has_required)
+    unparsed = has_required & dob.isnull()
+    if unparsed.any():
+        raise ValueError(
+            'Invalid PatientDateOfBirth: {!r}'.format(
+                df.loc[unparsed, 'PatientDateOfBirth'].iloc[0]
+            )
+        )
+    age = np.round(age_in_days(dob, as_of=as_of) / 365.25)
+
+    # Student statuses
+    student_statuses = ['PartTime', 'FullTime']
+
+    flags = pd.DataFrame(index=df.index)
+    flags['Exclusion_MissingValue'] = missing
+    flags['Exclusion_WaitPeriod'] = valid & df['WaitPeriod'].where(valid, False).astype(bool)
+    flags['Exclusion_Student'] = (
+        valid &
+        df['StudentStatus'].isin(student_statuses) &
+        (age >= df['AgeMaxStudent'])
+    )
+    flags['Exclusion_AgeMax'] = (
+        valid &
+        (((age >= 18) & (age <= 26)) | (age >= df['AgeMax']))
+    )
+    flags['Exclusion_PreAuth'] = valid & (df['IsPreAuthRequired'] != 0)
+
+    flags.insert(0, 'Exclusion', flags.any(axis=1))
+
+    return flags
+
+
+# How far (in dollars) the lifetime values found in the EDI html may be from
+# the values entered in OF for the check to count as EDI only
+EDI_TOLERANCE = 1
+
+# Columns kept next to the EDI_only target in the cleaned data, showing why a
+# check isn't EDI only (see edi_only_target), for mislabel analysis
+EDI_DIAGNOSTIC_COLUMNS = [
+    'EDI_MaxMismatch',
+    'EDI_RemainingMismatch',
+    'EDI_Excluded'
+]
+
+# Columns of the cleaned data that aren't classifier features
+NON_FEATURE_COLUMNS = [
+    'EDI_only',
+    'Exclusion',
+    'InsurancePolicyPatientEligibilityId'
+] + EDI_DIAGNOSTIC_COLUMNS
+
+
+@timed('impute.edi_only_target')
+def edi_only_target(df, tolerance=EDI_TOLERANCE):
+    """Build the EDI_only target: whether the lifetime max and lifetime
+    remaining values found in the EDI html match the values entered in OF
+    (within the tolerance) for a check that isn't an exclusion case.
+
+    Args:
+        df (Pandas DataFrame object): the data, containing the LifetimeMax,
+                                      LifetimeRemaining, LifeTimeMaxValue,
+                                      LifeTimeRemainingValue and Exclusion
+                                      columns.
+
+    Keyword Arguments:
+        tolerance (float): the largest difference between the OF and html
+                           values that still counts as a match.
+
+    Returns:
+        Pandas DataFrame object - with the same index as df, the integer
+        'EDI_only' target and boolean diagnostic columns showing why a check
+        isn't EDI only: 'EDI_MaxMismatch' and 'EDI_RemainingMismatch' when
+        the values don't match (or either one is missing), and
+        'EDI_Excluded' when the check is an exclusion case.
+    """
+    def within(of_values, html_values):
+        return (
+            (of_values - tolerance <= html_values) &
+            (html_values <= of_values + tolerance)
+        )
+
+    target = pd.DataFrame(index=df.index)
+    target['EDI_MaxMismatch'] = ~within(
+        df['LifetimeMax'], df['LifeTimeMaxValue']
+    )
+    target['EDI_RemainingMismatch'] = ~within(
+        df['LifetimeRemaining'], df['LifeTimeRemainingValue']
+    )
+    target['EDI_Excluded'] = df['Exclusion'].astype(bool)
+
+    target.insert(0, 'EDI_only', (~target.any(axis=1)).astype(int))
+
+    return target
+
+
+@timed('impute.add_derived_columns')
+def add_derived_columns(df, as_of=None):
+    """A function to add the PatientAge and Exclusion columns
+
+    Args:
+        df (Pandas DataFrame object): the MetLife checks, modified in place.
+
+    Keyword Arguments:
+        as_of (date): the date patient ages are calculated at (see
+                      date_utilities.reference_date).
+
+    Returns:
+        None - the dataframe is modified in place.
+    """
+    # Convert PatientDateOfBirth to Patient Age, parsing each date of birth
+    # once for both the age and the exclusion cases
+    dob = parse_dates(df['PatientDateOfBirth'])
+    df['PatientAge'] = np.trunc(age_in_years(dob, as_of=as_of)).astype(int)
+
+    # Check for exclusion cases
+    df['Exclusion'] = exclusion_flags(df, as_of=as_of, dob=dob)['Exclusion']
+
+
+# Columns that are one-hot-encoded rather than converted to binary
+ENCODED_COLUMNS = [
+    'CoordinationOfBenefits',
+    'RelationshipToSubscriber',
+    'StudentStatus',
+    'SubscriberState'
+]
+
+
+@timed('impute.binarize_columns')
+def binarize_columns(df):
+    """A function to encode CoordinationOfBenefits and WaitPeriod and to
+    convert the remaining object columns, except ENCODED_COLUMNS, to binary
+    (whether or not the value is present)
+
+    Args:
+        df (Pandas DataFrame object): the dataframe to be encoded.
+
+    Returns:
+        Pandas DataFrame object - the encoded dataframe
+    """
+
+    # Encode Coordination of Benefits into three categories:
+    # 1: 'one', 2: 'two', and NaN: 'null'
+    # We will have to encode these using one-hot-encoding
+    df['CoordinationOfBenefits'].replace(
+        to_replace=[np.NaN, 1.0, 2.0],
+        value=['null', 'one', 'two'],
+        inplace=True
+    )
+
+    # Replace True/False in WaitPeriod with 1/0
+    df['WaitPeriod'].replace(
+        to_replace=[True, False],
+        value=[1, 0],
+        inplace=True
+    )
+
+    # Convert remaining object columns, except ENCODED_COLUMNS to binary
+    binary_columns = [
+        column
+        for column in sorted(df.columns)
+        if df[column].dtype == 'object' and column
+    ]
+    binary_columns = list(set(binary_columns).difference(ENCODED_COLUMNS))
+    df_binary = df[binary_columns].notnull().astype('uint8')
+    drop_columns(df, binary_columns)
+    return pd.concat([df, df_binary], axis=1)
+
+
+def train_feature_impute(df, as_of=None, tolerance=EDI_TOLERANCE):
     """A function to clean the data and extract features
 
     Args:
@@ -187,9 +839,39 @@ def train_feature_impute(df):
         df (Pandas DataFrame object): the dataframe containing the data to
                                       be cleaned.
 
+    Keyword Arguments:
+        as_of (date): the date patient ages are calculated at (see
+                      date_utilities.reference_date).
+        tolerance (float): the tolerance used to build the EDI_only target
+                           (see edi_only_target).
+
     Returns:
         Pandas DataFrame object - the dataframe containing the extracted data
     """
+    pipeline = FeaturePipeline(tolerance=tolerance)
+    return pipeline.fit_transform(df, as_of=as_of)
+
+
+@timed('impute.clean_training_data')
+def clean_training_data(df, as_of=None, tolerance=EDI_TOLERANCE):
+    """A function to clean the training data and extract every feature
+    except the one-hot-encoded ones
+
+    Args:
+        df (Pandas DataFrame object): the dataframe containing the data to
+                                      be cleaned.
+
+    Keyword Arguments:
+        as_of (date): the date patient ages are calculated at (see
+                      date_utilities.reference_date).
+        tolerance (float): the tolerance used to build the EDI_only target
+                           (see edi_only_target).
+
+    Returns:
+        Pandas DataFrame object - the cleaned data, with the columns still to
+        be one-hot-encoded left as object columns and the EDI_only target's
+        diagnostic columns (see EDI_DIAGNOSTIC_COLUMNS)
+    """
 
     # Filter out everything but MetLife claims
     df = df[df['CarrierName'] == 'MetLife']
@@ -220,48 +902,14 @@ def train_feature_impute(df):
     drop_columns(df, html_col_drop)
 
     # Remove additional columns we know are useless from talks with OF
-    OF_talks_unnec = [
-        'InitialPaymentPercent',
-        'OrthoBenefitUsedLifetime',
-        'PlanPriority',
-        'IsMinMaxDependentsOnly',
-        'IsActive',
-        'IsActive.1',
-        'IsInNetwork',
-        'PracticeOverriddenBenefit',
-        'IsTerminated',
-        'TotalNumberOfAdjustments',
-        'TotalAdjustmentValue',
-        'BenefitPaidToDate',
-        'CurrentEstimatedAr',
-        'OrthoFiCalculatedBenefit',
-        'SubscriberAddress2',
-        'SubscriberMiddleInitial',
-        'SubscriberPhonePrimary',
-        'SubscriberPhoneSecondary',
-        'SubscriberSex',
-        'SubscriberSuffix',
-        'DeductibleOrthoLifetimeMax',
-        'ClaimStatus',
-        'HowManyElecChecks',
-        'AgeLimit'
-    ]
-    drop_columns(df, OF_talks_unnec)
-
-    # Define columns to save based on OF notes
-    saved_columns = [
-        'InsurancePlanPriorityId',
-        'PayerId',
-        'PatientDateOfBirth',
-        'InsurancePolicyPatientEligibilityId'
-    ]
+    drop_columns(df, UNUSED_COLUMNS)
 
     # Drop ID columns.
     # NOTE: we might want to convert these to binary instead
     id_columns = [
         column
         for column in df.columns
-        if column.endswith(('Id', 'Id.1')) and column not in saved_columns
+        if column.endswith(('Id', 'Id.1')) and column not in SAVED_COLUMNS
     ]
     drop_columns(df, id_columns)
 
@@ -273,47 +921,11 @@ def train_feature_impute(df):
     ]
     drop_columns(df, null_columns)
 
-    # Convert PatientDateOfBirth to Patient Age
-    df['PatientAge'] = df['PatientDateOfBirth'].apply(
-        lambda row: int(
-            (date.today() - datetime.strptime(row, '%m/%d/%Y').date()).days / 365.25
-        )
-    )
+    # Add the patient's age and whether the check is an exclusion case
+    add_derived_columns(df, as_of=as_of)
 
-    # Check for exclusion cases
-    df['Exclusion'] = df.apply(
-        lambda row:
-        exclusion_case(
-            row['PatientDateOfBirth'],
-            row['StudentStatus'],
-            row['IsPreAuthRequired'],
-            row['AgeMax'],
-            row['AgeMaxStudent'],
-            row['WaitPeriod'],
-            row['LifeTimeMaxValue'],
-            row['LifeTimeRemainingValue']
-        ),
-        axis=1
-    )
-
-    # All datetime columns
-    datetime_columns = [
-        'CreatedOn',
-        'CreatedOn.1',
-        'EligibilityCheckRequestedOn',
-        'EligibilityEndCheck',
-        'EligibilityStartCheck',
-        'PlanBenefitsEnd',
-        'PlanBenefitsStart',
-        'SubscriberPlanEffectiveDateStart',
-        'SubscriberPlanEffectiveDateEnd',
-        'SubscriberDOB',
-        'UpdatedOn',
-        'UpdatedOn.1',
-    ]
-
-    # Remove any that are in saved_columns
-    datetime_columns = list(set(datetime_columns).difference(saved_columns))
+    # All datetime columns, except any that are in SAVED_COLUMNS
+    datetime_columns = list(set(DATETIME_COLUMNS).difference(SAVED_COLUMNS))
     # Drop datetime columns
     drop_columns(df, datetime_columns)
 
@@ -324,53 +936,14 @@ def train_feature_impute(df):
         (df['LifeTimeRemainingValue'].notnull())
     ]
 
-    # Define columns to be encoded
-    encoded_columns = [
-        'CoordinationOfBenefits',
-        'RelationshipToSubscriber',
-        'StudentStatus',
-        'SubscriberState'
-    ]
+    # Encode CoordinationOfBenefits and WaitPeriod and convert the remaining
+    # object columns to binary
+    df = binarize_columns(df)
 
-    # Encode Coordination of Benefits into three categories:
-    # 1: 'one', 2: 'two', and NaN: 'null'
-    # We will have to encode these using one-hot-encoding
-    df['CoordinationOfBenefits'].replace(
-        to_replace=[np.NaN, 1.0, 2.0],
-        value=['null', 'one', 'two'],
-        inplace=True
-    )
-
-    # Replace True/False in WaitPeriod with 1/0
-    df['WaitPeriod'].replace(
-        to_replace=[True, False],
-        value=[1, 0],
-        inplace=True
-    )
-
-    # Convert remaining object columns, except encoded_columns to binary
-    binary_columns = [
-        column
-        for column in sorted(df.columns)
-        if df[column].dtype == 'object' and column
-    ]
-    binary_columns = list(set(binary_columns).difference(encoded_columns))
-    df_binary = df[binary_columns].notnull().astype('uint8')
-    drop_columns(df, binary_columns)
-    df = pd.concat([df, df_binary], axis=1)
-
-    # Create the target vector
-    df['EDI_only'] = [
-        1
-        if (row['LifetimeMax'] - 1 <= row['LifeTimeMaxValue']
-            and row['LifeTimeMaxValue'] <= row['LifetimeMax'] + 1
-            and row['LifetimeRemaining'] - 1 <= row['LifeTimeRemainingValue']
-            and row['LifeTimeRemainingValue'] <= row['LifetimeRemaining'] + 1
-            and not row['Exclusion'])
-        else
-        0
-        for idx, row in df.iterrows()
-    ]
+    # Create the target vector and its diagnostic columns
+    target = edi_only_target(df, tolerance)
+    for column in target.columns:
+        df[column] = target[column]
 
     # Drop the OF columns used to define the success criteria
     df.drop('LifetimeMax', axis=1, inplace=True)
@@ -379,13 +952,134 @@ def train_feature_impute(df):
     # Replace null values with the median value of the column
     df.fillna(df.median(), inplace=True)
 
-    # Perform one-hot-encoding on remaining object columns
-    df_encoded = pd.get_dummies(df, sparse=False)
+    return df
+
+
+class OneHotEncoder(object):
+    """ One-hot-encode categorical columns against fixed category
+    vocabularies. Each category is mapped straight to the index of its
+    column, so encoding takes one pass per categorical column, and the
+    encoded columns match the training data whatever categories the data
+    being encoded contains. Null and unseen categories are encoded as all 0.
 
-    return df_encoded
+    Keyword Arguments:
+        categories (dict): the categories of each encoded column, in column
+                           order. Set by fit.
+    """
 
+    def __init__(self, categories=None):
+        self.categories = categories
+
+    @property
+    def columns(self):
+        """ The names of the encoded columns, '<column>_<category>' as
+        given by pd.get_dummies.
+        """
+        return [
+            '{}_{}'.format(column, category)
+            for column, categories in self.categories.items()
+            for category in categories
+        ]
+
+    def fit(self, df):
+        """ Learn the categories of the object columns of a dataframe.
+
+        Args:
+            df (Pandas DataFrame object): the data to fit to.
+
+        Returns:
+            OneHotEncoder - the fitted encoder
+        """
+        # Sort by type name first, so columns that mix types (e.g. an
+        # unmapped numeric value among strings) can still be sorted
+        self.categories = {
+            column: sorted(
+                df[column].dropna().unique().tolist(),
+                key=lambda value: (type(value).__name__, value)
+            )
+            for column in df.columns
+            if df[column].dtype == 'object'
+        }
+        return self
+
+    def transform(self, df, sparse=False):
+        """ One-hot-encode the categorical columns of a dataframe. A missing
+        categorical column is encoded as all 0.
+
+        Args:
+            df (Pandas DataFrame object): the data to encode.
+
+        Keyword Arguments:
+            sparse (boolean): return a scipy sparse matrix instead of a numpy
+                              array.
+
+        Returns:
+            A uint8 numpy array, or scipy csr_matrix, with a row for each row
+            of df and a column for each of the encoder's columns
+        """
+        rows = []
+        indices = []
+        offset = 0
+        for column, categories in self.categories.items():
+            if column in df.columns:
+                codes = pd.Categorical(df[column], categories=categories).codes
+                found = np.flatnonzero(codes >= 0)
+                rows.append(found)
+                indices.append(codes[found].astype(np.intp) + offset)
+            offset += len(categories)
+
+        rows = np.concatenate(rows) if rows else np.array([], dtype=np.intp)
+        indices = np.concatenate(indices) if indices else np.array([], dtype=np.intp)
+        shape = (len(df), offset)
+
+        if sparse:
+            return csr_matrix(
+                (np.ones(len(rows), dtype='uint8'), (rows, indices)),
+                shape=shape
+            )
+
+        encoded = np.zeros(shape, dtype='uint8')
+        encoded[rows, indices] = 1
+        return encoded
+
+    @timed('impute.one_hot_encode')
+    def transform_frame(self, df):
+        """ One-hot-encode the categorical columns of a dataframe into a
+        dataframe of uint8 columns (see transform).
+
+        Args:
+            df (Pandas DataFrame object): the data to encode.
+
+        Returns:
+            Pandas DataFrame object - the encoded columns, with the index of df
+        """
+        return pd.DataFrame(
+            self.transform(df), index=df.index, columns=self.columns
+        )
 
-def test_feature_impute(df, train_df):
+    @classmethod
+    def from_columns(cls, columns):
+        """ Recover the encoder that produced one-hot-encoded training
+        columns of ENCODED_COLUMNS, from the column names alone.
+
+        Args:
+            columns (list of str): the columns of the cleaned training data.
+
+        Returns:
+            OneHotEncoder - the encoder
+        """
+        categories = {}
+        for column in columns:
+            for encoded_column in ENCODED_COLUMNS:
+                if column.startswith(encoded_column + '_'):
+                    categories.setdefault(encoded_column, []).append(
+                        column[len(encoded_column) + 1:]
+                    )
+        return cls(categories)
+
+
+def test_feature_impute(df, train_df, as_of=None,
+                        tolerance=EDI_TOLERANCE):
     """ A function to clean the test data and impute based on the training data
 
     Args:
@@ -393,109 +1087,244 @@ def test_feature_impute(df, train_df):
                                       be cleaned.
         train_df (Pandas DataFrame object): the dataframe containing the data
                                             to impute from.
+
+    Keyword Arguments:
+        as_of (date): the date patient ages are calculated at (see
+                      date_utilities.reference_date).
+        tolerance (float): the tolerance used to build the EDI_only target
+                           (see edi_only_target).
     Returns:
         test_df (Pandas DataFrame object): dataframe containing the extracted
                                            test data
-        sanity_df (Pandas DataFrame object): dataframe containing sanity check
-                                             columns (useful for determining
-                                             cause of false positives)
     """
-
-    # Filter out everything but MetLife claims
-    df = df[df['CarrierName'] == 'MetLife']
-
-    # Drop the 'CarrierName' column since we're only looking at MetLife
-    df.drop('CarrierName', axis=1, inplace=True)
-
-    # Convert PatientDateOfBirth to Patient Age
-    df['PatientAge'] = df['PatientDateOfBirth'].apply(
-        lambda row: int(
-            (date.today() - datetime.strptime(row, '%m/%d/%Y').date()).days / 365.25
-        )
-    )
-
-    # Check for exclusion cases
-    df['Exclusion'] = df.apply(
-        lambda row:
-        exclusion_case(
-            row['PatientDateOfBirth'],
-            row['StudentStatus'],
-            row['IsPreAuthRequired'],
-            row['AgeMax'],
-            row['AgeMaxStudent'],
-            row['WaitPeriod'],
-            row['LifeTimeMaxValue'],
-            row['LifeTimeRemainingValue']
-        ),
-        axis=1
+    pipeline = FeaturePipeline(
+        tolerance=tolerance,
+        columns=list(train_df.columns),
+        medians=train_df.median().to_dict(),
+        categories=OneHotEncoder.from_columns(train_df.columns).categories
     )
+    return pipeline.transform(df, as_of=as_of)
+
+
+class FeaturePipeline(object):
+    """ The feature extraction fitted on the training data: the columns of
+    the cleaned training data, their medians and the categories of the
+    one-hot-encoded columns. Once fitted it can be saved alongside the
+    classifier, so test data can be cleaned without loading the training
+    data.
+
+    Keyword Arguments:
+        tolerance (float): the tolerance used to build the EDI_only target
+                           (see edi_only_target).
+        columns (list of str): the columns of the cleaned training data.
+                               Set by fit.
+        medians (dict): the median of each column of the cleaned training
+                        data, used to replace null values. Set by fit.
+        categories (dict): the categories of each one-hot-encoded column
+                           (see OneHotEncoder). Set by fit.
+        input_dtypes (dict): the type of each column of the joined training
+                             data (see coerce_input_types). Set by fit.
+    """
 
-    # Create the target vector
-    df['EDI_only'] = [
-        1
-        if (row['LifetimeMax'] - 1 <= row['LifeTimeMaxValue']
-            and row['LifeTimeMaxValue'] <= row['LifetimeMax'] + 1
-            and row['LifetimeRemaining'] - 1 <= row['LifeTimeRemainingValue']
-            and row['LifeTimeRemainingValue'] <= row['LifetimeRemaining'] + 1
-            and not row['Exclusion'])
-        else
-        0
-        for idx, row in df.iterrows()
-    ]
-
-    # Drop the OF columns used to define the success criteria
-    df.drop('LifetimeMax', axis=1, inplace=True)
-    df.drop('LifetimeRemaining', axis=1, inplace=True)
-
-    # Define columns to be encoded
-    encoded_columns = [
-        'CoordinationOfBenefits',
-        'RelationshipToSubscriber',
-        'StudentStatus',
-        'SubscriberState'
-    ]
-
-    # Encode Coordination of Benefits into three categories:
-    # 1: 'one', 2: 'two', and NaN: 'null'
-    # We will have to encode these using one-hot-encoding
-    df['CoordinationOfBenefits'].replace(
-        to_replace=[np.NaN, 1.0, 2.0],
-        value=['null', 'one', 'two'],
-        inplace=True
-    )
-
-    # Replace True/False in WaitPeriod with 1/0
-    df['WaitPeriod'].replace(
-        to_replace=[True, False],
-        value=[1, 0],
-        inplace=True
-    )
-
-    # Convert remaining object columns, except encoded_columns to binary
-    binary_columns = [
-        column
-        for column in sorted(df.columns)
-        if df[column].dtype == 'object' and column
-    ]
-    binary_columns = list(set(binary_columns).difference(encoded_columns))
-    df_binary = df[binary_columns].notnull().astype('uint8')
-    drop_columns(df, binary_columns)
-    df = pd.concat([df, df_binary], axis=1)
-
-    # Perform one-hot-encoding on remaining object columns
-    df_encoded = pd.get_dummies(df, sparse=False)
-
-    # Setup blank test data dataframe
-    test_df = pd.DataFrame(columns=train_df.columns)
-
-    # Assign all existing data from imported dataframe to test dataframe
-    for column in train_df.columns:
-        if column in df_encoded.columns:
-            test_df[column] = df_encoded[column]
-        else:
-            test_df[column] = 0
-
-    # Replace null values with median of training data
-    test_df.fillna(train_df.median(), inplace=True)
+    def __init__(self, tolerance=EDI_TOLERANCE, columns=None, medians=None,
+                 categories=None, input_dtypes=None):
+        self.tolerance = tolerance
+        self.columns = columns
+        self.medians = medians
+        self.encoder = OneHotEncoder(categories)
+        self.input_dtypes = input_dtypes
+
+    def fit(self, df, as_of=None):
+        """ Fit the pipeline to the joined training data.
+
+        Args:
+            df (Pandas DataFrame object): the joined training data.
+
+        Keyword Arguments:
+            as_of (date): the date patient ages are calculated at (see
+                          date_utilities.reference_date).
+
+        Returns:
+            FeaturePipeline - the fitted pipeline
+        """
+        self.fit_transform(df, as_of=as_of)
+        return self
+
+    @timed('impute')
+    def fit_transform(self, df, as_of=None):
+        """ Fit the pipeline to the joined training data and return the
+        cleaned training data.
+
+        Args:
+            df (Pandas DataFrame object): the joined training data.
+
+        Keyword Arguments:
+            as_of (date): the date patient ages are calculated at (see
+                          date_utilities.reference_date).
+
+        Returns:
+            Pandas DataFrame object - the cleaned training data
+        """
+        self.input_dtypes = {
+            column: str(dtype) for column, dtype in df.dtypes.items()
+        }
+
+        df = clean_training_data(df, as_of=as_of, tolerance=self.tolerance)
+
+        # Perform one-hot-encoding on remaining object columns
+        self.encoder.fit(df)
+        train_df = pd.concat(
+            [
+                df.drop(list(self.encoder.categories), axis=1),
+                self.encoder.transform_frame(df)
+            ],
+            axis=1
+        )
 
-    return test_df
+        self.columns = list(train_df.columns)
+        self.medians = train_df.median().to_dict()
+        return train_df
+
+    @timed('impute')
+    def transform(self, df, as_of=None):
+        """ Clean joined test data into the columns of the training data,
+        replacing null values with the medians of the training data.
+
+        Args:
+            df (Pandas DataFrame object): the joined test data.
+
+        Keyword Arguments:
+            as_of (date): the date patient ages are calculated at (see
+                          date_utilities.reference_date).
+
+        Returns:
+            Pandas DataFrame object - the cleaned test data, with the
+            EDI_only target's diagnostic columns (see EDI_DIAGNOSTIC_COLUMNS)
+        """
+        if self.columns is None:
+            raise ValueError('FeaturePipeline has not been fitted')
+
+        # Filter out everything but MetLife claims
+        df = df[df['CarrierName'] == 'MetLife']
+
+        # Drop the 'CarrierName' column since we're only looking at MetLife
+        df.drop('CarrierName', axis=1, inplace=True)
+
+        # Add the patient's age and whether the check is an exclusion case
+        add_derived_columns(df, as_of=as_of)
+
+        # Create the target vector and its diagnostic columns
+        target = edi_only_target(df, self.tolerance)
+        for column in target.columns:
+            df[column] = target[column]
+
+        # Drop the OF columns used to define the success criteria
+        df.drop('LifetimeMax', axis=1, inplace=True)
+        df.drop('LifetimeRemaining', axis=1, inplace=True)
+
+        # Encode CoordinationOfBenefits and WaitPeriod and convert the
+        # remaining object columns to binary
+        df = binarize_columns(df)
+
+        # Perform one-hot-encoding with the training categories
+        df_encoded = self.encoder.transform_frame(df)
+
+        # Match the training columns, filling in columns that don't occur in
+        # the test data with 0. Pipelines fitted before the diagnostic
+        # columns were kept get them at the end.
+        columns = self.columns + [
+            column
+            for column in EDI_DIAGNOSTIC_COLUMNS
+            if column not in self.columns
+        ]
+        encoded_columns = set(df_encoded.columns)
+        test_df = pd.concat(
+            [
+                df.reindex(
+                    columns=[
+                        column
+                        for column in columns
+                        if column not in encoded_columns
+                    ],
+                    fill_value=0
+                ),
+                df_encoded
+            ],
+            axis=1
+        )[columns]
+
+        # Replace null values with median of training data
+        test_df.fillna(self.medians, inplace=True)
+
+        return test_df
+
+    def coerce_input_types(self, df):
+        """ Convert joined data built from parsed values that haven't been
+        through a csv file (where every HTML value is still text) to the
+        column types of the joined training data, as reading the csv would
+        have. Columns that were text in the training data stay text, so
+        they are converted to binary the same way.
+
+        Args:
+            df (Pandas DataFrame object): the joined data.
+
+        Returns:
+            Pandas DataFrame object - the joined data with converted columns
+        """
+        if self.input_dtypes is None:
+            return df
+
+        booleans = {'True': True, 'False': False, True: True, False: False}
+
+        df = df.copy()
+        for column, dtype in self.input_dtypes.items():
+            if column not in df.columns or str(df[column].dtype) == dtype:
+                continue
+            if dtype == 'bool':
+                values = df[column].map(booleans)
+                df[column] = values.astype(bool) if values.notnull().all() else values
+            elif dtype.startswith(('int', 'uint', 'float')):
+                values = pd.to_numeric(df[column], errors='coerce')
+                if dtype.startswith('float') or values.isnull().any():
+                    df[column] = values.astype('float64')
+                else:
+                    df[column] = values.astype(dtype)
+            elif dtype == 'object':
+                df[column] = df[column].astype(object)
+        return df
+
+    def save(self, filename):
+        """ Save the fitted pipeline to a json file.
+
+        Args:
+            filename (str): the file to write.
+        """
+        with open(filename, 'w') as f:
+            json.dump(
+                {
+                    'tolerance': self.tolerance,
+                    'columns': self.columns,
+                    'medians': {
+                        column: float(median)
+                        for column, median in self.medians.items()
+                    },
+                    'categories': self.encoder.categories,
+                    'input_dtypes': self.input_dtypes
+                },
+                f,
+                indent=1
+            )
+
+    @classmethod
+    def load(cls, filename):
+        """ Load a pipeline saved by save.
+
+        Args:
+            filename (str): the file to read.
+
+        Returns:
+            FeaturePipeline - the fitted pipeline
+        """
+        with open(filename) as f:
+            state = json.load(f)
+        return cls(**state)
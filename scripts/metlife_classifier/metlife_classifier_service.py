@@ -0,0 +1,163 @@
+import json
+import os
+import sys
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+# The EDI parsing and run instrumentation modules live with the EDI parsing
+# scripts
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'edi_parsing')
+)
+from feature_extraction_utilities import FeaturePipeline  # noqa: E402
+from model_artifact_utilities import CompactForest  # noqa: E402
+from scoring_utilities import ID_COLUMNS, MicroBatcher, SQL_FIELDS_KEY, StreamScorer  # noqa: E402
+
+
+EXCLUSIONS = True
+
+HOST = '127.0.0.1'
+PORT = 8080
+# Largest number of requests scored together
+BATCH_SIZE = 64
+# Longest time, in seconds, a request waits for others to join its batch
+MAX_BATCH_WAIT = 0.005
+# Html parsing backend, one of 'bs4', 'lxml' or 'regex'
+# (see mpu.parse_edi_response)
+BACKEND = 'bs4'
+
+# Fields every scoring request must have. The ids may be null.
+REQUIRED_FIELDS = ['HtmlResponse'] + ID_COLUMNS
+
+
+class ScoringHandler(BaseHTTPRequestHandler):
+    """ Score EDI responses from the OF REST API as they come in.
+
+    POST /score takes a JSON record from the OF REST API, with the OF SQL
+    fields of the check under 'SqlFields', or a list of them, and returns
+    the result of StreamScorer.score_requests for each. GET /stats returns
+    the throughput, latency and batch sizes so far.
+    """
+
+    # Keep connections open between requests, so clients don't pay for a
+    # new TCP connection per request
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        # Read the whole body first, so the next request on the connection
+        # starts where it should
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+        except ValueError:
+            self.close_connection = True
+            self._send(400, {'error': 'invalid Content-Length'})
+            return
+        content = self.rfile.read(length)
+
+        if self.path != '/score':
+            self._send(404, {'error': 'not found'})
+            return
+
+        try:
+            body = json.loads(content.decode('utf-8'))
+        except ValueError as e:
+            self._send(400, {'error': 'invalid JSON: {}'.format(e)})
+            return
+
+        requests = body if isinstance(body, list) else [body]
+        if not all(isinstance(request, dict) and
+                   all(field in request for field in REQUIRED_FIELDS)
+                   for request in requests):
+            self._send(400, {
+                'error': 'each record needs {}'.format(', '.join(REQUIRED_FIELDS))
+            })
+            return
+        if not all(isinstance(request.get(SQL_FIELDS_KEY) or {}, dict)
+                   for request in requests):
+            self._send(400, {'error': '{} must be an object'.format(SQL_FIELDS_KEY)})
+            return
+
+        try:
+            futures = [self.server.batcher.submit(request) for request in requests]
+            responses = [future.result() for future in futures]
+        except Exception as e:
+            self._send(500, {'error': repr(e)})
+            return
+
+        self._send(200, responses if isinstance(body, list) else responses[0])
+
+    def do_GET(self):
+        if self.path != '/stats':
+            self._send(404, {'error': 'not found'})
+            return
+        self._send(200, self.server.batcher.summary())
+
+    def log_message(self, format, *args):
+        # Don't log every request
+        pass
+
+    def _send(self, status, content):
+        body = json.dumps(content).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def make_server(scorer, host=HOST, port=PORT, batch_size=BATCH_SIZE,
+                max_wait=MAX_BATCH_WAIT):
+    """ Create the scoring service.
+
+    Args:
+        scorer (StreamScorer): the scorer, with the pipeline and classifier
+                               loaded.
+
+    Keyword Arguments:
+        host (str): the address to listen on.
+        port (int): the port to listen on.
+        batch_size (int): the largest number of requests scored together.
+        max_wait (float): the longest time, in seconds, a request waits for
+                          others to join its batch.
+
+    Returns:
+        ThreadingHTTPServer object - the service, with its MicroBatcher as
+        batcher
+    """
+    server = ThreadingHTTPServer((host, port), ScoringHandler)
+    server.daemon_threads = True
+    server.batcher = MicroBatcher(
+        scorer.score_requests, batch_size=batch_size, max_wait=max_wait
+    )
+    return server
+
+
+if __name__ == '__main__':
+    train_date_range = '20140516_20170331'
+
+    # Feature pipeline fitted on the training data
+    feature_pipeline_file = '../trained_classifiers/ExtraTrees_nf1000_noRounding_' + train_date_range + '_features.json'
+    # Compact, memory-mappable copy of the classifier
+    compact_classifier_dir = '../trained_classifiers/ExtraTrees_nf1000_noRounding_' + train_date_range + '_compact'
+
+    # Load the fitted feature pipeline and the classifier once, up front
+    pipeline = FeaturePipeline.load(feature_pipeline_file)
+    clf = CompactForest.load(compact_classifier_dir)
+
+    scorer = StreamScorer(
+        pipeline,
+        clf,
+        clf.manifest['feature_columns'],
+        None,
+        backend=BACKEND,
+        exclusions=EXCLUSIONS
+    )
+
+    server = make_server(scorer)
+    print('Scoring on http://{}:{}/score'.format(HOST, PORT))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.batcher.close()
+        print(server.batcher.stats)
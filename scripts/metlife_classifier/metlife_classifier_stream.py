@@ -0,0 +1,79 @@
+import os
+import sys
+# The EDI parsing and run instrumentation modules live with the EDI parsing
+# scripts
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'edi_parsing')
+)
+from feature_extraction_utilities import FeaturePipeline  # noqa: E402
+from model_artifact_utilities import CompactForest  # noqa: E402
+from scoring_utilities import SqlLookup, StreamScorer  # noqa: E402
+from edi_stream_utilities import iter_jsonl  # noqa: E402
+import instrumentation_utilities as instruments  # noqa: E402
+
+
+EXCLUSIONS = True
+
+# Number of records scored together
+BATCH_SIZE = 100
+# Html parsing backend, one of 'bs4', 'lxml' or 'regex'
+# (see mpu.parse_edi_response)
+BACKEND = 'bs4'
+# Number of records between progress reports
+REPORT_EVERY = 10000
+
+
+if __name__ == '__main__':
+    train_date_range = '20140516_20170331'
+    test_date_range = '20170401_20170417'
+
+    # Input data files
+    sql_file = '../sql_data/4-18-2017FlatDataV9.csv'
+    # Cleaned EDI responses, one JSON record per line, as written by
+    # metlife_edi_cleaner.py
+    edi_file = '../edi_data/final_data/' \
+               'metlife_cleaned_edi_HTMLOnly_noErrors_' + test_date_range + '.txt'
+
+    # Output data file
+    output_file = '../test_data/output_stream_wExclusions_ExtraTrees_nf1000_noRounding_' + test_date_range + '.csv'
+
+    # Feature pipeline fitted on the training data
+    feature_pipeline_file = '../trained_classifiers/ExtraTrees_nf1000_noRounding_' + train_date_range + '_features.json'
+    # Compact, memory-mappable copy of the classifier
+    compact_classifier_dir = '../trained_classifiers/ExtraTrees_nf1000_noRounding_' + train_date_range + '_compact'
+
+    # Profile the run if asked to by the METLIFE_PROFILE environment variable
+    instruments.start()
+
+    # Load the fitted feature pipeline, the classifier and the SQL data
+    pipeline = FeaturePipeline.load(feature_pipeline_file)
+    clf = CompactForest.load(compact_classifier_dir)
+    lookup = SqlLookup(sql_file)
+    print('Loaded', len(lookup), 'SQL records')
+
+    scorer = StreamScorer(
+        pipeline,
+        clf,
+        clf.manifest['feature_columns'],
+        lookup,
+        batch_size=BATCH_SIZE,
+        backend=BACKEND,
+        exclusions=EXCLUSIONS
+    )
+
+    # Score the records as they are read, writing the results of each batch
+    # as soon as it is scored
+    next_report = REPORT_EVERY
+    with open(edi_file) as f, open(output_file, 'w') as out:
+        header = True
+        for results in scorer.score(iter_jsonl(f)):
+            results.to_csv(out, header=header, index=False)
+            header = False
+
+            if scorer.stats.n_records >= next_report:
+                print(scorer.stats)
+                next_report += REPORT_EVERY
+
+    print(scorer.stats)
+    instruments.count('records.scored', scorer.stats.n_records)
+    instruments.report()
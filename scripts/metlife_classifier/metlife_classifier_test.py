@@ -1,12 +1,39 @@
-import pandas as pd
+import os
+import sys
 import numpy as np
 from sklearn.ensemble import ExtraTreesClassifier
 from sklearn.externals import joblib
-from feature_extraction_utilities import build_set, test_feature_impute
+# The EDI parsing and run instrumentation modules live with the EDI parsing
+# scripts
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'edi_parsing')
+)
+from classifier_utilities import predict_with_exclusions  # noqa: E402
+from model_artifact_utilities import CompactForest  # noqa: E402
+from feature_extraction_utilities import build_set, build_set_chunked, FeaturePipeline, NON_FEATURE_COLUMNS, read_table, write_table  # noqa: E402
+import instrumentation_utilities as instruments  # noqa: E402
 
 
 EXCLUSIONS = True
 
+# Only run the classifier on the checks that aren't excluded, instead of
+# predicting every check and then overwriting the excluded ones with 0. Both
+# give the same results.
+PREFILTER_EXCLUSIONS = True
+
+# Format of the parsed HTML input and of the intermediate data files: 'csv',
+# or 'parquet' / 'feather' to keep column types between stages. The results
+# are always written as csv.
+DATA_FORMAT = 'csv'
+
+# Join the SQL and parsed HTML data a chunk at a time instead of in memory
+# (see build_set_chunked). The joined data is then always written as csv.
+CHUNKED_JOIN = False
+
+# Score with the compact, memory-mapped copy of the classifier instead of
+# unpickling it (see model_artifact_utilities)
+COMPACT_MODEL = True
+
 
 if __name__ == '__main__':
     train_date_range = '20140516_20170331'
@@ -14,63 +41,72 @@ if __name__ == '__main__':
 
     # Input data files
     sql_file = '../sql_data/4-18-2017FlatDataV9.csv'
-    test_html_file = '../edi_data/parsed_data/metlife_' + test_date_range + '.csv'
-    train_file = '../training_data/input_cleaned_ediHTML_ofSQL_noRounding_' + train_date_range + '.csv'
+    test_html_file = '../edi_data/parsed_data/metlife_' + test_date_range + '.' + DATA_FORMAT
 
     # Output data files
-    raw_test_data_file = '../test_data/input_raw_ediHTML_ofSQL_v2' + test_date_range + '.csv'
-    cleaned_test_data_file = '../test_data/input_cleaned_ediHTML_ofSQL_noRounding_' + test_date_range + '.csv'
+    raw_test_data_file = '../test_data/input_raw_ediHTML_ofSQL_v2' + test_date_range + '.' + DATA_FORMAT
+    cleaned_test_data_file = '../test_data/input_cleaned_ediHTML_ofSQL_noRounding_' + test_date_range + '.' + DATA_FORMAT
     output_file = '../test_data/output_wExclusions_ExtraTrees_nf1000_noRounding_' + test_date_range + '.csv'
 
     # Serialized classifier output file
     classifier_file = '../trained_classifiers/ExtraTrees_nf1000_noRounding_' + train_date_range + '.pkl'
+    # Feature pipeline fitted on the training data
+    feature_pipeline_file = '../trained_classifiers/ExtraTrees_nf1000_noRounding_' + train_date_range + '_features.json'
+    # Compact, memory-mappable copy of the classifier
+    compact_classifier_dir = '../trained_classifiers/ExtraTrees_nf1000_noRounding_' + train_date_range + '_compact'
+
+    # Profile the run if asked to by the METLIFE_PROFILE environment variable
+    instruments.start()
 
-    # Create joined dataset
-    test_df = build_set(sql_file, test_html_file)
-    train_df = pd.read_csv(train_file, low_memory=False)
+    # Create joined dataset and save it for sanity check
+    if CHUNKED_JOIN:
+        raw_test_data_file = '../test_data/input_raw_ediHTML_ofSQL_v2' + test_date_range + '.csv'
+        build_set_chunked(sql_file, test_html_file, raw_test_data_file)
+        test_df = read_table(raw_test_data_file, low_memory=False)
+    else:
+        test_df = build_set(sql_file, test_html_file)
+        write_table(test_df, raw_test_data_file)
 
-    # Save joined dataset for sanity check
-    test_df.to_csv(raw_test_data_file, index=False)
+    pipeline = FeaturePipeline.load(feature_pipeline_file)
 
     # Clean features
-    test_df = test_feature_impute(test_df, train_df)
+    test_df = pipeline.transform(test_df)
 
     # Save imputed dataset before dropping columns for use in NtBk
-    test_df.to_csv(cleaned_test_data_file, index=False)
+    write_table(test_df, cleaned_test_data_file)
 
     # Transform the targets into a numpy array
     Y = test_df['EDI_only'].values
-    # Transform input data into numpy ndarray
-    X = test_df[
-        [
-            column
-            for column in test_df.columns
-            if column not in [
-                                'EDI_only',
-                                'Exclusion',
-                                'InsurancePolicyPatientEligibilityId'
-                             ]
-        ]
-    ].values
-
     # Load the classifier
-    clf = joblib.load(classifier_file)
-
-    # Test the classifier
-    predictions = clf.predict(X)
+    with instruments.timer('load_model'):
+        if COMPACT_MODEL:
+            clf = CompactForest.load(compact_classifier_dir)
+            feature_columns = clf.manifest['feature_columns']
+        else:
+            clf = joblib.load(classifier_file)
+            feature_columns = [
+                column
+                for column in test_df.columns
+                if column not in NON_FEATURE_COLUMNS
+            ]
 
     # Save results of classifier into dataframe
     df_results = test_df
-    df_results['Predict'] = predictions
-
-    if EXCLUSIONS:
-        df_results['Predict'] = [
-            0
-            if row['Exclusion']
-            else
-            row['Predict']
-            for idx, row in df_results.iterrows()
-        ]
+    with instruments.timer('predict'):
+        if EXCLUSIONS:
+            # Predict 0 for the checks that fall under an exclusion case
+            df_results['Predict'] = predict_with_exclusions(
+                clf, test_df, feature_columns, prefilter=PREFILTER_EXCLUSIONS
+            )
+        else:
+            # Transform input data into numpy ndarray
+            X = test_df[feature_columns].values
+
+            # Test the classifier
+            df_results['Predict'] = clf.predict(X)
+    instruments.count('records.predicted', len(df_results))
 
     # Save results to file
     df_results.to_csv(output_file, index=False)
+
+    instruments.report()
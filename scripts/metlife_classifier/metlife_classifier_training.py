@@ -1,8 +1,35 @@
+import os
+import sys
 import pandas as pd
 import numpy as np
-from sklearn.ensemble import ExtraTreesClassifier
 from sklearn.externals import joblib
-from feature_extraction_utilities import build_set, train_feature_impute
+# The EDI parsing and run instrumentation modules live with the EDI parsing
+# scripts
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'edi_parsing')
+)
+from classifier_utilities import fit_extra_trees  # noqa: E402
+from model_artifact_utilities import CompactForest  # noqa: E402
+from feature_extraction_utilities import build_set, FeaturePipeline, NON_FEATURE_COLUMNS, write_table  # noqa: E402
+import instrumentation_utilities as instruments  # noqa: E402
+
+
+# Format of the parsed HTML input and of the intermediate data files: 'csv',
+# or 'parquet' / 'feather' to keep column types between stages
+DATA_FORMAT = 'csv'
+
+# Number of trees in the ExtraTrees classifier
+N_ESTIMATORS = 1000
+# Number of cores used to train the classifier (-1 for all cores)
+N_JOBS = 1
+# Random seed, so retraining on the same data gives the same classifier
+RANDOM_STATE = 0
+# Grow the forest this many trees at a time, reporting the out-of-bag score
+# after each stage. Set to None to grow it in one go.
+STAGE_SIZE = None
+# Stop growing the forest once a stage improves the out-of-bag score by less
+# than this. Set to None to always grow N_ESTIMATORS trees.
+MIN_OOB_IMPROVEMENT = None
 
 
 if __name__ == '__main__':
@@ -11,52 +38,72 @@ if __name__ == '__main__':
     # Input data files
 #    sql_file = '../sql_data/Flat_MetLife_wEDI_SQLv9_EmptyCol.csv'
     sql_file = '../sql_data/4-18-2017FlatDataV9.csv'
-    train_html_file = '../edi_data/parsed_data/metlife_' + train_date_range + '.csv'
+    train_html_file = '../edi_data/parsed_data/metlife_' + train_date_range + '.' + DATA_FORMAT
 
     # Output data files
-    raw_training_data_file = '../training_data/input_raw_ediHTML_ofSQL_' + train_date_range + '.csv'
-    cleaned_training_data_file = '../training_data/input_cleaned_ediHTML_ofSQL_noRounding_' + train_date_range + '.csv'
+    raw_training_data_file = '../training_data/input_raw_ediHTML_ofSQL_' + train_date_range + '.' + DATA_FORMAT
+    cleaned_training_data_file = '../training_data/input_cleaned_ediHTML_ofSQL_noRounding_' + train_date_range + '.' + DATA_FORMAT
 
     # Serialized classifier output file
     classifier_file = '../trained_classifiers/ExtraTrees_nf1000_noRounding_' + train_date_range + '.pkl'
+    # Fitted feature pipeline, used to clean test data
+    feature_pipeline_file = '../trained_classifiers/ExtraTrees_nf1000_noRounding_' + train_date_range + '_features.json'
+    # Compact, memory-mappable copy of the classifier
+    compact_classifier_dir = '../trained_classifiers/ExtraTrees_nf1000_noRounding_' + train_date_range + '_compact'
+
+    # Profile the run if asked to by the METLIFE_PROFILE environment variable
+    instruments.start()
 
     # Create joined dataset
     train_df = build_set(sql_file, train_html_file)
 
     # Save joined dataset for sanity check
-    train_df.to_csv(raw_training_data_file, index=False)
+    write_table(train_df, raw_training_data_file)
 
     # Clean features
-    train_df = train_feature_impute(train_df)
+    pipeline = FeaturePipeline()
+    train_df = pipeline.fit_transform(train_df)
+
+    # Save the fitted feature pipeline next to the classifier
+    pipeline.save(feature_pipeline_file)
 
     # Save imputed dataset before dropping columns for use in NtBk
-    train_df.to_csv(cleaned_training_data_file, index=False)
+    write_table(train_df, cleaned_training_data_file)
 
     # Transform the targets into a numpy array
     Y = train_df['EDI_only'].values
     # Transform input data into numpy ndarray
-    X = train_df[
-        [
-            column
-            for column in train_df.columns
-            if column not in [
-                                'EDI_only',
-                                'Exclusion',
-                                'InsurancePolicyPatientEligibilityId'
-                             ]
-        ]
-    ].values
+    feature_columns = [
+        column
+        for column in train_df.columns
+        if column not in NON_FEATURE_COLUMNS
+    ]
+    X = train_df[feature_columns].values
 
     # Train our Random Forest classifier
-    clf = ExtraTreesClassifier(
-        bootstrap=True,
-        n_estimators=1000,
-        max_features=None
-    )
-    clf.fit(X, Y)
+    with instruments.timer('train'):
+        clf, stages = fit_extra_trees(
+            X,
+            Y,
+            n_estimators=N_ESTIMATORS,
+            stage_size=STAGE_SIZE,
+            n_jobs=N_JOBS,
+            random_state=RANDOM_STATE,
+            min_oob_improvement=MIN_OOB_IMPROVEMENT
+        )
+    instruments.count('records.trained', len(Y))
 
     # Save the classifier
     joblib.dump(clf, classifier_file)
+    CompactForest.from_classifier(clf).save(
+        compact_classifier_dir,
+        feature_columns,
+        train_date_range,
+        feature_pipeline_file=os.path.basename(feature_pipeline_file),
+        stages=stages
+    )
+
+    instruments.report()
 
     # Test the classifier
 #    predictions = clf.predict(X)
@@ -0,0 +1,255 @@
+import json
+import os
+from datetime import date
+import numpy as np
+
+
+# Name of the manifest file in a compact model directory
+MANIFEST_FILE = 'manifest.json'
+
+# Arrays making up a compact model, each saved as <name>.npy
+FOREST_ARRAYS = [
+    'roots',
+    'children',
+    'feature',
+    'threshold',
+    'value'
+]
+
+
+class CompactForest(object):
+    """ A trained tree ensemble flattened into a few numpy arrays with compact
+    dtypes, so it can be saved as plain .npy files and memory-mapped when
+    loaded instead of being unpickled. Concurrent scoring processes that load
+    the same model share its pages.
+
+    The nodes of all trees are numbered globally. The children of node i are
+    stored at 2 * i (left) and 2 * i + 1 (right), and leaves point to
+    themselves with an infinite threshold. Thresholds are rounded down to float32, which gives the
+    same splits as scikit-learn since it compares float32 features.
+
+    Args:
+        roots (numpy ndarray): the root node of each tree.
+        children (numpy ndarray): the left and right child of each node.
+        feature (numpy ndarray): the feature each node splits on.
+        threshold (numpy ndarray): the split threshold of each node.
+        value (numpy ndarray): the class probabilities of each node.
+
+    Keyword Arguments:
+        manifest (dict): a description of the model (see save).
+    """
+
+    def __init__(self, roots, children, feature, threshold, value,
+                 manifest=None):
+        self.roots = roots
+        self.children = children
+        self.feature = feature
+        self.threshold = threshold
+        self.value = value
+        self.manifest = manifest or {}
+
+    @classmethod
+    def from_classifier(cls, clf):
+        """ Flatten a trained forest classifier.
+
+        Args:
+            clf (ExtraTreesClassifier): the trained classifier.
+
+        Returns:
+            CompactForest - the flattened classifier
+        """
+        trees = [estimator.tree_ for estimator in clf.estimators_]
+        offsets = np.cumsum([0] + [tree.node_count for tree in trees])
+        if offsets[-1] > np.iinfo(np.int32).max:
+            raise ValueError('Too many nodes for a compact model')
+
+        feature_dtype = np.int16 if clf.n_features_in_ <= np.iinfo(np.int16).max else np.int32
+
+        children = []
+        feature = []
+        threshold = []
+        value = []
+        for tree, offset in zip(trees, offsets):
+            nodes = np.arange(tree.node_count) + offset
+            leaf = tree.children_left == -1
+
+            children.append(np.stack(
+                [
+                    np.where(leaf, nodes, tree.children_left + offset),
+                    np.where(leaf, nodes, tree.children_right + offset)
+                ],
+                axis=1
+            ).ravel())
+            feature.append(np.where(leaf, 0, tree.feature))
+
+            # Round thresholds down, so x <= threshold is unchanged for every
+            # float32 x
+            tree_threshold = tree.threshold.astype(np.float32)
+            rounded_up = tree_threshold > tree.threshold
+            tree_threshold[rounded_up] = np.nextafter(
+                tree_threshold[rounded_up], np.float32(-np.inf)
+            )
+            tree_threshold[leaf] = np.inf
+            threshold.append(tree_threshold)
+
+            tree_value = tree.value[:, 0, :]
+            value.append(tree_value / tree_value.sum(axis=1, keepdims=True))
+
+        forest = cls(
+            roots=offsets[:-1].astype(np.int32),
+            children=np.concatenate(children).astype(np.int32),
+            feature=np.concatenate(feature).astype(feature_dtype),
+            threshold=np.concatenate(threshold),
+            value=np.concatenate(value).astype(np.float32)
+        )
+        forest.manifest = {
+            'classes': clf.classes_.tolist(),
+            'n_features': int(clf.n_features_in_),
+            'n_estimators': len(trees),
+            'n_nodes': int(offsets[-1])
+        }
+        return forest
+
+    @property
+    def classes(self):
+        return np.array(self.manifest['classes'])
+
+    def apply(self, X):
+        """ Find the leaf each row of X ends up in for every tree.
+
+        Args:
+            X (numpy ndarray): the features, one row per sample.
+
+        Returns:
+            numpy ndarray - the global leaf node of each sample (rows) in each
+            tree (columns)
+        """
+        X = np.asarray(X, dtype=np.float32)
+        n_samples, n_features = X.shape
+        n_trees = len(self.roots)
+        X = X.ravel()
+
+        # Walk every (sample, tree) pair down its tree together, dropping the
+        # pairs that have reached a leaf every few steps
+        leaves = np.empty(n_samples * n_trees, dtype=np.int32)
+        pairs = np.arange(n_samples * n_trees)
+        nodes = np.tile(self.roots, n_samples)
+        offsets = np.repeat(np.arange(n_samples) * n_features, n_trees)
+        step = 0
+        while len(pairs):
+            go_right = X[offsets + self.feature[nodes]] > self.threshold[nodes]
+            children = self.children[2 * nodes + go_right]
+            step += 1
+            if step % 3 == 0:
+                moved = children != nodes
+                leaves[pairs[~moved]] = nodes[~moved]
+                pairs = pairs[moved]
+                nodes = children[moved]
+                offsets = offsets[moved]
+            else:
+                nodes = children
+
+        return leaves.reshape(n_samples, n_trees)
+
+    def predict_proba(self, X, batch_size=1000):
+        """ Predict class probabilities, averaged over the trees.
+
+        Args:
+            X (numpy ndarray): the features, one row per sample.
+
+        Keyword Arguments:
+            batch_size (int): the number of samples walked through the trees
+                              at a time, which bounds the memory used.
+
+        Returns:
+            numpy ndarray - the probability of each class (columns) for each
+            sample (rows)
+        """
+        X = np.asarray(X)
+        proba = np.empty((len(X), self.value.shape[1]))
+        for start in range(0, len(X), batch_size):
+            leaves = self.apply(X[start:start + batch_size])
+            proba[start:start + batch_size] = self.value[leaves].mean(
+                axis=1, dtype=np.float64
+            )
+        return proba
+
+    def predict(self, X, batch_size=1000):
+        """ Predict the class of each sample.
+
+        Args:
+            X (numpy ndarray): the features, one row per sample.
+
+        Keyword Arguments:
+            batch_size (int): see predict_proba.
+
+        Returns:
+            numpy ndarray - the predicted class of each sample
+        """
+        return self.classes[np.argmax(self.predict_proba(X, batch_size), axis=1)]
+
+    def save(self, directory, feature_columns, train_date_range, **manifest):
+        """ Save the model as a directory of .npy arrays plus a manifest.
+
+        Args:
+            directory (str): the directory to write. Created if it doesn't
+                             exist.
+            feature_columns (list of str): the names of the features, in the
+                                           order the model expects them.
+            train_date_range (str): the date range of the training data.
+
+        Keyword Arguments:
+            Any other values to record in the manifest.
+        """
+        if len(feature_columns) != self.manifest['n_features']:
+            raise ValueError(
+                'The model has {} features but {} feature columns were '
+                'given'.format(self.manifest['n_features'], len(feature_columns))
+            )
+
+        # Only needed when saving, so loading doesn't pay for importing
+        # scikit-learn
+        from sklearn import __version__ as sklearn_version
+
+        os.makedirs(directory, exist_ok=True)
+        for name in FOREST_ARRAYS:
+            np.save(os.path.join(directory, name + '.npy'), getattr(self, name))
+
+        self.manifest.update(manifest)
+        self.manifest.update({
+            'feature_columns': list(feature_columns),
+            'train_date_range': train_date_range,
+            'created_on': date.today().isoformat(),
+            'sklearn_version': sklearn_version,
+            'arrays': {
+                name: {
+                    'dtype': str(getattr(self, name).dtype),
+                    'shape': list(getattr(self, name).shape)
+                }
+                for name in FOREST_ARRAYS
+            }
+        })
+        with open(os.path.join(directory, MANIFEST_FILE), 'w') as f:
+            json.dump(self.manifest, f, indent=1)
+
+    @classmethod
+    def load(cls, directory, mmap_mode='r'):
+        """ Load a model saved by save.
+
+        Args:
+            directory (str): the model directory.
+
+        Keyword Arguments:
+            mmap_mode (str): how the arrays are memory-mapped (see np.load).
+                             None reads them into memory.
+
+        Returns:
+            CompactForest - the model, with its manifest
+        """
+        with open(os.path.join(directory, MANIFEST_FILE)) as f:
+            manifest = json.load(f)
+        arrays = {
+            name: np.load(os.path.join(directory, name + '.npy'), mmap_mode=mmap_mode)
+            for name in FOREST_ARRAYS
+        }
+        return cls(manifest=manifest, **arrays)
@@ -0,0 +1,453 @@
+import queue
+import random
+import threading
+import time
+from concurrent.futures import Future
+import numpy as np
+import pandas as pd
+import feature_extraction_utilities as feu
+from classifier_utilities import predict_with_exclusions
+# From the EDI parsing scripts, which the entry scripts put on sys.path
+import metlife_parsing_utilities as mpu
+from metlife_edi_html_parser import ParsedRecordBuilder, clean_blanks
+from edi_stream_utilities import is_clean_metlife_response
+from instrumentation_utilities import timer
+
+
+# Number of records scored together
+BATCH_SIZE = 100
+# Number of latencies kept to estimate the latency percentiles
+LATENCY_SAMPLE_SIZE = 10000
+# Longest time, in seconds, a request waits for others to join its batch
+MAX_BATCH_WAIT = 0.005
+# Key of the OF SQL fields in a scoring request
+SQL_FIELDS_KEY = 'SqlFields'
+ID_COLUMNS = [
+    'InsurancePolicyPatientEligibilityId',
+    'InsuranceEligibilityAuditId'
+]
+
+
+class LatencyStats(object):
+    """ Throughput and per-record latency of a stream, using a fixed-size
+    uniform sample of the latencies so memory use doesn't grow with the
+    length of the stream.
+
+    Keyword Arguments:
+        sample_size (int): the number of latencies kept.
+        seed (int): the random seed used to sample latencies.
+    """
+
+    def __init__(self, sample_size=LATENCY_SAMPLE_SIZE, seed=0):
+        self.sample_size = sample_size
+        self.sample = []
+        self.n_records = 0
+        self.start = time.perf_counter()
+        self._random = random.Random(seed)
+
+    def add(self, seconds):
+        """ Record the latency of a record.
+
+        Args:
+            seconds (float): the time from reading the record to scoring it.
+        """
+        self.n_records += 1
+        if len(self.sample) < self.sample_size:
+            self.sample.append(seconds)
+        else:
+            i = self._random.randrange(self.n_records)
+            if i < self.sample_size:
+                self.sample[i] = seconds
+
+    def summary(self):
+        """ Summarize the stream so far.
+
+        Returns:
+            Dictionary of the number of records, elapsed seconds, records
+            per second and the median and 99th percentile latency in
+            milliseconds
+        """
+        seconds = time.perf_counter() - self.start
+        if self.sample:
+            p50, p99 = np.percentile(self.sample, [50, 99]) * 1000
+        else:
+            p50 = p99 = float('nan')
+        return {
+            'n_records': self.n_records,
+            'seconds': seconds,
+            'records_per_second': self.n_records / seconds if seconds else 0.0,
+            'p50_ms': p50,
+            'p99_ms': p99
+        }
+
+    def __str__(self):
+        return (
+            '{n_records} records in {seconds:.1f} seconds '
+            '({records_per_second:.1f} records/s), '
+            'latency p50 {p50_ms:.1f} ms, p99 {p99_ms:.1f} ms'.format(**self.summary())
+        )
+
+
+class SqlLookup(object):
+    """ The columns of the OF SQL data that build_set joins to the parsed
+    EDI HTML data, held in memory and indexed on
+    InsurancePolicyPatientEligibilityId so records can be joined one batch at
+    a time.
+
+    Args:
+        sql_file (str): the filename containing the OF SQL data.
+    """
+
+    key = 'InsurancePolicyPatientEligibilityId'
+
+    def __init__(self, sql_file):
+        html_columns = [
+            column
+            for column in mpu.PARSED_COLUMNS
+            if column not in ('GroupName', 'SubscriberSSN')
+        ]
+        df_query = feu.read_query(
+            sql_file, feu.query_columns(sql_file, html_columns)
+        )
+        self.index = pd.Index(df_query[self.key])
+        self.data = df_query.drop(self.key, axis=1).reset_index(drop=True)
+        self.df_query = None if self.index.is_unique else df_query
+
+    def __len__(self):
+        return len(self.index)
+
+    def join(self, df_html):
+        """ Left join parsed EDI HTML data to the SQL data, as build_set
+        does.
+
+        Args:
+            df_html (Pandas DataFrame object): the prepared HTML data (see
+                                               feu.prepare_html).
+
+        Returns:
+            Pandas DataFrame object - the joined data
+        """
+        if self.df_query is not None:
+            # Some IPPEIDs have several SQL rows, so let pandas repeat the
+            # HTML rows that match them
+            return pd.merge(df_html, self.df_query, on=self.key, how='left')
+
+        positions = self.index.get_indexer(df_html[self.key])
+        df_query = self.data.reindex(positions)
+        df_query.index = df_html.index
+        return pd.concat([df_html, df_query], axis=1).reset_index(drop=True)
+
+
+class StreamScorer(object):
+    """ Score cleaned EDI records as they arrive, in batches: parse the html,
+    join the SQL data, clean the features with the fitted pipeline and
+    predict with the classifier.
+
+    Args:
+        pipeline (feu.FeaturePipeline): the fitted feature pipeline.
+        model: the classifier, with a predict method (e.g. a CompactForest).
+        feature_columns (list of str): the features the model expects.
+        lookup (SqlLookup): the SQL data. Not needed to score requests that
+                            carry their own SQL fields (see score_requests).
+
+    Keyword Arguments:
+        batch_size (int): the number of records scored together.
+        backend (str): the html parsing backend (see mpu.parse_edi_response).
+        as_of (date): the date patient ages are calculated at (see
+                      date_utilities.reference_date).
+        exclusions (boolean): predict 0 for checks that fall under an
+                              exclusion case.
+    """
+
+    def __init__(self, pipeline, model, feature_columns, lookup,
+                 batch_size=BATCH_SIZE, backend='bs4', as_of=None,
+                 exclusions=True):
+        self.pipeline = pipeline
+        self.model = model
+        self.feature_columns = list(feature_columns)
+        self.lookup = lookup
+        self.batch_size = batch_size
+        self.backend = backend
+        self.as_of = as_of
+        self.exclusions = exclusions
+        self.stats = LatencyStats()
+
+    def parse(self, records):
+        """ Parse the html of the MetLife responses in a batch of records.
+
+        Args:
+            records (list of dicts): records from the cleaned EDI data.
+
+        Returns:
+            Pandas DataFrame object - the prepared HTML data (see
+            feu.prepare_html), indexed by the position of each record in
+            records. Records with no payer table or whose payer isn't
+            MetLife are left out.
+        """
+        parsed = ParsedRecordBuilder()
+        positions = []
+        for i, datum in enumerate(records):
+            values, path = mpu.parse_edi_response_path(datum, backend=self.backend)
+            if values is not None and mpu.is_metlife(values):
+                parsed.add(values)
+                positions.append(i)
+
+        df_html = parsed.to_frame()
+        df_html.index = positions
+        clean_blanks(df_html)
+        feu.prepare_html(df_html)
+        return df_html
+
+    def score_joined(self, df_joined):
+        """ Clean joined data with the fitted pipeline and predict.
+
+        Args:
+            df_joined (Pandas DataFrame object): the joined data, with a
+                                                 unique index.
+
+        Returns:
+            Pandas DataFrame object - the Exclusion and Predict of each
+            MetLife check, with the index of df_joined
+        """
+        df_joined = self.pipeline.coerce_input_types(df_joined)
+        feu.reduce_network_values(df_joined)
+        df = self.pipeline.transform(df_joined, as_of=self.as_of)
+
+        results = pd.DataFrame(index=df.index)
+        results['Exclusion'] = df['Exclusion']
+        with timer('predict'):
+            if self.exclusions:
+                # Only run the classifier on the checks that aren't excluded
+                results['Predict'] = predict_with_exclusions(
+                    self.model, df, self.feature_columns
+                )
+            elif len(df):
+                results['Predict'] = self.model.predict(df[self.feature_columns].values)
+            else:
+                results['Predict'] = pd.Series(dtype=int)
+
+        return results
+
+    def score_batch(self, records):
+        """ Score a batch of records.
+
+        Args:
+            records (list of dicts): records from the cleaned EDI data.
+
+        Returns:
+            Pandas DataFrame object - the InsurancePolicyPatientEligibilityId,
+            InsuranceEligibilityAuditId, Exclusion and Predict of each MetLife
+            check in the batch
+        """
+        df_html = self.parse(records)
+        df_html = df_html[df_html[SqlLookup.key].notnull()]
+        if not len(df_html):
+            return pd.DataFrame(columns=ID_COLUMNS + ['Exclusion', 'Predict'])
+
+        # Join the SQL data, then clean the features and predict
+        with timer('build_set'):
+            df_joined = self.lookup.join(df_html)
+        results = self.score_joined(df_joined)
+        return pd.concat(
+            [df_joined.loc[results.index, ID_COLUMNS], results], axis=1
+        )
+
+    def score_requests(self, requests):
+        """ Score a batch of requests that carry their own SQL data instead
+        of looking it up.
+
+        Args:
+            requests (list of dicts): records from the OF REST API, each with
+                                      the OF SQL fields of the check under
+                                      SQL_FIELDS_KEY.
+
+        Returns:
+            List of dicts - for each request, its ids, whether it was scored
+            and either its Exclusion and Predict or the reason it wasn't
+            scored: 'not a MetLife response', 'no SqlFields', 'SqlFields has
+            no CarrierName' or 'CarrierName is not MetLife'
+        """
+        responses = [
+            dict({column: request.get(column) for column in ID_COLUMNS},
+                 Scored=False, Reason='not a MetLife response')
+            for request in requests
+        ]
+
+        # Parse the responses the EDI cleaner would have kept
+        clean = [
+            i for i, request in enumerate(requests)
+            if is_clean_metlife_response(request)
+        ]
+        df_html = self.parse([requests[i] for i in clean])
+        df_html.index = [clean[i] for i in df_html.index]
+        if not len(df_html):
+            return responses
+
+        # Join each response to its own SQL fields, with every column the
+        # pipeline was fitted on
+        df_sql = pd.DataFrame.from_records(
+            [requests[i].get(SQL_FIELDS_KEY) or {} for i in df_html.index],
+            index=df_html.index
+        )
+        df_sql.drop(
+            [column for column in df_sql.columns if column in df_html.columns],
+            axis=1, inplace=True
+        )
+        df_joined = pd.concat([df_html, df_sql], axis=1)
+        if self.pipeline.input_dtypes:
+            df_joined = df_joined.reindex(columns=list(self.pipeline.input_dtypes))
+
+        # The reason a MetLife response is left out by the pipeline, unless
+        # it's scored below
+        for i in df_html.index:
+            sql_fields = requests[i].get(SQL_FIELDS_KEY)
+            if not sql_fields:
+                responses[i]['Reason'] = 'no SqlFields'
+            elif sql_fields.get('CarrierName') is None:
+                responses[i]['Reason'] = 'SqlFields has no CarrierName'
+            else:
+                responses[i]['Reason'] = 'CarrierName is not MetLife'
+
+        results = self.score_joined(df_joined)
+        for i, exclusion, predict in zip(results.index, results['Exclusion'],
+                                         results['Predict']):
+            responses[i].update(
+                Scored=True, Exclusion=bool(exclusion), Predict=int(predict)
+            )
+            del responses[i]['Reason']
+
+        return responses
+
+    def score(self, records):
+        """ Score a stream of records a batch at a time, recording the
+        latency of each record in stats.
+
+        Args:
+            records (iterable of dicts): records from the cleaned EDI data.
+
+        Returns:
+            A generator yielding the results of score_batch for each batch
+        """
+        batch = []
+        arrivals = []
+        for datum in records:
+            arrivals.append(time.perf_counter())
+            batch.append(datum)
+            if len(batch) >= self.batch_size:
+                yield self._score(batch, arrivals)
+                batch = []
+                arrivals = []
+        if batch:
+            yield self._score(batch, arrivals)
+
+    def _score(self, batch, arrivals):
+        results = self.score_batch(batch)
+        done = time.perf_counter()
+        for arrival in arrivals:
+            self.stats.add(done - arrival)
+        return results
+
+
+class MicroBatcher(object):
+    """ Collect items submitted from many threads into small batches and
+    process each batch with a single call, so that concurrent requests share
+    one vectorized prediction.
+
+    A batch is processed as soon as it holds batch_size items or its first
+    item has waited max_wait seconds. If processing a batch raises, its items
+    are processed one at a time, so an exception only reaches the futures of
+    the items that cause it.
+
+    Args:
+        process (function): takes a list of items and returns a list of
+                            results in the same order.
+
+    Keyword Arguments:
+        batch_size (int): the largest number of items processed together.
+        max_wait (float): the longest time, in seconds, an item waits for
+                          others to join its batch.
+    """
+
+    def __init__(self, process, batch_size=BATCH_SIZE, max_wait=MAX_BATCH_WAIT):
+        self.process = process
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.n_items = 0
+        self.n_batches = 0
+        self.stats = LatencyStats()
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, item):
+        """ Add an item to the next batch without waiting for it.
+
+        Args:
+            item: the item to process.
+
+        Returns:
+            concurrent.futures.Future object - the result of processing the
+            item, once its batch has been processed
+        """
+        future = Future()
+        self._queue.put((item, future, time.perf_counter()))
+        return future
+
+    def close(self):
+        """ Process the items already submitted and stop the worker. """
+        self._queue.put(None)
+        self._thread.join()
+
+    def summary(self):
+        """ Summarize the batches so far.
+
+        Returns:
+            Dictionary of the latency summary (see LatencyStats.summary), the
+            number of batches and the mean batch size
+        """
+        summary = self.stats.summary()
+        summary['n_batches'] = self.n_batches
+        summary['mean_batch_size'] = (
+            self.n_items / self.n_batches if self.n_batches else 0.0
+        )
+        return summary
+
+    def _run(self):
+        closed = False
+        while not closed:
+            entry = self._queue.get()
+            if entry is None:
+                break
+            batch = [entry]
+            deadline = time.perf_counter() + self.max_wait
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.perf_counter()
+                try:
+                    entry = self._queue.get(timeout=max(timeout, 0))
+                except queue.Empty:
+                    break
+                if entry is None:
+                    closed = True
+                    break
+                batch.append(entry)
+            self._process(batch)
+
+    def _process(self, batch):
+        try:
+            results = self.process([item for item, future, arrival in batch])
+        except Exception as e:
+            if len(batch) == 1:
+                batch[0][1].set_exception(e)
+                return
+            # Process the items one at a time, so that only the items that
+            # fail get the exception instead of the whole batch
+            for entry in batch:
+                self._process([entry])
+            return
+
+        done = time.perf_counter()
+        self.n_items += len(batch)
+        self.n_batches += 1
+        for (item, future, arrival), result in zip(batch, results):
+            self.stats.add(done - arrival)
+            future.set_result(result)